@@ -33,9 +33,21 @@ class FeedAPI {
     }
   }
 
-  // Get feed posts
-  async getFeed(page = 1) {
-    return this.makeRequest(`/feed/api/feed/?page=${page}`);
+  // Build a query string from the non-empty params
+  buildQuery(params = {}) {
+    const query = new URLSearchParams();
+    Object.entries(params).forEach(([key, value]) => {
+      if (value !== null && value !== undefined && value !== '') {
+        query.append(key, value);
+      }
+    });
+    const qs = query.toString();
+    return qs ? `?${qs}` : '';
+  }
+
+  // Get feed posts; pass pagination.next / pagination.prev from a previous response as the cursor
+  async getFeed(cursor = null) {
+    return this.makeRequest(`/feed/api/feed/${this.buildQuery({ cursor })}`);
   }
 
   // Create a new post
@@ -60,9 +72,54 @@ class FeedAPI {
     });
   }
 
+  // Upload an image in resumable chunks; resolves to an upload_id for createPost
+  async uploadImage(file, onProgress = null, maxRetries = 3) {
+    const session = await this.makeRequest('/feed/api/uploads/', {
+      method: 'POST',
+      body: JSON.stringify({ filename: file.name, size: file.size }),
+    });
+    const endpoint = `/feed/api/uploads/${session.upload_id}/`;
+    let offset = 0;
+    let retries = 0;
+
+    while (offset < file.size) {
+      const chunk = file.slice(offset, offset + session.chunk_size);
+      try {
+        const response = await fetch(`${this.baseUrl}${endpoint}`, {
+          method: 'PUT',
+          credentials: 'include',
+          headers: {
+            'Content-Type': 'application/offset+octet-stream',
+            'Upload-Offset': String(offset),
+          },
+          body: chunk,
+        });
+        const state = await response.json();
+        if (!response.ok && state.offset === undefined) {
+          throw new Error(state.error || `HTTP error! status: ${response.status}`);
+        }
+        // On a conflict the server tells us where to continue from
+        offset = state.offset;
+        retries = 0;
+      } catch (error) {
+        if (++retries > maxRetries) throw error;
+        offset = (await this.makeRequest(endpoint)).offset;
+      }
+      if (onProgress) onProgress(offset / file.size);
+    }
+
+    await this.makeRequest(`${endpoint}finalize/`, { method: 'POST' });
+    return session.upload_id;
+  }
+
   // Get single post
-  async getPost(postId) {
-    return this.makeRequest(`/feed/api/posts/${postId}/`);
+  async getPost(postId, commentsCursor = null) {
+    return this.makeRequest(`/feed/api/posts/${postId}/${this.buildQuery({ comments_cursor: commentsCursor })}`);
+  }
+
+  // Load more replies to a comment
+  async getCommentReplies(commentId, cursor = null) {
+    return this.makeRequest(`/feed/api/comments/${commentId}/replies/${this.buildQuery({ cursor })}`);
   }
 
   // Toggle like on post
@@ -97,26 +154,30 @@ class FeedAPI {
     });
   }
 
+  // Apply many likes/favorites/follows at once: [{ op: 'like', id: 12 }, ...]
+  async bulkEngagement(operations) {
+    return this.makeRequest('/feed/api/engagement/bulk/', {
+      method: 'POST',
+      body: JSON.stringify({ operations }),
+    });
+  }
+
   // Get tag suggestions
   async getTagSuggestions(query = '') {
     return this.makeRequest(`/feed/api/tags/suggestions/?q=${encodeURIComponent(query)}`);
   }
 
-  // Search posts
+  // Search posts; filters may include a cursor from a previous response
   async searchPosts(query, filters = {}) {
-    const params = new URLSearchParams({
-      q: query,
-      ...filters,
-    });
-    return this.makeRequest(`/feed/api/posts/search/?${params}`);
+    return this.makeRequest(`/feed/api/posts/search/${this.buildQuery({ q: query, ...filters })}`);
   }
 
   // Get user posts
-  async getUserPosts(userId = null, page = 1) {
+  async getUserPosts(userId = null, cursor = null) {
     const endpoint = userId 
-      ? `/feed/api/users/${userId}/posts/?page=${page}`
-      : `/feed/api/users/posts/?page=${page}`;
-    return this.makeRequest(endpoint);
+      ? `/feed/api/users/${userId}/posts/`
+      : `/feed/api/users/posts/`;
+    return this.makeRequest(`${endpoint}${this.buildQuery({ cursor })}`);
   }
 }
 
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Post, PostImage, Comment, CommentLike, Like, Favorite, Follow
+from .models import Post, PostImage, Comment, CommentLike, Like, Favorite, Follow, TimelineEntry, Tag, PostTag, FollowSuggestion, UploadSession, MediaBlob
 # Register your models here.
 admin.site.register(Post)
 admin.site.register(PostImage)
@@ -7,4 +7,10 @@ admin.site.register(Comment)
 admin.site.register(CommentLike)
 admin.site.register(Like)
 admin.site.register(Favorite)
-admin.site.register(Follow)
\ No newline at end of file
+admin.site.register(Follow)
+admin.site.register(TimelineEntry)
+admin.site.register(Tag)
+admin.site.register(PostTag)
+admin.site.register(FollowSuggestion)
+admin.site.register(UploadSession)
+admin.site.register(MediaBlob)
@@ -0,0 +1,199 @@
+"""
+Tag autocomplete.
+
+Suggestions come from an in-process prefix index over the Tag table: tag
+names in a sorted array searched with bisect, ranked by how many posts use
+the tag and how recently it was used. The best tags for every prefix of up
+to three characters are precomputed, so even "a" on a 100k-tag vocabulary
+is a dictionary lookup.
+
+Each worker keeps its own copy. The built index is shared as a snapshot
+through the Django cache, so only one worker rebuilds it from the database
+when it expires, in a background thread while the old copy keeps serving.
+New tags are added to the local copy incrementally as posts are created.
+"""
+import heapq
+import math
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from wheryougo import metrics
+from .models import Tag
+from . import tags
+
+SNAPSHOT_KEY = 'feed:tag-index:snapshot'
+SNAPSHOT_TTL = getattr(settings, 'TAG_INDEX_SNAPSHOT_TTL', 300)
+CHECK_INTERVAL = getattr(settings, 'TAG_INDEX_CHECK_INTERVAL', 10)
+TOP_PREFIX_LENGTH = 3
+TOP_SIZE = 20
+RECENCY_HALF_LIFE = 7 * 24 * 3600
+RECENCY_WEIGHT = 2.0
+
+# Used until anyone has tagged a post
+DEFAULT_TAGS = [
+    'travel', 'adventure', 'backpacking', 'solo', 'budget', 'luxury',
+    'beach', 'mountain', 'city', 'nature', 'photography', 'food',
+    'culture', 'history', 'wildlife', 'roadtrip', 'europe', 'asia',
+    'america', 'africa', 'oceania', 'family', 'friends', 'couple',
+    'hiking', 'camping', 'hotel', 'hostel', 'restaurant', 'museum',
+    'sunset', 'sunrise', 'landscape', 'street', 'architecture'
+]
+
+
+def score(post_count, last_used, now):
+    """Popularity on a log scale plus a bonus that halves every week without use"""
+    recency = 0.0
+    if last_used is not None:
+        recency = RECENCY_WEIGHT * 0.5 ** (max(now - last_used, 0) / RECENCY_HALF_LIFE)
+    return math.log1p(post_count) + recency
+
+
+class TagIndex:
+    STATE = ('names', 'counts', 'last_used', 'scores', 'top')
+
+    def __init__(self, entries=(), version=None):
+        """entries: iterable of (name, post_count, last_used_timestamp)"""
+        self.version = version
+        self.lock = threading.Lock()
+        now = time.time()
+        rows = sorted(entries)
+        self.names = [name for name, _, _ in rows]
+        self.counts = {name: count for name, count, _ in rows}
+        self.last_used = {name: last_used for name, _, last_used in rows}
+        self.scores = {name: score(count, last_used, now) for name, count, last_used in rows}
+        # Walk the vocabulary best-first so each prefix list fills up already ranked
+        self.top = {}
+        for name in sorted(self.names, key=self.scores.__getitem__, reverse=True):
+            for length in range(0, min(len(name), TOP_PREFIX_LENGTH) + 1):
+                top = self.top.setdefault(name[:length], [])
+                if len(top) < TOP_SIZE:
+                    top.append(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def state(self):
+        with self.lock:
+            return {attr: getattr(self, attr) for attr in self.STATE}
+
+    @classmethod
+    def from_state(cls, state, version=None):
+        """Restore a built index without re-ranking the vocabulary"""
+        index = cls(version=version)
+        for attr in cls.STATE:
+            setattr(index, attr, state[attr])
+        return index
+
+    def suggest(self, prefix, limit=10):
+        with self.lock:
+            if len(prefix) <= TOP_PREFIX_LENGTH and limit <= TOP_SIZE:
+                return self.top.get(prefix, [])[:limit]
+            start = bisect_left(self.names, prefix)
+            end = bisect_left(self.names, prefix + '\uffff', lo=start)
+            return heapq.nlargest(limit, self.names[start:end], key=self.scores.__getitem__)
+
+    def record(self, names, when=None):
+        """Count one more use of each tag, adding tags the index has not seen"""
+        when = when or time.time()
+        with self.lock:
+            for name in names:
+                if name not in self.counts:
+                    insort(self.names, name)
+                    self.counts[name] = 0
+                self.counts[name] += 1
+                self.last_used[name] = when
+                self.scores[name] = score(self.counts[name], when, when)
+                for length in range(0, min(len(name), TOP_PREFIX_LENGTH) + 1):
+                    top = [n for n in self.top.get(name[:length], []) if n != name]
+                    top.append(name)
+                    self.top[name[:length]] = heapq.nlargest(TOP_SIZE, top, key=self.scores.__getitem__)
+
+
+def build_from_database():
+    rows = Tag.objects.filter(post_count__gt=0).values_list('name', 'post_count', 'last_used_at')
+    return [
+        (name, count, last_used.timestamp() if last_used else None)
+        for name, count, last_used in rows.iterator()
+    ]
+
+
+REBUILD_LOCK_KEY = 'feed:tag-index:rebuilding'
+
+_index = None
+_checked_at = 0.0
+_load_lock = threading.Lock()
+
+
+def publish_snapshot():
+    """Build the index from the database and share it with every worker"""
+    version = time.time_ns()
+    index = TagIndex(build_from_database(), version=version)
+    cache.set(SNAPSHOT_KEY, {'version': version, 'state': index.state()}, SNAPSHOT_TTL)
+    return index
+
+
+def _rebuild_in_background():
+    # Only one worker rebuilds; the others keep serving their current copy
+    if not cache.add(REBUILD_LOCK_KEY, 1, 60):
+        return
+
+    def rebuild():
+        try:
+            publish_snapshot()
+        finally:
+            cache.delete(REBUILD_LOCK_KEY)
+            connection.close()
+
+    threading.Thread(target=rebuild, name='tag-index-rebuild', daemon=True).start()
+
+
+def get_index():
+    """This process's TagIndex, refreshed from the shared snapshot when it changes"""
+    global _index, _checked_at
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < CHECK_INTERVAL:
+        return _index
+
+    with _load_lock:
+        if _index is not None and now - _checked_at < CHECK_INTERVAL:
+            return _index
+        snapshot = cache.get(SNAPSHOT_KEY)
+        metrics.record_cache('tag_index', hits=snapshot is not None, misses=snapshot is None)
+        if snapshot is None:
+            if _index is None:
+                _index = publish_snapshot()
+            else:
+                _rebuild_in_background()
+        elif _index is None or _index.version != snapshot['version']:
+            _index = TagIndex.from_state(snapshot['state'], version=snapshot['version'])
+        _checked_at = now
+    return _index
+
+
+def suggest(query, limit=10):
+    prefix = tags.normalize(query)
+    index = get_index()
+    if not len(index):
+        if not prefix:
+            return DEFAULT_TAGS[:limit]
+        return [tag for tag in DEFAULT_TAGS if tag.startswith(prefix)][:limit]
+    return index.suggest(prefix, limit)
+
+
+def record_tags(names):
+    """Feed newly used tags into this process's index once the post is committed"""
+    index = _index
+    if names and index is not None:
+        transaction.on_commit(lambda: index.record(names))
+
+
+def invalidate():
+    """Drop the shared snapshot so the next lookup rebuilds it from the database"""
+    global _index
+    cache.delete(SNAPSHOT_KEY)
+    _index = None
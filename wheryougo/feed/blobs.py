@@ -0,0 +1,127 @@
+"""
+Reference counts for content-addressed media (see feed.storage).
+
+Every model field that can point at a blob is listed in REFERENCES. When a
+row starts or stops pointing at a blob, MediaBlob.ref_count moves with it.
+Blobs nobody refers to are not deleted straight away, since an upload of the
+same content may be about to claim them: MediaBlob.unreferenced_at records
+when the count last dropped to zero, and collectable() only returns blobs
+that have stayed unreferenced for the grace period.
+"""
+import datetime
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Case, Count, F, When
+from django.utils import timezone
+
+from . import imaging
+from .storage import is_blob
+
+# (app_label.Model, file field)
+REFERENCES = [
+    ('feed.PostImage', 'image'),
+    ('manage.UserProfile', 'pfp'),
+    ('trip.Trip', 'image'),
+]
+GRACE_PERIOD = getattr(settings, 'MEDIA_BLOB_GRACE_PERIOD', 24 * 3600)
+
+
+def reference_fields(model):
+    return [field for label, field in REFERENCES if model is apps.get_model(label)]
+
+
+def retain(name):
+    if is_blob(name):
+        apps.get_model('feed', 'MediaBlob').objects.filter(name=name).update(
+            ref_count=F('ref_count') + 1, unreferenced_at=None
+        )
+
+
+def release(name):
+    if is_blob(name):
+        apps.get_model('feed', 'MediaBlob').objects.filter(name=name, ref_count__gt=0).update(
+            ref_count=F('ref_count') - 1,
+            unreferenced_at=Case(When(ref_count=1, then=timezone.now()), default=F('unreferenced_at'))
+        )
+
+
+def remember(instance, update_fields=None):
+    """
+    Before a save: record the names the row has in the database for the
+    file fields being saved, for saved() to diff against. A new row has
+    none, even when it is built with the name of a blob that already exists.
+    """
+    model = type(instance)
+    fields = [field for field in reference_fields(model) if update_fields is None or field in update_fields]
+    stored = {}
+    if fields and not instance._state.adding:
+        stored = model._base_manager.filter(pk=instance.pk).values(*fields).first() or {}
+    instance._blob_names = {field: stored.get(field) for field in fields}
+
+
+def saved(instance):
+    """After a save: move the references of the fields whose file changed"""
+    for field, before in instance.__dict__.pop('_blob_names', {}).items():
+        name = getattr(instance, field).name
+        if name != before:
+            retain(name)
+            release(before)
+
+
+def deleted(instance):
+    for field in reference_fields(type(instance)):
+        release(getattr(instance, field).name)
+
+
+def references():
+    """{blob name: number of rows pointing at it}, counted from the rows themselves"""
+    counts = {}
+    for label, field in REFERENCES:
+        rows = apps.get_model(label).objects.filter(**{f'{field}__startswith': 'blobs/'}).values(
+            field
+        ).annotate(n=Count('pk')).values_list(field, 'n')
+        for name, n in rows:
+            counts[name] = counts.get(name, 0) + n
+    return counts
+
+
+def recount():
+    """Reset every ref_count from the rows; returns how many were wrong"""
+    MediaBlob = apps.get_model('feed', 'MediaBlob')
+    actual = references()
+    fixed = 0
+    for blob in MediaBlob.objects.only('name', 'ref_count').iterator():
+        count = actual.get(blob.name, 0)
+        if blob.ref_count != count:
+            MediaBlob.objects.filter(pk=blob.pk).update(
+                ref_count=count, unreferenced_at=None if count else timezone.now()
+            )
+            fixed += 1
+    return fixed
+
+
+def collectable():
+    """Blobs unreferenced for longer than the grace period, minus uploads waiting for a post"""
+    pending = apps.get_model('feed', 'UploadSession').objects.filter(
+        status='complete'
+    ).values('stored_name')
+    cutoff = timezone.now() - datetime.timedelta(seconds=GRACE_PERIOD)
+    return apps.get_model('feed', 'MediaBlob').objects.filter(
+        ref_count=0, unreferenced_at__lt=cutoff
+    ).exclude(name__in=pending)
+
+
+def remove(name):
+    """Delete an unreferenced blob file together with its resized variants"""
+    if apps.get_model('feed', 'MediaBlob').objects.filter(name=name, ref_count__gt=0).exists():
+        return False
+    for label in imaging.SIZES:
+        for extension in imaging.FORMATS:
+            variant = imaging.variant_name(name, label, extension)
+            if os.path.exists(default_storage.path(variant)):
+                os.remove(default_storage.path(variant))
+    default_storage.delete(name)
+    return True
@@ -0,0 +1,82 @@
+"""
+Comment threads for the post detail API.
+
+A page of top-level comments is fetched by cursor, then the first few
+replies of every comment on the page come back in a single query (a
+ROW_NUMBER() window per parent), and the viewer's likes for all of them in
+one more. Each comment carries its replies_count, so clients fetch the rest
+of a thread, or deeper levels, from the replies endpoint on demand.
+"""
+from django.db.models import Count, F, OuterRef, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+
+from .models import Comment, CommentLike
+from .pagination import paginate
+
+THREADS_PAGE_SIZE = 20
+REPLIES_PAGE_SIZE = 20
+REPLY_PREVIEW = 3
+ORDERING = ('created_at', 'id')
+
+
+def _with_reply_counts(queryset):
+    replies = Comment.objects.filter(parent=OuterRef('pk')).order_by().values('parent').annotate(
+        n=Count('id')
+    ).values('n')
+    return queryset.select_related('author__userprofile').annotate(
+        replies_total=Coalesce(Subquery(replies), 0)
+    )
+
+
+def _attach_replies(comments, preview=REPLY_PREVIEW):
+    """Set `preloaded_replies` on each comment to its first `preview` replies"""
+    by_parent = {comment.id: comment for comment in comments}
+    for comment in comments:
+        comment.preloaded_replies = []
+    if not by_parent or preview <= 0:
+        return []
+    replies = list(
+        _with_reply_counts(Comment.objects.filter(parent_id__in=by_parent)).annotate(
+            position=Window(
+                RowNumber(), partition_by=F('parent_id'),
+                order_by=[F('created_at').asc(), F('id').asc()]
+            )
+        ).filter(position__lte=preview).order_by('parent_id', 'created_at', 'id')
+    )
+    for reply in replies:
+        reply.preloaded_replies = []
+        by_parent[reply.parent_id].preloaded_replies.append(reply)
+    return replies
+
+
+def liked_by(user, comments):
+    """Ids of the given comments the user has liked"""
+    if user is None or not user.is_authenticated or not comments:
+        return set()
+    return set(CommentLike.objects.filter(
+        user=user, comment_id__in=[comment.id for comment in comments]
+    ).values_list('comment_id', flat=True))
+
+
+def load_threads(post, user=None, cursor=None, page_size=THREADS_PAGE_SIZE):
+    """
+    One page of top-level comments with their first replies.
+    Returns (comments, pagination, liked_comment_ids).
+    """
+    threads, pagination = paginate(
+        _with_reply_counts(Comment.objects.filter(post=post, parent=None)),
+        cursor, ordering=ORDERING, page_size=page_size
+    )
+    replies = _attach_replies(threads)
+    return threads, pagination, liked_by(user, threads + replies)
+
+
+def load_replies(comment, user=None, cursor=None, page_size=REPLIES_PAGE_SIZE):
+    """One page of direct replies to `comment`. Returns (replies, pagination, liked_comment_ids)."""
+    replies, pagination = paginate(
+        _with_reply_counts(Comment.objects.filter(parent=comment)),
+        cursor, ordering=ORDERING, page_size=page_size
+    )
+    for reply in replies:
+        reply.preloaded_replies = []
+    return replies, pagination, liked_by(user, replies)
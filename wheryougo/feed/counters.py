@@ -0,0 +1,76 @@
+"""
+Denormalized engagement counters.
+
+Post.likes_count, Post.favorites_count, Post.comments_count and
+Comment.likes_count are kept in step with their child rows using atomic
+F() updates, so listings read plain columns instead of COUNT joins.
+reconcile() recomputes them in bulk to repair any drift.
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Post, Comment, Like, Favorite, CommentLike
+
+# (child model, owner model, foreign key on the child, counter column on the owner)
+COUNTERS = [
+    (Like, Post, 'post', 'likes_count'),
+    (Favorite, Post, 'post', 'favorites_count'),
+    (Comment, Post, 'post', 'comments_count'),
+    (CommentLike, Comment, 'comment', 'likes_count'),
+]
+
+
+def adjust(owner_model, pk, field, delta):
+    """Atomically add delta to a counter column, never going below zero"""
+    queryset = owner_model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta})
+
+
+def counter_for(child_model):
+    for child, owner, fk, field in COUNTERS:
+        if child is child_model:
+            return owner, fk, field
+    return None
+
+
+def _actual(child_model, fk):
+    return Coalesce(
+        Subquery(
+            child_model.objects.filter(**{fk: OuterRef('pk')}).order_by().values(fk).annotate(
+                n=Count('pk')
+            ).values('n')
+        ),
+        0
+    )
+
+
+def reconcile(batch_size=5000, dry_run=False):
+    """
+    Recompute every counter from its child rows and fix the ones that drifted.
+
+    Works through the owner table in primary-key ranges with one set-based
+    UPDATE per range. Returns {(owner, field): rows_fixed}.
+    """
+    report = {}
+    for child_model, owner_model, fk, field in COUNTERS:
+        key = f'{owner_model.__name__}.{field}'
+        report[key] = 0
+        bounds = owner_model.objects.order_by('pk').values_list('pk', flat=True)
+        first, last = bounds.first(), bounds.last()
+        if first is None:
+            continue
+
+        start = first
+        while start <= last:
+            actual = _actual(child_model, fk)
+            drifted = owner_model.objects.filter(
+                pk__gte=start, pk__lt=start + batch_size
+            ).exclude(**{field: actual})
+            if dry_run:
+                report[key] += drifted.count()
+            else:
+                report[key] += drifted.update(**{field: actual})
+            start += batch_size
+    return report
@@ -0,0 +1,138 @@
+"""
+Resized variants of uploaded images.
+
+After a PostImage, profile picture or trip image is saved, a worker process
+writes thumb/card/full variants in WebP and JPEG next to the original
+(see feed.imaging) and the metadata is stored in the row's variants JSON
+field. Serializers expose the variant URLs, and clients fall back to the
+original while variants are pending.
+
+Workers need the originals on local disk, i.e. MEDIA_ROOT storage.
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import fragments, imaging, response_cache
+
+logger = logging.getLogger(__name__)
+
+WORKERS = getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2)
+# False runs the resizing in the saving thread
+ASYNC = getattr(settings, 'IMAGE_DERIVATIVES_ASYNC', True)
+
+# (app_label.Model, image field, variants field)
+SOURCES = [
+    ('feed.PostImage', 'image', 'variants'),
+    ('manage.UserProfile', 'pfp', 'pfp_variants'),
+    ('trip.Trip', 'image', 'image_variants'),
+]
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: forking a threaded web worker can copy held locks
+            _executor = ProcessPoolExecutor(
+                max_workers=WORKERS, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executor
+
+
+def fields_for(model):
+    for label, image_field, variants_field in SOURCES:
+        if model is apps.get_model(label):
+            return image_field, variants_field
+    raise LookupError(f'{model.__name__} has no image variants')
+
+
+def is_current(instance):
+    image_field, variants_field = fields_for(type(instance))
+    name = getattr(instance, image_field).name
+    return not name or getattr(instance, variants_field).get('source') == name
+
+
+def store(model, pk, metadata):
+    """Save generated metadata unless the image was replaced in the meantime"""
+    image_field, variants_field = fields_for(model)
+    updated = model.objects.filter(pk=pk, **{image_field: metadata['source']}).update(
+        **{variants_field: metadata}
+    )
+    if not updated:
+        return False
+    # update() sends no signals, so expire what the serialized image is cached in
+    if model is apps.get_model('feed.PostImage'):
+        post_id = model.objects.filter(pk=pk).values_list('post_id', flat=True).first()
+        apps.get_model('feed.Post').objects.filter(pk=post_id).update(updated_at=timezone.now())
+        response_cache.invalidate_post(post_id)
+    elif model is apps.get_model('manage.UserProfile'):
+        fragments.invalidate_author(model.objects.filter(pk=pk).values_list('user_id', flat=True).first())
+    return True
+
+
+def generate_now(instance):
+    """Generate variants in this process; returns False if there is no image"""
+    image_field, _ = fields_for(type(instance))
+    name = getattr(instance, image_field).name
+    if not name:
+        return False
+    return store(type(instance), instance.pk, imaging.generate(settings.MEDIA_ROOT, name))
+
+
+def _finished(model, pk, future):
+    try:
+        store(model, pk, future.result())
+    except Exception:
+        # The original is still served; generate_image_derivatives retries
+        logger.exception('Generating variants for %s %s failed', model.__name__, pk)
+    finally:
+        connection.close()
+
+
+def schedule(instance):
+    """Generate variants for `instance` after the current transaction commits"""
+    if is_current(instance):
+        return
+    image_field, variants_field = fields_for(type(instance))
+    model, pk, name = type(instance), instance.pk, getattr(instance, image_field).name
+
+    # Identical uploads share a file, so their variants are already on disk
+    existing = model.objects.filter(**{f'{variants_field}__source': name}).exclude(pk=pk).values_list(
+        variants_field, flat=True
+    ).first()
+    if existing:
+        transaction.on_commit(lambda: store(model, pk, existing))
+        return
+
+    def submit():
+        if not ASYNC:
+            store(model, pk, imaging.generate(settings.MEDIA_ROOT, name))
+            return
+        future = _get_executor().submit(imaging.generate, str(settings.MEDIA_ROOT), name)
+        future.add_done_callback(lambda f: _finished(model, pk, f))
+    transaction.on_commit(submit)
+
+
+def variant_urls(variants, request=None):
+    """{'card': {'width': .., 'height': .., 'webp': url, 'jpeg': url}, ...} for a serializer"""
+    urls = {}
+    for label in imaging.SIZES:
+        variant = variants.get(label)
+        if not variant:
+            continue
+        urls[label] = {'width': variant['width'], 'height': variant['height']}
+        for extension in imaging.FORMATS:
+            url = default_storage.url(variant[extension]['name'])
+            urls[label][extension] = request.build_absolute_uri(url) if request is not None else url
+    return urls
@@ -0,0 +1,293 @@
+"""
+Likes, favorites and comment likes with set/unset semantics.
+
+Each change is one conditional write plus one counter update that returns
+the new value, inside a single transaction:
+
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING   (or DELETE)
+    UPDATE ... SET likes_count = likes_count + 1 RETURNING likes_count
+
+Setting something that is already set (a double click, a retried request)
+inserts nothing and reads the count instead, so the unique constraints are
+never hit and no COUNT(*) runs. The rows are written with SQL, bypassing
+the model signals, so the counters are maintained here.
+
+PUT (set) and DELETE (unset) always take these two statements. A toggle
+(POST) tries the insert first: toggling on takes two statements, toggling
+off three, as the DELETE follows the insert that found the row. Trying
+the DELETE first would only move the third statement to the more common
+toggle-on path.
+
+apply_bulk() does the same for a batch of operations with one set-based
+insert, delete and counter update per kind. The insert and delete return
+the targets they actually changed, and only those move counters or send
+notifications, so a concurrent toggle of the same row cannot make the
+counters drift.
+"""
+from collections import namedtuple
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from notification import notify
+
+from .models import Post, Like, Favorite, CommentLike, Follow
+from . import counters, suggestions, timeline
+
+# kind -> (model, target foreign key, notification type or None)
+KINDS = {
+    'like': (Like, 'post', 'like'),
+    'favorite': (Favorite, 'post', 'favorite'),
+    'comment_like': (CommentLike, 'comment', None),
+}
+# Undoing these also withdraws the notification
+RETRACTED = {'like'}
+
+Result = namedtuple('Result', ['active', 'changed', 'count', 'author_id'])
+
+
+class TargetNotFound(Exception):
+    pass
+
+
+def _tables(kind):
+    model, fk, _ = KINDS[kind]
+    owner, _, field = counters.counter_for(model)
+    return model._meta.db_table, f'{fk}_id', owner._meta.db_table, field
+
+
+def _insert(cursor, kind, user_id, target_id):
+    table, fk_column, owner_table, _ = _tables(kind)
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    # Selecting from the target makes a missing post or comment insert nothing
+    cursor.execute(
+        f'INSERT INTO {table} (user_id, {fk_column}, created_at) '
+        f'SELECT %s, id, %s FROM {owner_table} WHERE id = %s '
+        f'ON CONFLICT DO NOTHING',
+        [user_id, now, target_id]
+    )
+    return cursor.rowcount > 0
+
+
+def _delete(cursor, kind, user_id, target_id):
+    table, fk_column, _, _ = _tables(kind)
+    cursor.execute(f'DELETE FROM {table} WHERE user_id = %s AND {fk_column} = %s', [user_id, target_id])
+    return cursor.rowcount > 0
+
+
+def _count(cursor, kind, target_id, delta):
+    """Apply delta to the target's counter and return (count, author_id)"""
+    _, _, owner_table, field = _tables(kind)
+    if delta > 0:
+        cursor.execute(
+            f'UPDATE {owner_table} SET {field} = {field} + 1 WHERE id = %s RETURNING {field}, author_id',
+            [target_id]
+        )
+    elif delta < 0:
+        cursor.execute(
+            f'UPDATE {owner_table} SET {field} = CASE WHEN {field} > 0 THEN {field} - 1 ELSE 0 END '
+            f'WHERE id = %s RETURNING {field}, author_id',
+            [target_id]
+        )
+    else:
+        cursor.execute(f'SELECT {field}, author_id FROM {owner_table} WHERE id = %s', [target_id])
+    row = cursor.fetchone()
+    if row is None:
+        raise TargetNotFound(f'{kind} target {target_id} does not exist')
+    return row
+
+
+def _notify(kind, user, target_id, author_id, active):
+    notification_type = KINDS[kind][2]
+    if notification_type is None or author_id == user.id:
+        return
+    if active:
+        notify.send(author_id, user, notification_type, post_id=target_id)
+    elif kind in RETRACTED:
+        notify.withdraw(author_id, user, notification_type, post_id=target_id)
+
+
+def apply(kind, user, target_id, active=None):
+    """
+    Set (active=True), unset (active=False) or toggle (active=None) the
+    user's like/favorite/comment like on a target, in two statements (three
+    when a toggle unsets). Raises TargetNotFound.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        if active is None:
+            # Toggle: the insert only succeeds when it was not set yet
+            active = _insert(cursor, kind, user.id, target_id)
+            changed = active or _delete(cursor, kind, user.id, target_id)
+        elif active:
+            changed = _insert(cursor, kind, user.id, target_id)
+        else:
+            changed = _delete(cursor, kind, user.id, target_id)
+
+        delta = (1 if active else -1) if changed else 0
+        count, author_id = _count(cursor, kind, target_id, delta)
+        if changed:
+            _notify(kind, user, target_id, author_id, active)
+    return Result(active, changed, count, author_id)
+
+
+def requested_state(method):
+    """PUT sets, DELETE unsets, anything else toggles"""
+    return {'PUT': True, 'DELETE': False}.get(method)
+
+
+# Batch operations: op -> (kind, state it sets)
+BULK_OPERATIONS = {
+    'like': ('like', True),
+    'unlike': ('like', False),
+    'favorite': ('favorite', True),
+    'unfavorite': ('favorite', False),
+    'follow': ('follow', True),
+    'unfollow': ('follow', False),
+}
+MAX_BULK_OPERATIONS = 500
+
+
+def _parse(user, operations):
+    """Validate operations; returns (results, {(kind, target_id): wanted state})"""
+    results = []
+    wanted = {}
+    for index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        target = operation.get('id') if isinstance(operation, dict) else None
+        result = {'index': index, 'op': op, 'id': target}
+        results.append(result)
+        if op not in BULK_OPERATIONS:
+            result['status'] = 'invalid'
+            result['error'] = 'Unknown op'
+            continue
+        try:
+            result['id'] = target = int(target)
+        except (TypeError, ValueError):
+            result['status'] = 'invalid'
+            result['error'] = 'id must be an integer'
+            continue
+        kind, state = BULK_OPERATIONS[op]
+        if kind == 'follow' and target == user.id:
+            result['status'] = 'invalid'
+            result['error'] = 'You cannot follow yourself'
+            continue
+        # Later operations on the same target win, as if replayed in order
+        wanted[(kind, target)] = state
+    return results, wanted
+
+
+def _insert_many(table, user_column, target_column, user_id, target_ids):
+    """Insert (user, target) rows, skipping existing ones; returns the targets inserted"""
+    if not target_ids:
+        return []
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    values = ', '.join(['(%s, %s, %s)'] * len(target_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({user_column}, {target_column}, created_at) VALUES {values} '
+            f'ON CONFLICT DO NOTHING RETURNING {target_column}',
+            [param for target_id in target_ids for param in (user_id, target_id, now)]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _delete_many(table, user_column, target_column, user_id, target_ids):
+    """Delete (user, target) rows without per-row signals; returns the targets deleted"""
+    if not target_ids:
+        return []
+    placeholders = ', '.join(['%s'] * len(target_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE {user_column} = %s AND {target_column} IN ({placeholders}) '
+            f'RETURNING {target_column}',
+            [user_id, *target_ids]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _apply_post_kind(user, kind, wanted, posts):
+    """Set/unset likes or favorites for many posts; returns {post_id: changed}"""
+    model, _, notification_type = KINDS[kind]
+    _, _, field = counters.counter_for(model)
+    table = model._meta.db_table
+    targets = {post_id: state for (k, post_id), state in wanted.items() if k == kind and post_id in posts}
+    added = _insert_many(table, 'user_id', 'post_id', user.id, [post_id for post_id, state in targets.items() if state])
+    removed = _delete_many(table, 'user_id', 'post_id', user.id, [post_id for post_id, state in targets.items() if not state])
+
+    # The raw writes skip the model signals, so the counters move here
+    if added:
+        Post.objects.filter(id__in=added).update(**{field: F(field) + 1})
+        notify.send_many(user, notification_type, [(posts[post_id], post_id, None) for post_id in added])
+    if removed:
+        Post.objects.filter(id__in=removed, **{f'{field}__gt': 0}).update(**{field: F(field) - 1})
+        if kind in RETRACTED:
+            notify.withdraw_many(user, notification_type, [(posts[post_id], post_id) for post_id in removed])
+    changed = set(added) | set(removed)
+    return {post_id: post_id in changed for post_id in targets}
+
+
+def _apply_follows(user, wanted, users):
+    targets = {user_id: state for (k, user_id), state in wanted.items() if k == 'follow' and user_id in users}
+    table = Follow._meta.db_table
+    added = _insert_many(table, 'follower_id', 'following_id', user.id, [user_id for user_id, state in targets.items() if state])
+    removed = _delete_many(table, 'follower_id', 'following_id', user.id, [user_id for user_id, state in targets.items() if not state])
+
+    # The raw writes skip the Follow signals, so do their work here
+    if added:
+        timeline.backfill_follows(user.id, added)
+    if removed:
+        timeline.prune_follows(user.id, removed)
+    notify.send_many(user, 'follow', [(user_id, None, None) for user_id in added])
+    notify.send_many(user, 'unfollow', [(user_id, None, None) for user_id in removed])
+    if added or removed:
+        suggestions.invalidate(user.id, *added)
+    changed = set(added) | set(removed)
+    return {user_id: user_id in changed for user_id in targets}
+
+
+def apply_bulk(user, operations):
+    """
+    Apply a batch of like/unlike/favorite/unfavorite/follow/unfollow
+    operations in one transaction. Returns one result per operation plus
+    the resulting counts of every post and user touched.
+    """
+    results, wanted = _parse(user, operations)
+    post_ids = {target for (kind, target) in wanted if kind != 'follow'}
+    user_ids = {target for (kind, target) in wanted if kind == 'follow'}
+
+    with transaction.atomic():
+        posts = dict(Post.objects.filter(id__in=post_ids).values_list('id', 'author_id'))
+        users = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        changed = {}
+        for kind in ('like', 'favorite'):
+            changed.update({(kind, post_id): c for post_id, c in _apply_post_kind(user, kind, wanted, posts).items()})
+        changed.update({('follow', user_id): c for user_id, c in _apply_follows(user, wanted, users).items()})
+
+    for result in results:
+        if 'status' in result:
+            continue
+        kind, _ = BULK_OPERATIONS[result['op']]
+        key = (kind, result['id'])
+        if key not in changed:
+            result['status'] = 'not_found'
+            continue
+        result['status'] = 'ok'
+        result['active'] = wanted[key]
+        result['changed'] = changed[key]
+
+    post_counts = {
+        post['id']: {'like_count': post['likes_count'], 'favorite_count': post['favorites_count']}
+        for post in Post.objects.filter(id__in=posts).values('id', 'likes_count', 'favorites_count')
+    }
+    follower_counts = dict(
+        Follow.objects.filter(following_id__in=users).values('following_id').annotate(
+            n=Count('id')
+        ).values_list('following_id', 'n')
+    )
+    return {
+        'results': results,
+        'posts': post_counts,
+        'users': {user_id: {'followers_count': follower_counts.get(user_id, 0)} for user_id in users},
+    }
@@ -0,0 +1,65 @@
+"""
+Cached viewer-independent part of serialized posts.
+
+Everything PostSerializer outputs except the viewer flags and the counters
+is the same for every reader, so it is cached per post under a key made of
+the post id, its updated_at, the author's profile version and
+SCHEMA_VERSION. Editing a post (or its images, which touch updated_at)
+moves it to a new key; so does editing the author's name or picture.
+Bump SCHEMA_VERSION whenever the serialized fields change.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from wheryougo import metrics
+
+SCHEMA_VERSION = 2
+TTL = getattr(settings, 'POST_FRAGMENT_TTL', 3600)
+
+
+def _author_version_key(user_id):
+    return f'feed:author:{user_id}:version'
+
+
+def invalidate_author(user_id):
+    """Retire cached fragments of every post by this user"""
+    key = _author_version_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+class FragmentCache:
+    """Fragments for a batch of posts: one get_many up front, one set_many at the end"""
+
+    def __init__(self, posts, request=None):
+        posts = list(posts)
+        # Image URLs are absolute, so fragments differ per host
+        host = request.get_host() if request is not None else ''
+        versions = cache.get_many({_author_version_key(post.author_id) for post in posts})
+        self.keys = {
+            post.pk: 'feed:post:{}:{}:{}:{}:{}'.format(
+                SCHEMA_VERSION, post.pk, post.updated_at.timestamp(),
+                versions.get(_author_version_key(post.author_id), 1), host
+            )
+            for post in posts
+        }
+        self.cached = cache.get_many(self.keys.values()) if self.keys else {}
+        metrics.record_cache('post_fragments', hits=len(self.cached), misses=len(self.keys) - len(self.cached))
+        self.missed = {}
+
+    def get(self, post):
+        key = self.keys.get(post.pk)
+        return self.cached.get(key) if key is not None else None
+
+    def add(self, post, fragment):
+        key = self.keys.get(post.pk)
+        if key is not None:
+            self.missed[key] = fragment
+
+    def save(self):
+        if self.missed:
+            cache.set_many(self.missed, TTL)
+            self.cached.update(self.missed)
+            self.missed = {}
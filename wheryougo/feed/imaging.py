@@ -0,0 +1,76 @@
+"""
+Resizing and re-encoding of uploaded images.
+
+This module only depends on Pillow so it can run in worker processes
+without setting up Django. Paths are filesystem paths; names in the
+returned metadata are relative to `root`.
+"""
+import os
+
+from PIL import Image, ImageOps
+
+# label -> longest side in pixels
+SIZES = {
+    'thumb': 160,
+    'card': 640,
+    'full': 1600,
+}
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+
+def variant_name(name, label, extension):
+    """'posts/beach.png' -> 'posts/variants/beach_png_card.webp'"""
+    directory, filename = os.path.split(name)
+    # Keep the original extension so beach.png and beach.jpg do not collide
+    stem = filename.replace('.', '_')
+    return os.path.join(directory, 'variants', f'{stem}_{label}.{extension}')
+
+
+def _save(image, path, extension):
+    options = dict(FORMATS[extension])
+    image_format = options.pop('format')
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.tmp'
+    image.save(temporary, image_format, **options)
+    os.replace(temporary, path)
+    return os.path.getsize(path)
+
+
+def generate(root, name):
+    """
+    Write every size/format variant of `root/name` and return their metadata:
+    {'source': name, 'width': ..., 'height': ..., 'card': {'width': ...,
+    'height': ..., 'webp': {'name': ..., 'size': ...}, 'jpeg': {...}}, ...}
+    """
+    with Image.open(os.path.join(root, name)) as original:
+        width, height = original.size
+        # Let JPEG decode at reduced scale when the original is far larger
+        original.draft('RGB', (max(SIZES.values()),) * 2)
+        image = ImageOps.exif_transpose(original)
+        image.load()
+    if image.size[0] < image.size[1] and width > height:
+        width, height = height, width
+
+    metadata = {'source': name, 'width': width, 'height': height}
+    # Largest first so each size is scaled down from the previous one
+    for label, longest in sorted(SIZES.items(), key=lambda item: -item[1]):
+        if max(image.size) > longest:
+            image = image.copy()
+            image.thumbnail((longest, longest), Image.LANCZOS)
+        variant = {'width': image.width, 'height': image.height}
+        for extension in FORMATS:
+            variant_path = variant_name(name, label, extension)
+            size = _save(image, os.path.join(root, variant_path), extension)
+            variant[extension] = {'name': variant_path.replace(os.sep, '/'), 'size': size}
+        metadata[label] = variant
+    return metadata
@@ -0,0 +1,29 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from feed import uploads
+
+
+class Command(BaseCommand):
+    help = "Delete upload sessions that were never attached to a post, with their files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report what would be deleted")
+
+    def handle(self, *args, **options):
+        removed = 0
+        for session in uploads.expired().iterator():
+            if not options['dry_run']:
+                partial = uploads.partial_path(session)
+                if os.path.exists(partial):
+                    os.remove(partial)
+                if session.stored_name:
+                    default_storage.delete(session.stored_name)
+                session.delete()
+            removed += 1
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {removed} expired upload sessions"))
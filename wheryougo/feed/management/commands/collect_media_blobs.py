@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from feed import blobs
+
+
+class Command(BaseCommand):
+    help = "Delete stored media that no row has referred to for the grace period"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recount', action='store_true',
+                            help="Recompute reference counts from the rows first")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report what would be deleted")
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            fixed = blobs.recount()
+            self.stdout.write(f"Corrected {fixed} reference counts")
+
+        removed = 0
+        freed = 0
+        for blob in blobs.collectable().iterator():
+            if options['dry_run'] or blobs.remove(blob.name):
+                removed += 1
+                freed += blob.size
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {removed} unreferenced blobs ({freed / (1024 * 1024):.1f}MB)"
+        ))
@@ -0,0 +1,34 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from feed import derivatives
+
+
+class Command(BaseCommand):
+    help = "Generate resized variants for uploaded images that do not have them yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', dest='models', default=[],
+                            help="Only this model, e.g. feed.PostImage (repeatable)")
+        parser.add_argument('--force', action='store_true',
+                            help="Regenerate variants that are already up to date")
+
+    def handle(self, *args, **options):
+        sources = [
+            source for source in derivatives.SOURCES
+            if not options['models'] or source[0] in options['models']
+        ]
+        for label, image_field, _ in sources:
+            model = apps.get_model(label)
+            generated = failed = 0
+            queryset = model.objects.exclude(**{image_field: ''}).exclude(**{f'{image_field}__isnull': True})
+            for instance in queryset.order_by('pk').iterator():
+                if not options['force'] and derivatives.is_current(instance):
+                    continue
+                try:
+                    derivatives.generate_now(instance)
+                    generated += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{label} {instance.pk}: {e}")
+            self.stdout.write(self.style.SUCCESS(f"{label}: generated {generated}, failed {failed}"))
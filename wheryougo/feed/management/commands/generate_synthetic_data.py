@@ -0,0 +1,273 @@
+import bisect
+import datetime
+import itertools
+import random
+from contextlib import contextmanager
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from feed import autocomplete, counters
+from feed.models import Post, Like, Favorite, Follow, Comment, Tag, PostTag
+from manage.models import UserProfile
+from notification import unread
+from notification.models import Notification
+from trip.models import Trip
+
+USERNAME_PREFIX = 'synth_'
+PASSWORD = 'synthetic'
+PLACES = [
+    'Bali', 'Kyoto', 'Lisbon', 'Cusco', 'Reykjavik', 'Hanoi', 'Cape Town', 'Queenstown',
+    'Marrakesh', 'Istanbul', 'Oaxaca', 'Tbilisi', 'Leh', 'Hampi', 'Darjeeling', 'Patagonia',
+]
+TAGS = [
+    'beach', 'mountains', 'road trip', 'backpacking', 'food', 'budget', 'solo', 'hiking',
+    'camping', 'culture', 'photography', 'islands', 'trekking', 'wildlife', 'city', 'festival',
+    'monsoon', 'desert', 'snow', 'vanlife', 'temples', 'street food', 'surfing', 'diving',
+]
+WORDS = (
+    'sunrise trail hostel train market sunset valley river lake ferry local guide views '
+    'cafe museum old town bus night walk rain camp peak village coast itinerary tips'
+).split()
+
+
+class PowerLaw:
+    """Picks indexes 0..n-1 with probability proportional to 1 / (rank + 1) ** alpha"""
+
+    def __init__(self, n, alpha, rng):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1 / (rank + 1) ** alpha for rank in range(n)))
+
+    def pick(self):
+        return bisect.bisect(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Let bulk_create keep the spread-out created_at values instead of auto_now(_add)"""
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic users, posts, likes, follows, comments, notifications and trips "
+        "with power-law popularity, for load tests"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--likes', type=int, default=200000)
+        parser.add_argument('--favorites', type=int, default=40000)
+        parser.add_argument('--follows', type=int, default=40000)
+        parser.add_argument('--comments', type=int, default=40000)
+        parser.add_argument('--notifications', type=int, default=100000)
+        parser.add_argument('--trips', type=int, default=2000)
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help="Multiply every volume, e.g. 50 for millions of rows")
+        parser.add_argument('--alpha', type=float, default=1.1,
+                            help="Power-law exponent for follower counts and post popularity")
+        parser.add_argument('--days', type=int, default=365,
+                            help="Spread creation times over this many days")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.alpha = options['alpha']
+        self.now = timezone.now()
+        self.span = options['days'] * 86400
+        volume = {
+            name: max(int(options[name] * options['scale']), 0)
+            for name in ('users', 'posts', 'likes', 'favorites', 'follows', 'comments', 'notifications', 'trips')
+        }
+        volume['users'] = max(volume['users'], 2)
+
+        with explicit_timestamps(Post, Like, Favorite, Follow, Comment, Notification, Trip, UserProfile):
+            user_ids = self.create_users(volume['users'])
+            posts = self.create_posts(user_ids, volume['posts'])
+            self.create_pairs(Follow, 'follower_id', 'following_id', user_ids, user_ids, volume['follows'])
+            if posts:
+                post_ids = [post_id for post_id, _ in posts]
+                self.create_pairs(Like, 'user_id', 'post_id', user_ids, post_ids, volume['likes'])
+                self.create_pairs(Favorite, 'user_id', 'post_id', user_ids, post_ids, volume['favorites'])
+                self.create_comments(user_ids, posts, volume['comments'])
+                self.create_notifications(user_ids, posts, volume['notifications'])
+            self.create_trips(user_ids, volume['trips'])
+
+        self.stdout.write("Updating counters, tags and timelines...")
+        counters.reconcile()
+        Tag.objects.filter(name__in=TAGS).update(post_count=Coalesce(Subquery(
+            PostTag.objects.filter(tag=OuterRef('pk')).order_by().values('tag').annotate(n=Count('pk')).values('n')
+        ), 0), last_used_at=self.now)
+        autocomplete.invalidate()
+        unread.recount()
+        call_command('rebuild_timelines', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            "Generated " + ', '.join(f"{n} {name}" for name, n in volume.items())
+        ))
+
+    def timestamp(self):
+        # Skewed towards recent activity
+        return self.now - datetime.timedelta(seconds=self.span * self.rng.random() ** 2)
+
+    def batches(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def bulk(self, model, rows, **kwargs):
+        created = []
+        for batch in self.batches(rows):
+            with transaction.atomic():
+                created.extend(model.objects.bulk_create(batch, **kwargs))
+        self.stdout.write(f"  {model.__name__}: {len(created)}")
+        return created
+
+    def create_users(self, n):
+        start = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+        password = make_password(PASSWORD)
+        users = self.bulk(User, (
+            User(username=f'{USERNAME_PREFIX}{start + i}', password=password, first_name=f'Traveler {start + i}')
+            for i in range(n)
+        ))
+        self.bulk(UserProfile, (
+            UserProfile(
+                user=user, name=user.first_name, location=self.rng.choice(PLACES),
+                user_type=self.rng.choice(['traveler', 'vlogger', 'explorer', 'wanderer']),
+                created_at=self.timestamp()
+            )
+            for user in users
+        ))
+        # PowerLaw ranks follow list order: the first synthetic users become the celebrities
+        return [user.pk for user in users]
+
+    def create_posts(self, user_ids, n):
+        authors = PowerLaw(len(user_ids), self.alpha, self.rng)
+        Tag.objects.bulk_create([Tag(name=name) for name in TAGS], ignore_conflicts=True)
+        tags = dict(Tag.objects.filter(name__in=TAGS).values_list('name', 'pk'))
+
+        def rows():
+            for _ in range(n):
+                place = self.rng.choice(PLACES)
+                created_at = self.timestamp()
+                post_tags = self.rng.sample(TAGS, self.rng.randint(0, 4))
+                yield Post(
+                    author_id=user_ids[authors.pick()],
+                    post_type=self.rng.choice(['travel', 'photo', 'tip', 'review', 'itinerary']),
+                    title=f"{' '.join(self.rng.sample(WORDS, 3)).capitalize()} in {place}",
+                    content=' '.join(self.rng.choices(WORDS, k=self.rng.randint(10, 80))),
+                    location=place,
+                    categories=self.rng.choice(['story', 'photo', 'tip', 'story,photo']),
+                    tags=','.join(post_tags),
+                    is_private=self.rng.random() < 0.05,
+                    created_at=created_at,
+                    updated_at=created_at,
+                )
+
+        posts = self.bulk(Post, rows())
+        self.bulk(PostTag, (
+            PostTag(post_id=post.pk, tag_id=tags[name], position=position)
+            for post in posts for position, name in enumerate(post.tags.split(',')) if name
+        ), ignore_conflicts=True)
+        # Newest posts first: recent posts are the hot ones
+        posts.sort(key=lambda post: post.created_at, reverse=True)
+        return [(post.pk, post.author_id) for post in posts]
+
+    def create_pairs(self, model, source_field, target_field, source_ids, target_ids, n):
+        """n unique (source, target) rows, targets drawn by popularity"""
+        targets = PowerLaw(len(target_ids), self.alpha, self.rng)
+        seen = set()
+        attempts = 0
+
+        def rows():
+            nonlocal attempts
+            while len(seen) < n and attempts < n * 5:
+                attempts += 1
+                pair = (self.rng.choice(source_ids), target_ids[targets.pick()])
+                if pair in seen or (model is Follow and pair[0] == pair[1]):
+                    continue
+                seen.add(pair)
+                yield model(**{source_field: pair[0], target_field: pair[1], 'created_at': self.timestamp()})
+
+        self.bulk(model, rows(), ignore_conflicts=True)
+
+    def create_comments(self, user_ids, posts, n):
+        hot = PowerLaw(len(posts), self.alpha, self.rng)
+        top_level = self.bulk(Comment, (
+            Comment(
+                post_id=posts[hot.pick()][0], author_id=self.rng.choice(user_ids),
+                content=' '.join(self.rng.choices(WORDS, k=self.rng.randint(3, 25))),
+                created_at=self.timestamp(), updated_at=self.now
+            )
+            for _ in range(int(n * 0.7))
+        ))
+        if top_level:
+            self.bulk(Comment, (
+                Comment(
+                    post_id=parent.post_id, parent_id=parent.pk, author_id=self.rng.choice(user_ids),
+                    content=' '.join(self.rng.choices(WORDS, k=self.rng.randint(3, 15))),
+                    created_at=parent.created_at + datetime.timedelta(minutes=self.rng.randint(1, 600)),
+                    updated_at=self.now
+                )
+                for parent in (self.rng.choice(top_level) for _ in range(n - int(n * 0.7)))
+            ))
+
+    def create_notifications(self, user_ids, posts, n):
+        hot = PowerLaw(len(posts), self.alpha, self.rng)
+
+        def rows():
+            for _ in range(n):
+                notification_type = self.rng.choices(['like', 'comment', 'favorite', 'follow'], [6, 2, 1, 1])[0]
+                post_id, author_id = posts[hot.pick()]
+                actors = self.rng.sample(user_ids, min(3, len(user_ids)))
+                yield Notification(
+                    to_user_id=author_id, from_user_id=actors[0], notification_type=notification_type,
+                    post_id=None if notification_type == 'follow' else post_id,
+                    actor_count=max(int(self.rng.paretovariate(self.alpha)), len(actors)),
+                    recent_actors=actors, is_seen=self.rng.random() < 0.8, created_at=self.timestamp()
+                )
+
+        self.bulk(Notification, rows())
+
+    def create_trips(self, user_ids, n):
+        def rows():
+            for _ in range(n):
+                created_at = self.timestamp()
+                start = (created_at + datetime.timedelta(days=self.rng.randint(-30, 120))).date()
+                yield Trip(
+                    name=f"{self.rng.choice(PLACES)} trip"[:50], created_by_id=self.rng.choice(user_ids),
+                    created_at=created_at, start_date=start,
+                    end_date=start + datetime.timedelta(days=self.rng.randint(1, 21)),
+                    status=self.rng.choice(['planned', 'ongoing', 'completed']),
+                )
+
+        trips = self.bulk(Trip, rows())
+        Member = Trip.members.through
+        self.bulk(Member, (
+            Member(trip_id=trip.pk, user_id=user_id)
+            for trip in trips for user_id in {trip.created_by_id, *self.rng.sample(user_ids, min(3, len(user_ids)))}
+        ), ignore_conflicts=True)
@@ -0,0 +1,56 @@
+import os
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import storages
+from django.core.management.base import BaseCommand, CommandError
+
+from feed import blobs
+from feed.storage import ContentAddressedStorage
+
+
+class Command(BaseCommand):
+    help = "Move files uploaded before content-addressed storage into deduplicated blobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many files would move")
+        parser.add_argument('--keep-originals', action='store_true',
+                            help="Leave the old files in place after copying them")
+
+    def handle(self, *args, **options):
+        storage = storages['default']
+        if not isinstance(storage, ContentAddressedStorage):
+            raise CommandError("The default storage is not feed.storage.ContentAddressedStorage")
+
+        moved = missing = 0
+        originals = set()
+        for label, field in blobs.REFERENCES:
+            model = apps.get_model(label)
+            rows = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True}).exclude(
+                **{f'{field}__startswith': 'blobs/'}
+            ).values_list('pk', field)
+            for pk, name in rows.iterator():
+                path = storage.path(name)
+                if not os.path.exists(path):
+                    missing += 1
+                    self.stderr.write(f"{label} {pk}: {name} is missing")
+                    continue
+                moved += 1
+                if options['dry_run']:
+                    continue
+                with open(path, 'rb') as f:
+                    blob = storage.save(name, File(f, name=name))
+                # update() skips the save signals, so count the reference here
+                model.objects.filter(pk=pk).update(**{field: blob})
+                blobs.retain(blob)
+                originals.add(path)
+
+        if not options['keep_originals']:
+            for path in originals:
+                os.remove(path)
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {moved} files into blobs ({missing} missing)"))
+        if moved and not options['dry_run']:
+            self.stdout.write("Run generate_image_derivatives to create variants for the new names")
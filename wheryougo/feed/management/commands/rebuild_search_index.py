@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from feed.search import ensure_search_index
+
+
+class Command(BaseCommand):
+    help = "Recreate the post full-text index and its triggers, then reindex every post"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        if ensure_search_index(options['database'], rebuild=True):
+            self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
+        else:
+            self.stdout.write("Full-text index is only used on SQLite; nothing to do")
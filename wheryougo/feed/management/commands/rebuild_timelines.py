@@ -0,0 +1,36 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from feed.models import TimelineEntry
+from feed.timeline import rebuild_timeline
+
+
+class Command(BaseCommand):
+    help = "Rebuild materialized home timelines from Follow and Post rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', default=[],
+                            help="Only rebuild this user's timeline (repeatable)")
+        parser.add_argument('--limit', type=int, default=None,
+                            help="Keep at most this many entries per timeline")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+            missing = set(options['usernames']) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+        else:
+            # Full rebuild: drop everything up front instead of user by user
+            TimelineEntry.objects.all().delete()
+
+        total_users = 0
+        total_entries = 0
+        for user_id in users.values_list('id', flat=True).iterator():
+            total_entries += rebuild_timeline(user_id, limit=options['limit'])
+            total_users += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {total_users} timelines with {total_entries} entries"
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from feed.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = "Detect and repair drift in the denormalized like/favorite/comment counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many rows have drifted")
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Primary-key range handled per UPDATE")
+
+    def handle(self, *args, **options):
+        report = reconcile(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        verb = 'drifted' if options['dry_run'] else 'repaired'
+        for counter, rows in report.items():
+            self.stdout.write(f"{counter}: {rows} {verb}")
+        self.stdout.write(self.style.SUCCESS(f"{sum(report.values())} counters {verb}"))
@@ -0,0 +1,38 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+from feed import suggestions
+
+
+class Command(BaseCommand):
+    help = "Recompute stored who-to-follow suggestions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', default=[],
+                            help="Only refresh this user's suggestions (repeatable)")
+        parser.add_argument('--stale-only', action='store_true',
+                            help="Skip users whose suggestions are still fresh")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+            missing = set(options['usernames']) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+
+        # Recompute popularity once for the whole run
+        cache.delete(suggestions.POPULAR_KEY)
+
+        total_users = 0
+        total_rows = 0
+        for user_id in users.values_list('id', flat=True).iterator():
+            if options['stale_only'] and suggestions.is_fresh(user_id):
+                continue
+            total_rows += len(suggestions.compute(user_id))
+            total_users += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Refreshed suggestions for {total_users} users ({total_rows} rows)"
+        ))
@@ -0,0 +1,216 @@
+import base64
+import json
+import logging
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from feed.management.commands.generate_synthetic_data import USERNAME_PREFIX, PASSWORD, TAGS, WORDS, PowerLaw
+from feed.models import Post
+from notification import dispatch
+
+# Share of requests per endpoint
+SCENARIOS = {
+    'api_feed': 40,
+    'api_get_post': 25,
+    'api_search_posts': 15,
+    'api_toggle_like': 10,
+    'api_toggle_favorite': 10,
+}
+HOT_POSTS = 5000
+LOGGED_IN_USERS = 200
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(int(round(p / 100 * len(ordered))) - 1, 0))]
+
+
+def summarize(latencies, errors, elapsed):
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'throughput_rps': round(len(ordered) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(sum(ordered) / len(ordered), 2) if ordered else None,
+        'p50_ms': percentile(ordered, 50),
+        'p95_ms': percentile(ordered, 95),
+        'p99_ms': percentile(ordered, 99),
+        'max_ms': ordered[-1] if ordered else None,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the feed, post, search and toggle API endpoints with concurrent synthetic users "
+        "and report p50/p95/p99 latency and throughput as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=30, help="Seconds to run after warm-up")
+        parser.add_argument('--warmup', type=float, default=3, help="Seconds of untimed requests first")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--url', default=None,
+                            help="Base URL of a running server, e.g. http://127.0.0.1:8000; "
+                                 "default is in-process through the test client")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', default=None, help="Write the JSON report to this file")
+        parser.add_argument('--compare', default=None, help="Baseline JSON report to compare against")
+
+    def handle(self, *args, **options):
+        users = list(
+            User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('?')[:LOGGED_IN_USERS]
+        )
+        post_ids = list(
+            Post.objects.filter(is_private=False).order_by('-created_at', '-id').values_list('id', flat=True)[:HOT_POSTS]
+        )
+        if not users or not post_ids:
+            raise CommandError("No synthetic data; run generate_synthetic_data first")
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        self.base_url = options['url'].rstrip('/') if options['url'] else None
+        self.urls = {
+            'api_feed': reverse('api_feed'),
+            'api_search_posts': reverse('api_search_posts'),
+        }
+        self.post_ids = post_ids
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+        self.recording = False
+        self.stop = threading.Event()
+
+        # Per-request SQL logging would dominate what is being measured
+        sql_logger = logging.getLogger('wheryougo.sql')
+        sql_logger_disabled, sql_logger.disabled = sql_logger.disabled, True
+        rng = random.Random(options['seed'])
+        workers = [
+            threading.Thread(target=self.worker, args=(users[i % len(users)], random.Random(rng.random())))
+            for i in range(options['concurrency'])
+        ]
+        try:
+            for worker in workers:
+                worker.start()
+            time.sleep(options['warmup'])
+            with self.lock:
+                self.recording = True
+            start = time.perf_counter()
+            time.sleep(options['duration'])
+            self.stop.set()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+            dispatch.flush()
+        finally:
+            self.stop.set()
+            sql_logger.disabled = sql_logger_disabled
+
+        report = {
+            'target': self.base_url or 'in-process',
+            'database': connection.vendor,
+            'concurrency': options['concurrency'],
+            'duration_s': round(elapsed, 2),
+            'posts': Post.objects.count(),
+            'users': User.objects.count(),
+            'endpoints': {
+                name: summarize(self.latencies[name], self.errors[name], elapsed) for name in SCENARIOS
+            },
+            'total': summarize(
+                [ms for values in self.latencies.values() for ms in values], sum(self.errors.values()), elapsed
+            ),
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output + '\n')
+        self.stdout.write(output)
+        if baseline:
+            self.compare(baseline, report)
+
+    def worker(self, user, rng):
+        if self.base_url:
+            token = base64.b64encode(f'{user.username}:{PASSWORD}'.encode()).decode()
+            send = lambda method, path: self.send_http(method, path, token)
+        else:
+            # The test client's default 'testserver' host is only allowed under the test runner
+            host = next((h for h in settings.ALLOWED_HOSTS if h != '*' and not h.startswith('.')), 'localhost')
+            client = Client(HTTP_HOST=host)
+            client.force_login(user)
+            send = lambda method, path: self.send_client(client, method, path)
+        hot = PowerLaw(len(self.post_ids), 1.1, rng)
+        names = list(SCENARIOS)
+        weights = list(SCENARIOS.values())
+        try:
+            while not self.stop.is_set():
+                name = rng.choices(names, weights)[0]
+                method, path = self.request_for(name, rng, hot)
+                start = time.perf_counter()
+                try:
+                    ok = send(method, path)
+                except Exception:
+                    ok = False
+                elapsed = round((time.perf_counter() - start) * 1000, 2)
+                with self.lock:
+                    if self.recording and not self.stop.is_set():
+                        self.latencies[name].append(elapsed)
+                        if not ok:
+                            self.errors[name] += 1
+        finally:
+            connection.close()
+
+    def request_for(self, name, rng, hot):
+        if name == 'api_feed':
+            return 'GET', self.urls[name]
+        if name == 'api_search_posts':
+            query = rng.choice(WORDS)
+            if rng.random() < 0.5:
+                return 'GET', f"{self.urls[name]}?q={query}&tags={rng.choice(TAGS).replace(' ', '+')}"
+            return 'GET', f"{self.urls[name]}?q={query}"
+        post_id = self.post_ids[hot.pick()]
+        if name == 'api_get_post':
+            return 'GET', reverse(name, args=[post_id])
+        return 'POST', reverse(name, args=[post_id])
+
+    def send_client(self, client, method, path):
+        response = client.get(path) if method == 'GET' else client.post(path)
+        return response.status_code < 400
+
+    def send_http(self, method, path, token):
+        request = urllib.request.Request(
+            self.base_url + path, method=method, data=b'' if method == 'POST' else None,
+            headers={'Authorization': f'Basic {token}', 'Accept': 'application/json'}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+                return response.status < 400
+        except urllib.error.HTTPError:
+            return False
+
+    def compare(self, baseline, report):
+        self.stdout.write("\nChange against baseline:")
+        for name, current in [*report['endpoints'].items(), ('total', report['total'])]:
+            before = baseline['total'] if name == 'total' else baseline.get('endpoints', {}).get(name)
+            if not before:
+                continue
+            changes = []
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+                if before.get(metric) and current.get(metric) is not None:
+                    changes.append(f"{metric} {before[metric]} -> {current[metric]} "
+                                   f"({(current[metric] - before[metric]) / before[metric]:+.1%})")
+            self.stdout.write(f"  {name}: " + ', '.join(changes))
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:28
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Post = apps.get_model('feed', 'Post')
+    Comment = apps.get_model('feed', 'Comment')
+    counters = [
+        (apps.get_model('feed', 'Like'), Post, 'post', 'likes_count'),
+        (apps.get_model('feed', 'Favorite'), Post, 'post', 'favorites_count'),
+        (Comment, Post, 'post', 'comments_count'),
+        (apps.get_model('feed', 'CommentLike'), Comment, 'comment', 'likes_count'),
+    ]
+    for child, owner, fk, field in counters:
+        actual = Subquery(
+            child.objects.filter(**{fk: OuterRef('pk')}).order_by().values(fk).annotate(
+                n=Count('pk')
+            ).values('n')
+        )
+        owner.objects.update(**{field: Coalesce(actual, 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0005_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:31
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def split_tags(value):
+    names = []
+    for part in (value or '').split(','):
+        name = re.sub(r'\s+', ' ', part.strip().lstrip('#').strip()).lower()[:50]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def migrate_tag_strings(apps, schema_editor):
+    Post = apps.get_model('feed', 'Post')
+    Tag = apps.get_model('feed', 'Tag')
+    PostTag = apps.get_model('feed', 'PostTag')
+
+    tag_ids = {}
+    counts = {}
+    last_used = {}
+    batch = []
+    for post in Post.objects.exclude(tags='').only('id', 'tags', 'created_at').iterator():
+        names = split_tags(post.tags)
+        canonical = ','.join(names)
+        if canonical != post.tags:
+            Post.objects.filter(pk=post.pk).update(tags=canonical)
+        for position, name in enumerate(names):
+            if name not in tag_ids:
+                tag_ids[name] = Tag.objects.create(name=name).id
+            counts[name] = counts.get(name, 0) + 1
+            if last_used.get(name) is None or post.created_at > last_used[name]:
+                last_used[name] = post.created_at
+            batch.append(PostTag(post_id=post.id, tag_id=tag_ids[name], position=position))
+        if len(batch) >= 1000:
+            PostTag.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        PostTag.objects.bulk_create(batch)
+
+    for name, tag_id in tag_ids.items():
+        Tag.objects.filter(pk=tag_id).update(post_count=counts[name], last_used_at=last_used[name])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0006_engagement_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('post_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PostTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='feed.post')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='feed.tag')),
+            ],
+            options={
+                'ordering': ['position'],
+                'unique_together': {('tag', 'post')},
+            },
+        ),
+        migrations.RunPython(migrate_tag_strings, migrations.RunPython.noop),
+    ]
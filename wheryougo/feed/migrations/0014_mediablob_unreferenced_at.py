@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:12
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def start_grace_periods(apps, schema_editor):
+    # When existing blobs lost their last reference is unknown; start counting now
+    MediaBlob = apps.get_model('feed', 'MediaBlob')
+    MediaBlob.objects.filter(ref_count=0).update(unreferenced_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0013_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='mediablob',
+            name='feed_blob_unreferenced',
+        ),
+        migrations.AddField(
+            model_name='mediablob',
+            name='unreferenced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='mediablob',
+            index=models.Index(fields=['ref_count', 'unreferenced_at'], name='feed_blob_unreferenced'),
+        ),
+        migrations.RunPython(start_grace_periods, migrations.RunPython.noop),
+    ]
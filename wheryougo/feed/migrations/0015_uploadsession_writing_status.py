@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0014_mediablob_unreferenced_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadsession',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Receiving chunks'), ('writing', 'Writing a chunk'), ('complete', 'Complete'), ('attached', 'Attached to a post'), ('aborted', 'Aborted')], default='pending', max_length=10),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 from manage.models import UserProfile
@@ -19,7 +21,8 @@ class Post(models.Model):
         ('itinerary', 'Itinerary'),
     ]
     
-    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
+    # Indexed by feed_post_author_recent
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts', db_index=False)
     
     post_type = models.CharField(max_length=20, choices=POST_TYPES, default='travel')
     
@@ -34,18 +37,35 @@ class Post(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     likes_count = models.PositiveIntegerField(default=0)
+    favorites_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
     is_private = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['author', '-created_at', '-id'], name='feed_post_author_recent'),
+            # is_private=False compiles to NOT is_private, which no index
+            # column can seek on, so public posts get a partial index instead
+            models.Index(
+                fields=['-created_at', '-id'], condition=models.Q(is_private=False), name='feed_post_public_recent'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.title} by {self.author.username}"
     
     def get_tags_list(self):
+        if 'post_tags' in getattr(self, '_prefetched_objects_cache', {}):
+            return [post_tag.tag.name for post_tag in self.post_tags.all()]
+        # self.tags is kept in canonical form by feed.tags, so a split is enough
         return [tag.strip() for tag in self.tags.split(',') if tag.strip()]
     
     def get_categories_list(self):
         return [cat.strip() for cat in self.categories.split(',') if cat.strip()]
     
     def has_photos(self):
+        if 'images' in getattr(self, '_prefetched_objects_cache', {}):
+            return bool(self.images.all())
         return self.images.exists()
     
     def is_story_with_photos(self):
@@ -64,6 +84,8 @@ class PostImage(models.Model):
     caption = models.CharField(max_length=200, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     order = models.PositiveIntegerField(default=1)
+    # Resized copies written by feed.derivatives
+    variants = models.JSONField(default=dict, blank=True, editable=False)
     class Meta:
         ordering = ['order']
     
@@ -72,22 +94,29 @@ class PostImage(models.Model):
 
 class Follow(models.Model):
     follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='followers')
-    following = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
+    following = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following', db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ('follower', 'following')
+        indexes = [
+            # Follower counts and fan-out read only this index
+            models.Index(fields=['following', 'follower'], name='feed_follow_following'),
+        ]
     
     def __str__(self):
         return f"{self.follower.username} follows {self.following.username}"
 
 class Like(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='likes')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='likes', db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['post', 'user'], name='feed_like_post_user'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} likes {self.post.title}"
@@ -95,11 +124,14 @@ class Like(models.Model):
 
 class Favorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_favorites')
-    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='favorites')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='favorites', db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['post', 'user'], name='feed_favorite_post_user'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} favorited {self.post.title}"
@@ -115,9 +147,15 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_edited = models.BooleanField(default=False)
+    likes_count = models.PositiveIntegerField(default=0)
     
     class Meta:
         ordering = ['created_at']  # Show oldest first
+        indexes = [
+            # Top-level threads of a post, and replies of a comment, in page order
+            models.Index(fields=['post', 'parent', 'created_at', 'id'], name='feed_comment_post_thread'),
+            models.Index(fields=['parent', 'created_at', 'id'], name='feed_comment_parent_recent'),
+        ]
     
     def __str__(self):
         return f"Comment by {self.author.username} on {self.post.title}"
@@ -145,3 +183,112 @@ class CommentLike(models.Model):
     def __str__(self):
         return f"{self.user.username} likes comment by {self.comment.author.username}"
     
+
+class TimelineEntry(models.Model):
+    """A post delivered to a user's home timeline (fan-out on write)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')  # Copied from post.author so unfollows can prune by index
+    created_at = models.DateTimeField()  # Copied from post.created_at so the timeline is ordered by index alone
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='feed_timeline_user_recent'),
+            models.Index(fields=['user', 'author'], name='feed_timeline_user_author'),
+        ]
+
+    def __str__(self):
+        return f"Post {self.post_id} in {self.user.username}'s timeline"
+
+class Tag(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    post_count = models.PositiveIntegerField(default=0)  # Maintained by feed.tags
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+class PostTag(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='post_tags')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='post_tags')
+    position = models.PositiveSmallIntegerField(default=0)  # Order the tags were written in
+
+    class Meta:
+        unique_together = ('tag', 'post')  # Leads with tag so "posts tagged X" is an index range scan
+        ordering = ['position']
+
+    def __str__(self):
+        return f"{self.post_id} tagged {self.tag.name}"
+
+class FollowSuggestion(models.Model):
+    """Precomputed "who to follow" entry, refreshed in the background by feed.suggestions"""
+    REASONS = [
+        ('mutual', 'Followed by people you follow'),
+        ('tags', 'Posts about the same things'),
+        ('popular', 'Popular'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='follow_suggestions')
+    suggested = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    reason = models.CharField(max_length=20, choices=REASONS)
+    mutual_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'suggested')
+        indexes = [
+            models.Index(fields=['user', '-score'], name='feed_suggestion_user_score'),
+        ]
+
+    def __str__(self):
+        return f"Suggest {self.suggested.username} to {self.user.username}"
+
+class UploadSession(models.Model):
+    """A resumable chunked image upload, see feed.uploads"""
+    STATUSES = [
+        ('pending', 'Receiving chunks'),
+        ('writing', 'Writing a chunk'),
+        ('complete', 'Complete'),
+        ('attached', 'Attached to a post'),
+        ('aborted', 'Aborted'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=50, blank=True)  # Sniffed from the first bytes
+    size = models.PositiveIntegerField()  # Declared total size
+    received = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    stored_name = models.CharField(max_length=255, blank=True)  # Storage name once complete
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'updated_at'], name='feed_upload_status_updated'),
+        ]
+
+    def __str__(self):
+        return f"Upload {self.id} of {self.filename} by {self.user.username}"
+
+class MediaBlob(models.Model):
+    """One stored file, shared by every upload with the same content (see feed.storage)"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)  # Storage name, sharded by hash
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)  # Rows whose file field points here
+    created_at = models.DateTimeField(auto_now_add=True)
+    unreferenced_at = models.DateTimeField(null=True, blank=True)  # When ref_count last dropped to 0
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ref_count', 'unreferenced_at'], name='feed_blob_unreferenced'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} references)"
@@ -0,0 +1,141 @@
+"""
+Keyset (cursor) pagination for the list APIs.
+
+Pages are addressed by an opaque cursor holding the sort key of the row at
+the page boundary, e.g. (created_at, id). Fetching a page is then a range
+query that the database answers from an index, so the 500th page costs the
+same as the first. No COUNT(*) runs unless the client asks for one.
+"""
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder trims datetimes to milliseconds; cursors need the exact value"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values, reverse=False):
+    payload = {'k': list(values)}
+    if reverse:
+        payload['r'] = 1
+    raw = json.dumps(payload, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, model, keys):
+    """Turn a cursor token back into typed sort-key values"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        raw_values = payload['k']
+        reverse = bool(payload.get('r'))
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor('Invalid cursor')
+    if not isinstance(raw_values, list) or len(raw_values) != len(keys):
+        raise InvalidCursor('Invalid cursor')
+
+    values = []
+    for (name, _), value in zip(keys, raw_values):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Annotations such as a search score are plain JSON numbers
+            values.append(value)
+            continue
+        try:
+            values.append(field.to_python(value))
+        except Exception:
+            raise InvalidCursor('Invalid cursor')
+    return values, reverse
+
+
+def _parse_ordering(ordering):
+    return [(key.lstrip('-'), key.startswith('-')) for key in ordering]
+
+
+def _after(keys, values):
+    """Q matching rows strictly after `values` in the given key order"""
+    condition = Q()
+    equal_so_far = Q()
+    for (name, descending), value in zip(keys, values):
+        lookup = f'{name}__lt' if descending else f'{name}__gt'
+        condition |= equal_so_far & Q(**{lookup: value})
+        equal_so_far &= Q(**{name: value})
+    return condition
+
+
+def _flip(keys):
+    return [(name, not descending) for name, descending in keys]
+
+
+def _ordering(keys):
+    return [f'-{name}' if descending else name for name, descending in keys]
+
+
+def paginate(queryset, cursor=None, ordering=('-created_at', '-id'), page_size=10, with_count=False):
+    """
+    Return one page of `queryset` plus the pagination block for the response.
+
+    `ordering` must end in a unique column so every row has a distinct key.
+    """
+    keys = _parse_ordering(ordering)
+    reverse = False
+    page_qs = queryset
+
+    if cursor:
+        values, reverse = decode_cursor(cursor, queryset.model, keys)
+        if reverse:
+            page_qs = page_qs.filter(_after(_flip(keys), values))
+        else:
+            page_qs = page_qs.filter(_after(keys, values))
+
+    order = _flip(keys) if reverse else keys
+    rows = list(page_qs.order_by(*_ordering(order))[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    if reverse:
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, bool(cursor)
+
+    def key_of(row):
+        return [getattr(row, name) for name, _ in keys]
+
+    pagination = {
+        'next': encode_cursor(key_of(rows[-1])) if rows and has_next else None,
+        'prev': encode_cursor(key_of(rows[0]), reverse=True) if rows and has_previous else None,
+        'has_next': has_next,
+        'has_previous': has_previous,
+        'page_size': page_size,
+    }
+    if with_count:
+        pagination['total_posts'] = queryset.order_by().count()
+    return rows, pagination
+
+
+def up_to(cursor, model, ordering=('-created_at', '-id')):
+    """Q matching the row a cursor was made from and every row after it"""
+    keys = _parse_ordering(ordering)
+    values, _ = decode_cursor(cursor, model, keys)
+    return ~_after(_flip(keys), values)
+
+
+def wants_count(request):
+    return request.GET.get('count', '').lower() in ('1', 'true', 'yes')
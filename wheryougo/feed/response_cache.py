@@ -0,0 +1,87 @@
+"""
+Shared response cache for logged-out traffic.
+
+Anonymous requests to the public feed, post detail and search endpoints all
+get the same payload, so the serialized response is cached under a key built
+from the endpoint, host and query parameters. Keys embed version counters
+instead of being deleted one by one:
+
+* the posts version changes whenever any post is created, edited or deleted
+  and covers the feed and search listings
+* each post has its own version, also changed by its comments and images
+
+Old entries are never read again and simply expire. Counts that change
+without bumping a version (likes, favorites) may lag by RESPONSE_CACHE_TTL.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+from wheryougo import metrics
+
+TTL = getattr(settings, 'RESPONSE_CACHE_TTL', 30)
+POSTS_VERSION_KEY = 'feed:responses:posts:version'
+
+
+def _post_version_key(post_id):
+    return f'feed:responses:post:{post_id}:version'
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+def invalidate_post(post_id, listings=True):
+    """
+    Retire cached responses showing this post once the current transaction
+    commits, so no reader can cache the old rows under the new version.
+    """
+    def bump():
+        _bump(_post_version_key(post_id))
+        if listings:
+            _bump(POSTS_VERSION_KEY)
+    transaction.on_commit(bump)
+
+
+def response_key(scope, request, post_id=None):
+    version_keys = [POSTS_VERSION_KEY] if post_id is None else [_post_version_key(post_id)]
+    versions = cache.get_many(version_keys)
+    params = sorted((key, value) for key, values in request.GET.lists() for value in values)
+    digest = hashlib.md5(repr((request.get_host(), params)).encode()).hexdigest()
+    version = '.'.join(str(versions.get(key, 1)) for key in version_keys)
+    return f'feed:responses:{scope}:{post_id or ""}:v{version}:{digest}'
+
+
+def cache_public_response(scope):
+    """
+    Serve anonymous GETs of a DRF function view from the cache. Goes below
+    @api_view; responses other than 200 are never stored.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated or TTL <= 0:
+                return view(request, *args, **kwargs)
+
+            key = response_key(scope, request, kwargs.get('post_id'))
+            data = cache.get(key)
+            metrics.record_cache('responses', hits=data is not None, misses=data is None)
+            if data is not None:
+                response = Response(data)
+                response['X-Cache'] = 'HIT'
+                return response
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data, TTL)
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapped
+    return decorator
@@ -0,0 +1,153 @@
+"""
+Full-text search over posts.
+
+On SQLite the post title, content, tags and location are indexed in an
+FTS5 table (feed_post_fts) that mirrors feed_post through triggers. Queries
+are matched against the inverted index with prefix matching, ranked with
+BM25 and returned with highlighted snippets. Other databases fall back to
+the icontains filters.
+"""
+import html
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+
+FTS_TABLE = 'feed_post_fts'
+POST_TABLE = Post._meta.db_table
+COLUMNS = ('title', 'content', 'tags', 'location')
+# BM25 weight per column, in COLUMNS order: a hit in the title counts most
+WEIGHTS = (10.0, 1.0, 5.0, 3.0)
+MAX_TERMS = 8
+
+# Highlight markers are control characters so the text can be HTML-escaped
+# before they are turned into <mark> tags
+_OPEN, _CLOSE = '\x02', '\x03'
+
+
+def _schema_sql():
+    columns = ', '.join(COLUMNS)
+    new_values = ', '.join(f'new.{c}' for c in COLUMNS)
+    old_values = ', '.join(f'old.{c}' for c in COLUMNS)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"{columns}, content='{POST_TABLE}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {POST_TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {POST_TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {columns} ON {POST_TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END",
+    ]
+
+
+def _trigger_names():
+    return {f'{FTS_TABLE}_ai', f'{FTS_TABLE}_ad', f'{FTS_TABLE}_au'}
+
+
+def ensure_search_index(using='default', rebuild=False):
+    """
+    Create the FTS table and its triggers if they are missing.
+
+    SQLite drops triggers when Django rebuilds feed_post during a migration,
+    so this runs after every migrate. If anything had to be (re)created the
+    index is rebuilt from feed_post. Returns True when a rebuild happened.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name IN (%s, %s) OR (type = 'trigger' AND tbl_name = %s)",
+            [FTS_TABLE, POST_TABLE, POST_TABLE]
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        if POST_TABLE not in existing:
+            return False
+        if {FTS_TABLE} | _trigger_names() <= existing and not rebuild:
+            return False
+        for statement in _schema_sql():
+            cursor.execute(statement)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+def install_search_index(sender, using='default', **kwargs):
+    """post_migrate hook"""
+    ensure_search_index(using)
+
+
+def is_available(using=None):
+    using = using or router.db_for_read(Post)
+    return connections[using].vendor == 'sqlite'
+
+
+def build_match_query(text):
+    """
+    Turn user input into an FTS5 query: every word must match, and the
+    last word also matches as a prefix so results update while typing.
+    """
+    terms = re.findall(r'\w+', text.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' AND '.join(quoted)
+
+
+def rank_expression(match):
+    weights = ', '.join(str(w) for w in WEIGHTS)
+    return RawSQL(
+        f'SELECT bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {POST_TABLE}.id',
+        (match,)
+    )
+
+
+def hits(match):
+    """Subquery of the ids of every post matching the FTS query"""
+    return RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,))
+
+
+def search(queryset, text):
+    """
+    Restrict `queryset` to posts matching `text` and annotate `search_rank`
+    (BM25; lower is more relevant). Returns (queryset, ranked).
+    """
+    match = build_match_query(text)
+    if match is None or not is_available(queryset.db):
+        return queryset.filter(
+            Q(title__icontains=text) |
+            Q(content__icontains=text) |
+            Q(tags__icontains=text) |
+            Q(location__icontains=text)
+        ), False
+    return queryset.filter(id__in=hits(match)).annotate(search_rank=rank_expression(match)), True
+
+
+def _mark(fragment):
+    return html.escape(fragment).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def highlights(text, post_ids, using='default'):
+    """HTML-safe highlighted title and content snippet for each post id"""
+    match = build_match_query(text)
+    if match is None or not post_ids or not is_available(using):
+        return {}
+    placeholders = ', '.join(['%s'] * len(post_ids))
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, highlight({FTS_TABLE}, 0, %s, %s), "
+            f"snippet({FTS_TABLE}, 1, %s, %s, '…', 16) "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid IN ({placeholders})",
+            [_OPEN, _CLOSE, _OPEN, _CLOSE, match, *post_ids]
+        )
+        return {
+            rowid: {'title': _mark(title or ''), 'content': _mark(snippet or '')}
+            for rowid, title, snippet in cursor.fetchall()
+        }
@@ -2,11 +2,19 @@ from rest_framework import serializers
 from .models import Post, PostImage, Follow, Like, Favorite, Comment, CommentLike
 from manage.models import UserProfile
 from django.contrib.auth.models import User
+from .viewer import ViewerContext
+from .fragments import FragmentCache
+from .derivatives import variant_urls
 
 class UserProfileSerializer(serializers.ModelSerializer):
+    pfp_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = UserProfile
-        fields = ['name', 'user_type', 'pfp']
+        fields = ['name', 'user_type', 'pfp', 'pfp_variants']
+
+    def get_pfp_variants(self, obj):
+        return variant_urls(obj.pfp_variants, self.context.get('request'))
 
 class UserSerializer(serializers.ModelSerializer):
     userprofile = UserProfileSerializer(read_only=True)
@@ -16,9 +24,30 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'first_name', 'last_name', 'userprofile']
 
 class PostImageSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()
+
     class Meta:
         model = PostImage
-        fields = ['id', 'image', 'caption', 'order']
+        fields = ['id', 'image', 'caption', 'order', 'variants']
+
+    def get_variants(self, obj):
+        return variant_urls(obj.variants, self.context.get('request'))
+
+class PostListSerializer(serializers.ListSerializer):
+    """Resolves viewer state for the whole page before serializing each post"""
+
+    def to_representation(self, data):
+        posts = list(data.all() if hasattr(data, 'all') else data)
+        request = self.context.get('request')
+        context = {**self.context, 'fragments': FragmentCache(posts, request)}
+        if 'viewer' not in context:
+            user = request.user if request is not None else None
+            context['viewer'] = ViewerContext(user, posts)
+        self._context = context
+        representation = super().to_representation(posts)
+        context['fragments'].save()
+        return representation
+
 
 class PostSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
@@ -44,6 +73,7 @@ class PostSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Post
+        list_serializer_class = PostListSerializer
         fields = [
             'id',
             'author',
@@ -69,32 +99,61 @@ class PostSerializer(serializers.ModelSerializer):
             'primary_category',
         ]
 
+    # Recomputed for every response; the rest comes from the fragment cache
+    VIEWER_FIELDS = (
+        'user_has_liked', 'user_has_favorited', 'is_following_author',
+        'like_count', 'favorite_count', 'comment_count',
+    )
+
+    def to_representation(self, instance):
+        fragments = self.context.get('fragments')
+        if fragments is None:
+            # Serializing a single post
+            fragments = FragmentCache([instance], self.context.get('request'))
+        fragment = fragments.get(instance)
+        if fragment is None:
+            fragment = self._represent(instance, exclude=self.VIEWER_FIELDS)
+            fragments.add(instance, fragment)
+            if 'fragments' not in self.context:
+                fragments.save()
+        data = {**fragment, **self._represent(instance, only=self.VIEWER_FIELDS)}
+        return {name: data[name] for name in self.Meta.fields}
+
+    def _represent(self, instance, only=None, exclude=()):
+        ret = {}
+        for field in self._readable_fields:
+            if (only is not None and field.field_name not in only) or field.field_name in exclude:
+                continue
+            attribute = field.get_attribute(instance)
+            ret[field.field_name] = None if attribute is None else field.to_representation(attribute)
+        return ret
+
+    def get_viewer(self, obj):
+        viewer = self.context.get('viewer')
+        if viewer is None:
+            # Serializing a single post: resolve just this one
+            request = self.context.get('request')
+            viewer = ViewerContext(request.user if request is not None else None, [obj])
+            self._context = {**self.context, 'viewer': viewer}
+        return viewer
+
     def get_user_has_liked(self, obj):
-        user = self.context.get('request').user
-        if not user.is_authenticated:
-            return False
-        return obj.likes.filter(user=user).exists()
+        return self.get_viewer(obj).has_liked(obj)
 
     def get_user_has_favorited(self, obj):
-        user = self.context.get('request').user
-        if not user.is_authenticated:
-            return False
-        return obj.favorites.filter(user=user).exists()
+        return self.get_viewer(obj).has_favorited(obj)
 
     def get_is_following_author(self, obj):
-        user = self.context.get('request').user
-        if not user.is_authenticated or obj.author == user:
-            return None
-        return obj.author.following.filter(follower=user).exists()
+        return self.get_viewer(obj).is_following_author(obj)
 
     def get_like_count(self, obj):
-        return obj.likes.count()
+        return self.get_viewer(obj).like_count(obj)
 
     def get_favorite_count(self, obj):
-        return obj.favorites.count()
+        return self.get_viewer(obj).favorite_count(obj)
 
     def get_comment_count(self, obj):
-        return obj.comments.count()
+        return self.get_viewer(obj).comment_count(obj)
 
     def get_tags_list(self, obj):
         return obj.get_tags_list()
@@ -112,6 +171,7 @@ class PostSerializer(serializers.ModelSerializer):
 class CommentSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     replies = serializers.SerializerMethodField()
+    replies_count = serializers.SerializerMethodField()
     likes_count = serializers.SerializerMethodField()
     user_has_liked = serializers.SerializerMethodField()
     
@@ -126,24 +186,36 @@ class CommentSerializer(serializers.ModelSerializer):
             'updated_at',
             'is_edited',
             'replies',
+            'replies_count',
             'likes_count',
             'user_has_liked',
         ]
         read_only_fields = ['created_at', 'updated_at', 'is_edited']
     
     def get_replies(self, obj):
+        if hasattr(obj, 'preloaded_replies'):
+            # Loaded by feed.comments together with the rest of the page
+            return CommentSerializer(obj.preloaded_replies, many=True, context=self.context).data
         if obj.parent is None:  # Only get replies for top-level comments
             replies = obj.get_replies()
             return CommentSerializer(replies, many=True, context=self.context).data
         return []
+
+    def get_replies_count(self, obj):
+        if hasattr(obj, 'replies_total'):
+            return obj.replies_total
+        return obj.replies_count()
     
     def get_likes_count(self, obj):
-        return obj.likes.count()
+        return obj.likes_count
     
     def get_user_has_liked(self, obj):
         user = self.context.get('request').user
         if not user.is_authenticated:
             return False
+        liked = self.context.get('liked_comments')
+        if liked is not None:
+            return obj.id in liked
         return obj.likes.filter(user=user).exists()
 
 
@@ -0,0 +1,126 @@
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Post, PostImage, Follow, Like, Favorite, Comment, CommentLike, Tag, PostTag
+from . import blobs, counters, derivatives, fragments, response_cache, suggestions, tags, timeline
+
+
+@receiver(post_save, sender=Post)
+def deliver_post(sender, instance, created, **kwargs):
+    """Fan new posts out to followers and react to privacy changes"""
+    if created:
+        timeline.fan_out_post(instance)
+    else:
+        timeline.sync_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def sync_tags(sender, instance, **kwargs):
+    """Mirror the comma-separated Post.tags string into Tag/PostTag rows"""
+    tags.set_post_tags(instance)
+
+
+@receiver(post_delete, sender=PostTag)
+def release_tag(sender, instance, origin=None, **kwargs):
+    if origin is not None and _deleting(origin, (Tag,)):
+        return
+    counters.adjust(Tag, instance.tag_id, 'post_count', -1)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def expire_post_responses(sender, instance, **kwargs):
+    response_cache.invalidate_post(instance.pk)
+
+
+@receiver(post_save, sender=PostImage)
+@receiver(post_delete, sender=PostImage)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def expire_parent_post_responses(sender, instance, **kwargs):
+    # Comments only appear on the post detail; images also show in listings
+    response_cache.invalidate_post(instance.post_id, listings=sender is PostImage)
+
+
+@receiver(post_save, sender=PostImage)
+@receiver(post_delete, sender=PostImage)
+def touch_post(sender, instance, origin=None, **kwargs):
+    """Images are part of the cached post fragment, which is keyed by updated_at"""
+    if origin is not None and _deleting(origin, (Post,)):
+        return
+    Post.objects.filter(pk=instance.post_id).update(updated_at=timezone.now())
+
+
+# UserProfile and Trip images are tracked by the same helpers, from
+# manage.signals and trip.signals
+
+@receiver(pre_save, sender=PostImage)
+def remember_blobs(sender, instance, update_fields=None, **kwargs):
+    blobs.remember(instance, update_fields)
+
+
+@receiver(post_save, sender=PostImage)
+def retain_blobs(sender, instance, **kwargs):
+    """Keep MediaBlob.ref_count in step with the files rows point at"""
+    blobs.saved(instance)
+
+
+@receiver(post_delete, sender=PostImage)
+def release_blobs(sender, instance, **kwargs):
+    blobs.deleted(instance)
+
+
+@receiver(post_save, sender=PostImage)
+def generate_image_variants(sender, instance, **kwargs):
+    derivatives.schedule(instance)
+
+
+@receiver(post_save, sender=User)
+def expire_author_fragments(sender, instance, update_fields=None, **kwargs):
+    # Logging in saves last_login only, which no post shows
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    fragments.invalidate_author(instance.pk)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        timeline.backfill_follow(instance.follower_id, instance.following_id)
+        suggestions.invalidate(instance.follower_id, instance.following_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline(sender, instance, **kwargs):
+    timeline.prune_follow(instance.follower_id, instance.following_id)
+    suggestions.invalidate(instance.follower_id)
+
+
+def _deleting(origin, models):
+    """True when a delete cascades from one of `models`, whose counters go away with it"""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return issubclass(model, models)
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=CommentLike)
+def increment_counter(sender, instance, created, **kwargs):
+    if created:
+        owner, fk, field = counters.counter_for(sender)
+        counters.adjust(owner, getattr(instance, f'{fk}_id'), field, 1)
+
+
+@receiver(post_delete, sender=Like)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=CommentLike)
+def decrement_counter(sender, instance, origin=None, **kwargs):
+    owner, fk, field = counters.counter_for(sender)
+    if origin is not None and _deleting(origin, (owner, Post)):
+        return
+    counters.adjust(owner, getattr(instance, f'{fk}_id'), field, -1)
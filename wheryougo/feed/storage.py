@@ -0,0 +1,98 @@
+"""
+Content-addressed file storage.
+
+Every saved file is hashed (SHA-256) while it is streamed to a staging
+file, then stored once under blobs/<h[:2]>/<h[2:4]>/<hash><ext>, no matter
+which upload_to directory or file name it came with. Saving identical
+content again returns the existing name, so re-posted photos take no more
+space, and no directory grows beyond 65536 hash shards.
+
+Each stored file has a MediaBlob row whose ref_count is kept by
+feed.blobs; delete() leaves files alone while anything still refers to them.
+"""
+import hashlib
+import os
+import uuid
+
+from django.apps import apps
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError
+from django.utils import timezone
+
+BLOB_DIR = 'blobs'
+STAGING_DIR = f'{BLOB_DIR}/staging'
+READ_BLOCK = 64 * 1024
+
+
+def blob_name(digest, extension):
+    return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(f'{BLOB_DIR}/') and not name.startswith(f'{STAGING_DIR}/')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # The final name comes from the content hash in _save
+        return name
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1].lower()[:10]
+        digest = hashlib.sha256()
+        size = 0
+        staged = None
+
+        if hasattr(content, 'temporary_file_path'):
+            # Already on disk: hash it in place and move it if it is new
+            source = content.temporary_file_path()
+            with open(source, 'rb') as f:
+                for block in iter(lambda: f.read(READ_BLOCK), b''):
+                    digest.update(block)
+                    size += len(block)
+        else:
+            staged = source = self.path(f'{STAGING_DIR}/{uuid.uuid4().hex}')
+            os.makedirs(os.path.dirname(staged), exist_ok=True)
+            with open(staged, 'wb') as f:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+        MediaBlob = apps.get_model('feed', 'MediaBlob')
+        digest = digest.hexdigest()
+        existing = MediaBlob.objects.filter(sha256=digest).values_list('name', flat=True).first()
+        if existing is not None and os.path.exists(self.path(existing)):
+            if staged is not None:
+                os.remove(staged)
+            # Uploaded again: give the row about to claim it a full grace period
+            MediaBlob.objects.filter(sha256=digest, ref_count=0).update(unreferenced_at=timezone.now())
+            return existing
+
+        name = existing or blob_name(digest, extension)
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        file_move_safe(source, full_path, allow_overwrite=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        try:
+            MediaBlob.objects.get_or_create(
+                sha256=digest, defaults={'name': name, 'size': size, 'unreferenced_at': timezone.now()}
+            )
+        except IntegrityError:
+            # Saved concurrently by another request; the file is the same
+            pass
+        return name
+
+    def delete(self, name):
+        """Only deletes a blob nothing refers to any more"""
+        if is_blob(name):
+            MediaBlob = apps.get_model('feed', 'MediaBlob')
+            if MediaBlob.objects.filter(name=name, ref_count__gt=0).exists():
+                return
+            MediaBlob.objects.filter(name=name).delete()
+        super().delete(name)
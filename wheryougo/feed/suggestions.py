@@ -0,0 +1,185 @@
+"""
+"Who to follow" suggestions.
+
+Suggestions are computed off the request path from the follow graph and
+stored per user in FollowSuggestion:
+
+* friends of friends: people followed by the people you follow
+* shared tags: authors who post under the tags you use most
+* popularity: follower count, mostly as a tie-breaker
+
+A feed request only reads the stored rows by (user, score) index. Rows
+older than FOLLOW_SUGGESTIONS_TTL, or invalidated by a follow change, are
+recomputed in a background worker while the old rows are served.
+"""
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count
+
+from wheryougo import metrics
+from .models import Follow, PostTag, FollowSuggestion
+
+TTL = getattr(settings, 'FOLLOW_SUGGESTIONS_TTL', 6 * 3600)
+ASYNC = getattr(settings, 'FOLLOW_SUGGESTIONS_ASYNC', True)
+STORED_PER_USER = 20
+CANDIDATES_PER_SOURCE = 200
+POPULAR_KEY = 'feed:popular-users'
+POPULAR_TTL = 600
+
+MUTUAL_WEIGHT = 3.0
+TAG_WEIGHT = 2.0
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='follow-suggestions')
+
+
+def _fresh_key(user_id):
+    return f'feed:suggestions:fresh:{user_id}'
+
+
+def is_fresh(user_id):
+    return bool(cache.get(_fresh_key(user_id)))
+
+
+def popular_users():
+    """[(user_id, followers_count)] of the most followed users, shared by everyone"""
+    popular = cache.get(POPULAR_KEY)
+    metrics.record_cache('popular_users', hits=popular is not None, misses=popular is None)
+    if popular is None:
+        popular = list(
+            Follow.objects.values('following_id').annotate(
+                n=Count('id')
+            ).order_by('-n').values_list('following_id', 'n')[:CANDIDATES_PER_SOURCE]
+        )
+        cache.set(POPULAR_KEY, popular, POPULAR_TTL)
+    return popular
+
+
+def compute(user_id):
+    """Rank candidates for one user and replace their stored suggestions"""
+    following = set(Follow.objects.filter(follower_id=user_id).values_list('following_id', flat=True))
+    excluded = following | {user_id}
+
+    mutual = dict(
+        Follow.objects.filter(follower_id__in=following).exclude(
+            following_id__in=excluded
+        ).values('following_id').annotate(n=Count('id')).order_by('-n').values_list(
+            'following_id', 'n'
+        )[:CANDIDATES_PER_SOURCE]
+    )
+
+    my_tags = list(
+        PostTag.objects.filter(post__author_id=user_id).values('tag_id').annotate(
+            n=Count('id')
+        ).order_by('-n').values_list('tag_id', flat=True)[:10]
+    )
+    shared_tags = {}
+    if my_tags:
+        shared_tags = dict(
+            PostTag.objects.filter(tag_id__in=my_tags).exclude(
+                post__author_id__in=excluded
+            ).values('post__author_id').annotate(
+                n=Count('tag_id', distinct=True)
+            ).order_by('-n').values_list('post__author_id', 'n')[:CANDIDATES_PER_SOURCE]
+        )
+
+    popular = {uid: n for uid, n in popular_users() if uid not in excluded}
+    candidates = set(mutual) | set(shared_tags) | set(popular)
+    followers = dict(popular)
+    unknown = candidates - set(followers)
+    if unknown:
+        followers.update(
+            Follow.objects.filter(following_id__in=unknown).values('following_id').annotate(
+                n=Count('id')
+            ).values_list('following_id', 'n')
+        )
+
+    ranked = []
+    for candidate in candidates:
+        signals = {
+            'mutual': MUTUAL_WEIGHT * mutual.get(candidate, 0),
+            'tags': TAG_WEIGHT * shared_tags.get(candidate, 0),
+            'popular': math.log1p(followers.get(candidate, 0)),
+        }
+        ranked.append((sum(signals.values()), candidate, max(signals, key=signals.get)))
+    ranked.sort(reverse=True)
+
+    rows = [
+        FollowSuggestion(
+            user_id=user_id,
+            suggested_id=candidate,
+            score=total,
+            reason=reason,
+            mutual_count=mutual.get(candidate, 0),
+            followers_count=followers.get(candidate, 0),
+        )
+        for total, candidate, reason in ranked[:STORED_PER_USER]
+    ]
+    with transaction.atomic():
+        FollowSuggestion.objects.filter(user_id=user_id).delete()
+        FollowSuggestion.objects.bulk_create(rows)
+    cache.set(_fresh_key(user_id), True, TTL)
+    return rows
+
+
+def _refresh(user_id):
+    try:
+        compute(user_id)
+    finally:
+        cache.delete(f'feed:suggestions:computing:{user_id}')
+        connection.close()
+
+
+def schedule_refresh(user_id):
+    """Recompute a user's suggestions in the background once the current transaction commits"""
+    if not ASYNC:
+        transaction.on_commit(lambda: compute(user_id))
+        return
+    def submit():
+        # One pending recompute per user is enough. Locking only after the
+        # commit means a rolled-back request cannot hold the lock.
+        if cache.add(f'feed:suggestions:computing:{user_id}', True, 300):
+            _executor.submit(_refresh, user_id)
+    transaction.on_commit(submit)
+
+
+def invalidate(user_id, *followed_ids):
+    """After a follow change: hide the followed users now and recompute the rest later"""
+    if followed_ids:
+        FollowSuggestion.objects.filter(user_id=user_id, suggested_id__in=followed_ids).delete()
+    cache.delete(_fresh_key(user_id))
+
+
+def suggested_users(user, limit=5):
+    """
+    Stored suggestions for `user` as User objects carrying followers_count.
+    Falls back to popular users until the first computation has run.
+    """
+    if not is_fresh(user.id):
+        schedule_refresh(user.id)
+
+    rows = list(
+        FollowSuggestion.objects.filter(user=user).select_related(
+            'suggested__userprofile'
+        ).order_by('-score')[:limit]
+    )
+    users = []
+    for row in rows:
+        row.suggested.followers_count = row.followers_count
+        row.suggested.suggestion_reason = row.reason
+        users.append(row.suggested)
+    if users:
+        return users
+
+    following = set(Follow.objects.filter(follower=user).values_list('following_id', flat=True))
+    popular = [(uid, n) for uid, n in popular_users() if uid not in following and uid != user.id][:limit]
+    found = User.objects.select_related('userprofile').in_bulk([uid for uid, _ in popular])
+    for uid, n in popular:
+        if uid in found:
+            found[uid].followers_count = n
+            users.append(found[uid])
+    return users
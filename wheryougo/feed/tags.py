@@ -0,0 +1,107 @@
+"""
+Normalized post tags.
+
+Post.tags stays the comma-separated string clients send and read, but it is
+rewritten in canonical form and mirrored into Tag/PostTag rows. Tag
+filtering runs on the PostTag (tag, post) index, and Tag.post_count is kept
+up to date so the rarest tag can drive an intersection.
+"""
+import re
+
+from django.db.models import Exists, F, OuterRef, Prefetch
+from django.utils import timezone
+
+from .models import Post, Tag, PostTag
+from . import autocomplete
+
+MAX_TAG_LENGTH = Tag._meta.get_field('name').max_length
+
+
+def normalize(name):
+    """'  #Road Trip ' -> 'road trip'"""
+    name = re.sub(r'\s+', ' ', name.strip().lstrip('#').strip()).lower()
+    return name[:MAX_TAG_LENGTH]
+
+
+def parse(value):
+    """Split a comma-separated tag string into unique normalized names, keeping order"""
+    names = []
+    for part in (value or '').split(','):
+        name = normalize(part)
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def prefetch():
+    """Prefetch for a Post queryset so get_tags_list() needs no extra queries"""
+    return Prefetch('post_tags', queryset=PostTag.objects.select_related('tag'))
+
+
+def set_post_tags(post, names=None):
+    """
+    Make the post's PostTag rows match `names` (default: parsed from post.tags)
+    and rewrite post.tags in canonical form. Returns the names added.
+    """
+    if names is None:
+        names = parse(post.tags)
+
+    canonical = ','.join(names)
+    if post.tags != canonical:
+        post.tags = canonical
+        Post.objects.filter(pk=post.pk).update(tags=canonical)
+
+    current = {
+        post_tag.tag.name: post_tag
+        for post_tag in PostTag.objects.filter(post=post).select_related('tag')
+    }
+    added = [name for name in names if name not in current]
+    removed = [post_tag.pk for name, post_tag in current.items() if name not in names]
+
+    if removed:
+        # post_delete on PostTag takes care of Tag.post_count
+        PostTag.objects.filter(pk__in=removed).delete()
+
+    if added:
+        Tag.objects.bulk_create([Tag(name=name) for name in added], ignore_conflicts=True)
+        tags = {tag.name: tag for tag in Tag.objects.filter(name__in=added)}
+        PostTag.objects.bulk_create([
+            PostTag(post=post, tag=tags[name], position=names.index(name))
+            for name in added
+        ], ignore_conflicts=True)
+        Tag.objects.filter(name__in=added).update(
+            post_count=F('post_count') + 1,
+            last_used_at=timezone.now()
+        )
+        autocomplete.record_tags(added)
+
+    moved = [
+        post_tag for name, post_tag in current.items()
+        if name in names and post_tag.position != names.index(name)
+    ]
+    for post_tag in moved:
+        post_tag.position = names.index(post_tag.tag.name)
+    if moved:
+        PostTag.objects.bulk_update(moved, ['position'])
+    return added
+
+
+def filter_by_tags(queryset, names):
+    """
+    Restrict a Post queryset to posts carrying every tag in `names`.
+
+    The tag with the fewest posts supplies the candidate ids from its index
+    range; each remaining tag is an indexed (tag, post) existence probe.
+    """
+    names = [name for name in (normalize(n) for n in names) if name]
+    if not names:
+        return queryset
+    tags = list(Tag.objects.filter(name__in=set(names)).order_by('post_count'))
+    if len(tags) < len(set(names)):
+        return queryset.none()
+
+    rarest, *others = tags
+    queryset = queryset.filter(id__in=PostTag.objects.filter(tag=rarest).values('post_id'))
+    for tag in others:
+        queryset = queryset.filter(Exists(PostTag.objects.filter(tag=tag, post=OuterRef('pk'))))
+    return queryset
@@ -1,3 +1,446 @@
-from django.test import TestCase
+import datetime
+import io
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from notification.models import Notification
+from trip.models import Trip
+from . import blobs, counters, engagement, search, uploads
+from .pagination import InvalidCursor, encode_cursor, paginate
+from .models import Post, PostImage, Follow, Like, Favorite, Comment, CommentLike, MediaBlob, UploadSession
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "Checks SQLite query plans")
+class HotQueryPlanTests(TestCase):
+    """The hottest queries must be answered from an index, never by scanning a table"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('author')
+        cls.post = Post.objects.create(author=cls.user, title='Post')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        full_scans = re.findall(r'SCAN (\w+)\b(?! USING)', plan)
+        self.assertEqual(full_scans, [], f"Full table scan in:\n{plan}")
+        self.assertNotIn('USE TEMP B-TREE', plan, f"Sorts outside the index in:\n{plan}")
+
+    def test_author_posts(self):
+        self.assertUsesIndex(
+            Post.objects.filter(author=self.user, is_private=False).order_by('-created_at', '-id'),
+            'feed_post_author_recent'
+        )
+
+    def test_public_posts(self):
+        self.assertUsesIndex(
+            Post.objects.filter(is_private=False).order_by('-created_at', '-id')[:10],
+            'feed_post_public_recent'
+        )
+
+    def test_public_posts_next_page(self):
+        # The keyset condition feed.pagination adds for a cursor
+        after = Q(created_at__lt=self.post.created_at) | Q(created_at=self.post.created_at, id__lt=self.post.id)
+        self.assertUsesIndex(
+            Post.objects.filter(after, is_private=False).order_by('-created_at', '-id')[:10],
+            'feed_post_public_recent'
+        )
+
+    def test_follower_count(self):
+        self.assertUsesIndex(Follow.objects.filter(following=self.user).values('pk'), 'feed_follow_following')
+
+    def test_like_and_favorite_counts(self):
+        self.assertUsesIndex(Like.objects.filter(post=self.post).values('pk'), 'feed_like_post_user')
+        self.assertUsesIndex(Favorite.objects.filter(post=self.post).values('pk'), 'feed_favorite_post_user')
+
+    def test_comment_threads(self):
+        self.assertUsesIndex(
+            Comment.objects.filter(post=self.post, parent__isnull=True).order_by('created_at', 'id'),
+            'feed_comment_post_thread'
+        )
+
+    def test_notification_inbox(self):
+        self.assertUsesIndex(
+            Notification.objects.filter(to_user=self.user).order_by('-created_at', '-id'),
+            'notification_inbox_idx'
+        )
+        self.assertUsesIndex(
+            Notification.objects.filter(to_user=self.user, is_seen=False).values('pk'),
+            'notification_unseen_idx'
+        )
+
+    def test_user_trips(self):
+        self.assertUsesIndex(
+            Trip.objects.filter(created_by=self.user).order_by('-created_at'),
+            'trip_created_by_recent'
+        )
+
+
+class BlobReferenceTests(TestCase):
+
+    def setUp(self):
+        self.post = Post.objects.create(author=User.objects.create_user('author'), title='Post')
+        self.blob = MediaBlob.objects.create(
+            sha256='ab' * 32, name='blobs/ab/ab/' + 'ab' * 32 + '.jpg', size=10, unreferenced_at=timezone.now()
+        )
+
+    def test_new_row_with_existing_blob_is_counted(self):
+        # uploads.attach creates images from names that are already stored
+        PostImage.objects.create(post=self.post, image=self.blob.name)
+        self.blob.refresh_from_db()
+        self.assertEqual(self.blob.ref_count, 1)
+        self.assertIsNone(self.blob.unreferenced_at)
+        self.assertNotIn(self.blob, blobs.collectable())
+
+    def test_grace_period_starts_when_last_reference_goes(self):
+        MediaBlob.objects.filter(pk=self.blob.pk).update(created_at=timezone.now() - datetime.timedelta(days=365))
+        image = PostImage.objects.create(post=self.post, image=self.blob.name)
+        image.delete()
+        self.blob.refresh_from_db()
+        self.assertEqual(self.blob.ref_count, 0)
+        self.assertIsNotNone(self.blob.unreferenced_at)
+        self.assertNotIn(self.blob, blobs.collectable())
+
+        MediaBlob.objects.filter(pk=self.blob.pk).update(
+            unreferenced_at=timezone.now() - datetime.timedelta(seconds=blobs.GRACE_PERIOD + 1)
+        )
+        self.assertIn(self.blob, blobs.collectable())
+
+    def test_replacing_the_file_of_a_loaded_row_moves_the_reference(self):
+        other = MediaBlob.objects.create(sha256='cd' * 32, name='blobs/cd/cd/' + 'cd' * 32 + '.jpg', size=10)
+        image = PostImage.objects.create(post=self.post, image=self.blob.name)
+        image = PostImage.objects.get(pk=image.pk)
+        image.caption = 'Caption'
+        image.save(update_fields=['caption'])
+        image.image = other.name
+        image.save()
+        self.blob.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.blob.ref_count, other.ref_count), (0, 1))
+
+    def test_loading_rows_costs_nothing(self):
+        PostImage.objects.create(post=self.post, image=self.blob.name)
+        PostImage.objects.create(post=self.post, image=self.blob.name)
+        with self.assertNumQueries(1):
+            # The file field is deferred, so reading it on load would query per row
+            list(PostImage.objects.only('caption'))
+
+
+@mock.patch('notification.dispatch.ASYNC', False)
+class BulkEngagementTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader')
+        self.post = Post.objects.create(author=User.objects.create_user('author'), title='Post')
+
+    def apply(self, op):
+        result = engagement.apply_bulk(self.user, [{'op': op, 'id': self.post.id}])
+        return result['results'][0]['changed'], result['posts'][self.post.id]['like_count']
+
+    def test_counters_follow_rows_actually_changed(self):
+        self.assertEqual(self.apply('like'), (True, 1))
+        self.assertEqual(self.apply('like'), (False, 1))
+        self.assertEqual(self.apply('unlike'), (True, 0))
+        self.assertEqual(self.apply('unlike'), (False, 0))
+        self.assertEqual(Like.objects.count(), 0)
+
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(24)
+
+
+class UploadTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create_user('uploader')
+        self.client.force_login(self.user)
+
+    def start(self, size):
+        response = self.client.post('/feed/api/uploads/', {'filename': 'photo.png', 'size': size})
+        self.assertEqual(response.status_code, 201)
+        return response.json()['upload_id']
+
+    def put(self, upload_id, offset, chunk):
+        return self.client.put(
+            f'/feed/api/uploads/{upload_id}/', chunk,
+            content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    def test_unknown_or_foreign_upload_is_not_found(self):
+        foreign = UploadSession.objects.create(user=User.objects.create_user('other'), filename='x.png', size=10)
+        for upload_id in ('00000000-0000-0000-0000-000000000000', foreign.id):
+            self.assertEqual(self.client.get(f'/feed/api/uploads/{upload_id}/').status_code, 404)
+            self.assertEqual(self.client.delete(f'/feed/api/uploads/{upload_id}/').status_code, 404)
+            self.assertEqual(self.client.post(f'/feed/api/uploads/{upload_id}/finalize/').status_code, 404)
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.status, 'pending')
+
+    def test_non_image_is_refused_and_discarded(self):
+        upload_id = self.start(size=20)
+        self.assertEqual(self.put(upload_id, 0, b'definitely not a png').status_code, 415)
+        session = UploadSession.objects.get(id=upload_id)
+        self.assertEqual(session.status, 'aborted')
+        self.assertFalse(os.path.exists(uploads.partial_path(session)))
+
+    def test_racing_chunks_at_the_same_offset_write_once(self):
+        upload_id = self.start(size=len(PNG))
+        winner, loser = UploadSession.objects.get(id=upload_id), UploadSession.objects.get(id=upload_id)
+        other = PNG[:8] + bytes([1]) * 24
+        raced = []
+
+        class Stream(io.BytesIO):
+            def read(stream, size=-1):
+                if not raced:
+                    # The loser's chunk arrives while the winner is streaming
+                    with self.assertRaises(uploads.UploadError) as refused:
+                        uploads.append(loser, io.BytesIO(other), 0, len(other))
+                    raced.append(refused.exception.status)
+                return super().read(size)
+
+        uploads.append(winner, Stream(PNG), 0, len(PNG))
+        self.assertEqual(raced, [409])
+        with open(uploads.partial_path(winner), 'rb') as partial:
+            self.assertEqual(partial.read(), PNG)
+        self.assertEqual(UploadSession.objects.get(id=upload_id).received, len(PNG))
+
+    def test_stale_claim_is_taken_over(self):
+        upload_id = self.start(size=len(PNG))
+        UploadSession.objects.filter(id=upload_id).update(
+            status='writing', updated_at=timezone.now() - datetime.timedelta(seconds=uploads.CLAIM_TIMEOUT + 1)
+        )
+        response = self.put(upload_id, 0, PNG)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['offset'], response.json()['status']), (len(PNG), 'pending'))
+
+    def test_upload_resumes_from_the_offset_received(self):
+        upload_id = self.start(size=len(PNG))
+        self.assertEqual(self.put(upload_id, 0, PNG[:10]).json()['offset'], 10)
+
+        # The client lost the response: ask where to continue, then send the rest
+        self.assertEqual(self.client.get(f'/feed/api/uploads/{upload_id}/')['Upload-Offset'], '10')
+        response = self.put(upload_id, 10, PNG[10:])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['offset'], len(PNG))
+        session = UploadSession.objects.get(id=upload_id)
+        with open(uploads.partial_path(session), 'rb') as partial:
+            self.assertEqual(partial.read(), PNG)
+
+    def test_chunk_at_the_wrong_offset_is_refused(self):
+        upload_id = self.start(size=len(PNG))
+        self.put(upload_id, 0, PNG[:10])
+        for offset in (0, 20):
+            response = self.put(upload_id, offset, PNG[offset:offset + 5])
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual((response['Upload-Offset'], response.json()['offset']), ('10', 10))
+        self.assertEqual(UploadSession.objects.get(id=upload_id).received, 10)
+
+    def test_oversized_chunks_and_files_are_refused(self):
+        response = self.client.post('/feed/api/uploads/', {'filename': 'big.png', 'size': uploads.MAX_SIZE + 1})
+        self.assertEqual(response.status_code, 413)
+        upload_id = self.start(size=len(PNG))
+        self.assertEqual(self.put(upload_id, 0, PNG + b'extra').status_code, 413)
+        with mock.patch('feed.uploads.MAX_CHUNK_SIZE', 8):
+            self.assertEqual(self.put(upload_id, 0, PNG[:9]).status_code, 413)
+        self.assertEqual(UploadSession.objects.get(id=upload_id).received, 0)
+
+    def test_finished_upload_is_stored(self):
+        image = io.BytesIO()
+        Image.new('RGB', (4, 4)).save(image, 'PNG')
+        data = image.getvalue()
+        upload_id = self.start(size=len(data))
+        self.assertEqual(self.client.post(f'/feed/api/uploads/{upload_id}/finalize/').status_code, 409)
+        self.put(upload_id, 0, data)
+        response = self.client.post(f'/feed/api/uploads/{upload_id}/finalize/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['status'], response.json()['content_type']), ('complete', 'image/png'))
+        self.assertTrue(default_storage.exists(UploadSession.objects.get(id=upload_id).stored_name))
+
+
+class CommentRepliesTests(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+
+    def test_missing_comment_is_not_found(self):
+        self.assertEqual(self.client.get('/feed/api/comments/999/replies/').status_code, 404)
+
+    def test_comment_on_private_post_is_not_found(self):
+        post = Post.objects.create(author=self.author, title='Post', is_private=True)
+        comment = Comment.objects.create(post=post, author=self.author, content='Hi')
+        self.assertEqual(self.client.get(f'/feed/api/comments/{comment.id}/replies/').status_code, 404)
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get(f'/feed/api/comments/{comment.id}/replies/').status_code, 200)
+
+
+class EngagementTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader')
+        post = Post.objects.create(author=User.objects.create_user('author'), title='Post')
+        self.comment = Comment.objects.create(post=post, author=post.author, content='Hi')
+
+    def apply(self, active):
+        """(active, count, statements run) of a comment like"""
+        with CaptureQueriesContext(connection) as queries:
+            result = engagement.apply('comment_like', self.user, self.comment.id, active)
+        return result.active, result.count, len([q for q in queries if 'SAVEPOINT' not in q['sql']])
+
+    def test_set_and_unset_are_idempotent_in_two_statements(self):
+        self.assertEqual(self.apply(True), (True, 1, 2))
+        self.assertEqual(self.apply(True), (True, 1, 2))
+        self.assertEqual(self.apply(False), (False, 0, 2))
+        self.assertEqual(self.apply(False), (False, 0, 2))
+
+    def test_toggle_unset_takes_a_third_statement(self):
+        self.assertEqual(self.apply(None), (True, 1, 2))
+        self.assertEqual(self.apply(None), (False, 0, 3))
+        self.assertEqual(CommentLike.objects.count(), 0)
+
+    def test_missing_target(self):
+        with self.assertRaises(engagement.TargetNotFound):
+            engagement.apply('like', self.user, 999, True)
+        self.assertFalse(Like.objects.exists())
+
+
+class PaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        Post.objects.bulk_create([Post(author=cls.author, title=f'Post {i}') for i in range(7)])
+        # Five posts share a timestamp, so only the id tells them apart
+        now = timezone.now()
+        ids = list(Post.objects.order_by('id').values_list('id', flat=True))
+        Post.objects.filter(id__in=ids[1:6]).update(created_at=now)
+        Post.objects.filter(id=ids[0]).update(created_at=now - datetime.timedelta(hours=1))
+        Post.objects.filter(id=ids[6]).update(created_at=now + datetime.timedelta(hours=1))
+        cls.expected = list(Post.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def test_pages_through_ties_without_gaps_or_repeats(self):
+        pages, cursor = [], None
+        while True:
+            rows, pagination = paginate(Post.objects.all(), cursor, page_size=3)
+            pages.append([post.id for post in rows])
+            cursor = pagination['next']
+            if cursor is None:
+                break
+        self.assertEqual(pages, [self.expected[:3], self.expected[3:6], self.expected[6:]])
+
+        # And back again from the last page
+        rows, pagination = paginate(Post.objects.all(), pagination['prev'], page_size=3)
+        self.assertEqual([post.id for post in rows], self.expected[3:6])
+        self.assertTrue(pagination['has_next'])
+
+    def test_tampered_cursor_is_rejected(self):
+        for cursor in ('not-a-cursor', encode_cursor([1]), encode_cursor(['yesterday', 1]), 'eyJrIjo1fQ'):
+            with self.assertRaises(InvalidCursor):
+                paginate(Post.objects.all(), cursor)
+        self.client.force_login(self.author)
+        response = self.client.get('/feed/api/feed/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+@mock.patch('notification.dispatch.ASYNC', False)
+class CounterTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader')
+        self.post = Post.objects.create(author=User.objects.create_user('author'), title='Post')
+
+    def counts(self):
+        self.post.refresh_from_db()
+        return self.post.likes_count, self.post.favorites_count, self.post.comments_count
+
+    def test_rows_move_the_counters(self):
+        like = Like.objects.create(user=self.user, post=self.post)
+        Favorite.objects.create(user=self.user, post=self.post)
+        comment = Comment.objects.create(post=self.post, author=self.user, content='Hi')
+        CommentLike.objects.create(user=self.user, comment=comment)
+        self.assertEqual(self.counts(), (1, 1, 1))
+        comment.refresh_from_db()
+        self.assertEqual(comment.likes_count, 1)
+
+        like.delete()
+        comment.delete()
+        self.assertEqual(self.counts(), (0, 1, 0))
+
+    def test_reconcile_repairs_drift(self):
+        Like.objects.create(user=self.user, post=self.post)
+        other = Post.objects.create(author=self.user, title='Other')
+        Post.objects.filter(pk=self.post.pk).update(likes_count=5, comments_count=2)
+        Post.objects.filter(pk=other.pk).update(favorites_count=3)
+
+        report = counters.reconcile(batch_size=1, dry_run=True)
+        self.assertEqual((report['Post.likes_count'], report['Post.favorites_count']), (1, 1))
+        self.assertEqual(self.counts(), (5, 0, 2))
+
+        call_command('reconcile_counters', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(self.counts(), (1, 0, 0))
+        other.refresh_from_db()
+        self.assertEqual(other.favorites_count, 0)
+        self.assertEqual(sum(counters.reconcile().values()), 0)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "Uses the SQLite FTS5 index")
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+
+    def post(self, title, content=''):
+        return Post.objects.create(author=self.author, title=title, content=content)
+
+    def found(self, text):
+        posts, ranked = search.search(Post.objects.all(), text)
+        self.assertTrue(ranked)
+        return [post.id for post in posts.order_by('search_rank', '-id')]
+
+    def test_title_hits_rank_first_and_prefixes_match(self):
+        in_content = self.post('Weekend away', 'Trams all over Lisbon')
+        in_title = self.post('Lisbon by tram')
+        self.assertEqual(self.found('lisbon'), [in_title.id, in_content.id])
+        self.assertEqual(self.found('lisb'), [in_title.id, in_content.id])
+        self.assertEqual(self.found('lisbon weekend'), [in_content.id])
+
+    def test_index_follows_edits_and_deletes(self):
+        post = self.post('Porto')
+        post.title = 'Madeira'
+        post.save()
+        self.assertEqual(self.found('porto'), [])
+        self.assertEqual(self.found('madeira'), [post.id])
+        post.delete()
+        self.assertEqual(self.found('madeira'), [])
+
+    def test_query_syntax_is_escaped(self):
+        post = self.post('Rock "n" roll and more')
+        for text in ('rock"', '"rock', 'rock:', '{rock}', 'rock*', '-rock', '(rock)', 'rock AND'):
+            self.assertEqual(self.found(text), [post.id], text)
+        # Operators are plain words: this needs "or" and "1" in the post
+        self.assertEqual(self.found("rock' OR 1=1"), [])
+        posts, ranked = search.search(Post.objects.all(), '"*')
+        self.assertFalse(ranked)
+
+    def test_highlights_are_html_escaped(self):
+        post = self.post('<b>Lisbon</b> nights')
+        self.assertEqual(
+            search.highlights('lisbon', [post.id])[post.id]['title'],
+            '&lt;b&gt;<mark>Lisbon</mark>&lt;/b&gt; nights'
+        )
@@ -0,0 +1,136 @@
+"""
+Materialized home timelines.
+
+Every public post is copied into the timeline of its author and of each of
+the author's followers when it is written, so reading a home feed is a
+single indexed range scan over one user's TimelineEntry rows instead of an
+OR over authors joined against the whole Post table.
+"""
+from django.conf import settings
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .models import Post, Follow, TimelineEntry
+
+# How many of an author's recent posts are copied in when someone follows them
+BACKFILL_LIMIT = getattr(settings, 'FEED_TIMELINE_BACKFILL', 50)
+BATCH_SIZE = 1000
+
+
+def _entry(user_id, post):
+    return TimelineEntry(
+        user_id=user_id,
+        post_id=post.id,
+        author_id=post.author_id,
+        created_at=post.created_at,
+    )
+
+
+def fan_out_post(post):
+    """Deliver a public post to its author and every follower of the author"""
+    if post.is_private:
+        return
+    recipients = Follow.objects.filter(following_id=post.author_id).values_list('follower_id', flat=True)
+    batch = [_entry(post.author_id, post)]
+    for follower_id in recipients.iterator():
+        batch.append(_entry(follower_id, post))
+        if len(batch) >= BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def remove_post(post):
+    """Take a post out of every timeline, e.g. when it is made private"""
+    TimelineEntry.objects.filter(post_id=post.id).delete()
+
+
+def sync_post(post):
+    """Bring a post's timeline entries in line with its current privacy"""
+    if post.is_private:
+        remove_post(post)
+    elif not TimelineEntry.objects.filter(user_id=post.author_id, post_id=post.id).exists():
+        fan_out_post(post)
+
+
+def backfill_follow(follower_id, following_id, limit=BACKFILL_LIMIT):
+    """Copy the most recent public posts of a newly followed user into the follower's timeline"""
+    posts = Post.objects.filter(
+        author_id=following_id,
+        is_private=False
+    ).only('id', 'author_id', 'created_at').order_by('-created_at')[:limit]
+    TimelineEntry.objects.bulk_create(
+        [_entry(follower_id, post) for post in posts],
+        ignore_conflicts=True
+    )
+
+
+def backfill_follows(follower_id, following_ids, limit=BACKFILL_LIMIT):
+    """backfill_follow for many newly followed users, with one ranked query"""
+    if not following_ids:
+        return
+    posts = Post.objects.filter(
+        author_id__in=following_ids,
+        is_private=False
+    ).annotate(
+        recency=Window(RowNumber(), partition_by=F('author_id'), order_by=F('created_at').desc())
+    ).filter(recency__lte=limit).only('id', 'author_id', 'created_at')
+    TimelineEntry.objects.bulk_create(
+        [_entry(follower_id, post) for post in posts],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def prune_follow(follower_id, following_id):
+    """Remove an unfollowed user's posts from the follower's timeline"""
+    prune_follows(follower_id, [following_id])
+
+
+def prune_follows(follower_id, following_ids):
+    following_ids = [user_id for user_id in following_ids if user_id != follower_id]
+    if following_ids:
+        TimelineEntry.objects.filter(user_id=follower_id, author_id__in=following_ids).delete()
+
+
+def rebuild_timeline(user_id, limit=None):
+    """Rebuild one user's timeline from their follows and own posts"""
+    TimelineEntry.objects.filter(user_id=user_id).delete()
+    following = Follow.objects.filter(follower_id=user_id).values_list('following_id', flat=True)
+    posts = Post.objects.filter(
+        Q(author_id__in=following) | Q(author_id=user_id),
+        is_private=False
+    ).only('id', 'author_id', 'created_at').order_by('-created_at')
+    if limit:
+        posts = posts[:limit]
+
+    batch = []
+    created = 0
+    for post in posts.iterator():
+        batch.append(_entry(user_id, post))
+        if len(batch) >= BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            created += len(batch)
+            batch = []
+    if batch:
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+        created += len(batch)
+    return created
+
+
+def has_timeline(user_id):
+    return TimelineEntry.objects.filter(user_id=user_id).exists()
+
+
+def timeline_entries(user_id):
+    """Newest-first TimelineEntry queryset for a user"""
+    return TimelineEntry.objects.filter(user_id=user_id).order_by('-created_at', '-post_id')
+
+
+def posts_in_order(post_ids, queryset=None):
+    """Fetch posts by id and return them in the order of post_ids"""
+    if queryset is None:
+        queryset = Post.objects.all()
+    posts = queryset.in_bulk(post_ids)
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
@@ -0,0 +1,276 @@
+"""
+Resumable chunked image uploads.
+
+A client opens an UploadSession with the file name and total size, sends
+the bytes in chunks (each tagged with the offset it starts at), and
+finalizes the session once everything has arrived. Chunks are streamed from
+the request straight into a partial file in storage, so no chunk is held in
+memory, and the size limit and file type (sniffed from the first bytes) are
+enforced while data arrives. After a dropped connection the client asks
+for the current offset and continues from there.
+
+A chunk claims the session at its offset (status 'writing') before it
+touches the file, so of two requests racing at the same offset only one
+writes; the other is refused with 409 and the offset to resume from.
+
+A finalized upload is moved into posts/ and attached to a post by id, so
+the same image is never sent twice.
+"""
+import datetime
+import os
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL import Image
+
+from wheryougo import metrics
+
+from .models import UploadSession, PostImage
+
+MAX_SIZE = getattr(settings, 'UPLOAD_MAX_SIZE', 10 * 1024 * 1024)
+MAX_CHUNK_SIZE = getattr(settings, 'UPLOAD_MAX_CHUNK_SIZE', 5 * 1024 * 1024)
+SESSION_TTL = getattr(settings, 'UPLOAD_SESSION_TTL', 24 * 3600)
+# A claim this old belongs to a request that died mid-chunk
+CLAIM_TIMEOUT = getattr(settings, 'UPLOAD_CLAIM_TIMEOUT', 300)
+READ_BLOCK = 64 * 1024
+PARTIAL_DIR = 'uploads/partial'
+SNIFF_BYTES = 12
+
+# Extension used for the stored file, by sniffed content type
+EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+}
+
+
+class UploadError(Exception):
+    """Rejected upload; `status` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def sniff(head):
+    """Content type from an image's magic bytes, or None"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def partial_path(session):
+    return default_storage.path(f'{PARTIAL_DIR}/{session.id}.part')
+
+
+def start(user, filename, size):
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError('size is required')
+    if size <= 0:
+        raise UploadError('size must be positive')
+    if size > MAX_SIZE:
+        raise UploadError(f'Image file too large. Maximum size is {MAX_SIZE // (1024 * 1024)}MB.', status=413)
+    filename = os.path.basename(filename or '')[:255] or 'image'
+    session = UploadSession.objects.create(user=user, filename=filename, size=size)
+    os.makedirs(os.path.dirname(partial_path(session)), exist_ok=True)
+    open(partial_path(session), 'wb').close()
+    return session
+
+
+def append(session, stream, offset, length):
+    """
+    Write `length` bytes read from `stream` at `offset`. A chunk that does
+    not start where the previous one ended is refused with the offset the
+    client should resume from.
+    """
+    if session.status not in ('pending', 'writing'):
+        raise UploadError('Upload is not accepting data', status=409, offset=session.received)
+    if offset != session.received:
+        raise UploadError('Offset does not match the data received', status=409, offset=session.received)
+    if length <= 0:
+        raise UploadError('Empty chunk')
+    if length > MAX_CHUNK_SIZE:
+        raise UploadError('Chunk too large', status=413, offset=offset)
+    if offset + length > session.size:
+        raise UploadError('Chunk goes past the declared size', status=413, offset=offset)
+
+    claimed_at = _claim(session, offset)
+    if claimed_at is None:
+        session.refresh_from_db(fields=['received', 'status'])
+        if session.status == 'writing':
+            raise UploadError('Another chunk is being written', status=409, offset=session.received)
+        raise UploadError('Offset does not match the data received', status=409, offset=session.received)
+    mine = UploadSession.objects.filter(pk=session.pk, status='writing', updated_at=claimed_at)
+
+    written = 0
+    try:
+        with open(partial_path(session), 'r+b') as target:
+            target.seek(offset)
+            while written < length:
+                block = stream.read(min(READ_BLOCK, length - written))
+                if not block:
+                    break
+                target.write(block)
+                written += len(block)
+                if not session.content_type and offset + written >= min(SNIFF_BYTES, session.size):
+                    target.flush()
+                    _check_type(session, target)
+            target.truncate(offset + written)
+    except UploadError:
+        # Not an image. The partial file is closed by now, so it can be
+        # removed (Windows refuses to delete a file that is still open).
+        abort(session)
+        raise
+    except BaseException:
+        mine.update(status='pending')
+        raise
+
+    advanced = mine.update(
+        status='pending', received=F('received') + written, content_type=session.content_type,
+        updated_at=timezone.now()
+    )
+    session.refresh_from_db(fields=['received', 'status'])
+    metrics.record_upload('chunked', written)
+    if not advanced:
+        # Aborted meanwhile, or the claim timed out and was taken over
+        raise UploadError('Upload is not accepting data', status=409, offset=session.received)
+    if written < length:
+        raise UploadError('Connection closed before the chunk was complete', offset=session.received)
+    return session
+
+
+def _claim(session, offset):
+    """
+    Mark the session as receiving the chunk at `offset`. Returns the claim
+    time, which identifies the claim, or None if the offset has moved or
+    another request holds a live claim.
+    """
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=CLAIM_TIMEOUT)
+    claimed = UploadSession.objects.filter(
+        Q(status='pending') | Q(status='writing', updated_at__lt=stale), pk=session.pk, received=offset
+    ).update(status='writing', updated_at=now)
+    return now if claimed else None
+
+
+def _check_type(session, target):
+    """Set the session's content type from the first bytes; UploadError if it is not an image"""
+    position = target.tell()
+    target.seek(0)
+    content_type = sniff(target.read(SNIFF_BYTES))
+    if content_type is None:
+        raise UploadError('Please upload a valid image file.', status=415)
+    session.content_type = content_type
+    target.seek(position)
+
+
+class _PartialFile(File):
+    """Lets FileSystemStorage move the partial file into place instead of copying it"""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def finish(session):
+    """Verify the complete upload is a readable image and move it into posts/"""
+    if session.status == 'complete':
+        return session
+    if session.status != 'pending':
+        raise UploadError('Upload is not accepting data', status=409)
+    if session.received != session.size:
+        raise UploadError('Upload is incomplete', status=409, offset=session.received)
+
+    path = partial_path(session)
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except Exception:
+        abort(session)
+        raise UploadError('Please upload a valid image file.', status=415)
+
+    stem = os.path.splitext(session.filename)[0] or 'image'
+    name = f'posts/{stem}.{EXTENSIONS[session.content_type]}'
+    with open(path, 'rb') as partial:
+        session.stored_name = default_storage.save(name, _PartialFile(partial, name=name))
+    if os.path.exists(path):
+        os.remove(path)
+    session.status = 'complete'
+    session.save(update_fields=['stored_name', 'status', 'updated_at'])
+    return session
+
+
+def store_file(user, uploaded):
+    """Session for a file that arrived in one piece, e.g. a form upload"""
+    head = uploaded.read(SNIFF_BYTES)
+    uploaded.seek(0)
+    content_type = sniff(head)
+    if content_type is None:
+        raise UploadError('Please upload a valid image file.', status=415)
+    if uploaded.size > MAX_SIZE:
+        raise UploadError(f'Image file too large. Maximum size is {MAX_SIZE // (1024 * 1024)}MB.', status=413)
+    stem = os.path.splitext(os.path.basename(uploaded.name))[0] or 'image'
+    stored_name = default_storage.save(f'posts/{stem}.{EXTENSIONS[content_type]}', uploaded)
+    metrics.record_upload('form', uploaded.size)
+    return UploadSession.objects.create(
+        user=user, filename=os.path.basename(uploaded.name)[:255], content_type=content_type,
+        size=uploaded.size, received=uploaded.size, status='complete', stored_name=stored_name
+    )
+
+
+def attach(user, post, upload_ids, captions=(), first_order=1):
+    """
+    Create PostImages for the user's completed uploads, in the given order.
+    Unknown, foreign or unfinished ids are skipped; returns the images created.
+    """
+    ids = [_as_uuid(upload_id) for upload_id in upload_ids]
+    sessions = UploadSession.objects.in_bulk([upload_id for upload_id in ids if upload_id is not None])
+    images = []
+    for i, upload_id in enumerate(ids):
+        session = sessions.get(upload_id)
+        if session is None or session.user_id != user.id or session.status != 'complete':
+            continue
+        # Claim it first so the same upload cannot end up on two posts
+        if not UploadSession.objects.filter(pk=session.pk, status='complete').update(status='attached'):
+            continue
+        images.append(PostImage.objects.create(
+            post=post,
+            image=session.stored_name,
+            caption=captions[i] if i < len(captions) else '',
+            order=first_order + len(images)
+        ))
+    return images
+
+
+def abort(session):
+    UploadSession.objects.filter(pk=session.pk).update(status='aborted')
+    session.status = 'aborted'
+    path = partial_path(session)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def expired():
+    """Sessions that were never attached to a post and have been idle for SESSION_TTL"""
+    cutoff = timezone.now() - datetime.timedelta(seconds=SESSION_TTL)
+    return UploadSession.objects.exclude(status='attached').filter(updated_at__lt=cutoff)
+
+
+def _as_uuid(value):
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
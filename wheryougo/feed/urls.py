@@ -5,11 +5,16 @@ urlpatterns = [
     # API endpoints for frontend
     path('api/feed/', views.api_feed, name='api_feed'),
     path('api/posts/create/', views.api_create_post, name='api_create_post'),
+    path('api/uploads/', views.api_start_upload, name='api_start_upload'),
+    path('api/uploads/<uuid:upload_id>/', views.api_upload, name='api_upload'),
+    path('api/uploads/<uuid:upload_id>/finalize/', views.api_finish_upload, name='api_finish_upload'),
     path('api/posts/<int:post_id>/', views.api_get_post, name='api_get_post'),
     path('api/posts/<int:post_id>/like/', views.api_toggle_like, name='api_toggle_like'),
     path('api/posts/<int:post_id>/favorite/', views.api_toggle_favorite, name='api_toggle_favorite'),
     path('api/posts/<int:post_id>/comment/', views.api_add_comment, name='api_add_comment'),
+    path('api/comments/<int:comment_id>/replies/', views.api_get_comment_replies, name='api_get_comment_replies'),
     path('api/comments/<int:comment_id>/like/', views.api_toggle_comment_like, name='api_toggle_comment_like'),
+    path('api/engagement/bulk/', views.api_bulk_engagement, name='api_bulk_engagement'),
     path('api/tags/suggestions/', views.api_get_tag_suggestions, name='api_tag_suggestions'),
     path('api/posts/search/', views.api_search_posts, name='api_search_posts'),
     path('api/users/<int:user_id>/posts/', views.api_user_posts, name='api_user_posts'),
@@ -7,10 +7,17 @@ from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_protect
 from django.contrib.auth import logout
-from django.db.models import Q, Count
+from django.db.models import Q
 from django.core.paginator import Paginator
-from .models import Post, Follow, Like, Favorite, PostImage, CommentLike, Comment
-from notification.models import Notification
+from .models import Post, Follow, Like, Favorite, PostImage, CommentLike, Comment, UploadSession
+from .timeline import timeline_entries, posts_in_order
+from .pagination import paginate, wants_count, InvalidCursor
+from .viewer import ViewerContext
+from . import autocomplete, engagement, search, suggestions, uploads
+from .tags import filter_by_tags
+from .response_cache import cache_public_response
+from .comments import load_threads, load_replies
+from notification import notify
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
@@ -37,58 +44,40 @@ def feed(request):
     
     
     following_users = Follow.objects.filter(follower=request.user).values_list('following', flat=True)
-    users = User.objects.select_related('userprofile')[:10]
 
-    posts = Post.objects.filter(
-        Q(author__in=users) | Q(author=request.user),
+    post_queryset = Post.objects.filter(
         is_private=False
-    ).select_related('author').prefetch_related(
-        'images', 'author__userprofile'
-    ).annotate(
-        total_likes=Count('likes', distinct=True),
-        total_favorites=Count('favorites', distinct=True),
-        comment_count = Count('comments', distinct=True)
-    ).order_by('-created_at')
-    
-    if not posts.exists():
-        posts = Post.objects.filter(
-            is_private=False
-        ).select_related('author').prefetch_related(
-            'images', 'author__userprofile'
-        ).annotate(
-            total_likes=Count('likes', distinct=True),
-            total_favorites=Count('favorites', distinct=True)
-        ).order_by('-created_at', '-total_likes')[:20]
+    ).select_related('author__userprofile').prefetch_related('images')
+
+    page_number = request.GET.get('page')
+
+    # Read the viewer's materialized timeline; fall back to recent public posts
+    entries = timeline_entries(request.user.id)
+    if entries.exists():
+        paginator = Paginator(entries.values_list('post_id', flat=True), 10)  # 10 posts per page
+        posts_page = paginator.get_page(page_number)
+        posts_page.object_list = posts_in_order(list(posts_page.object_list), post_queryset)
+    else:
+        paginator = Paginator(post_queryset.order_by('-created_at', '-likes_count')[:20], 10)
+        posts_page = paginator.get_page(page_number)
     
-    # Create lists of liked and favorited post IDs for template
-    user_liked_posts = list(Like.objects.filter(user=request.user).values_list('post_id', flat=True))
-    user_favorited_posts = list(Favorite.objects.filter(user=request.user).values_list('post_id', flat=True))
+    # Resolve liked/favorited/following state for the whole page at once
+    viewer = ViewerContext(request.user, posts_page)
+    user_liked_posts = list(viewer.liked)
+    user_favorited_posts = list(viewer.favorited)
     
-    for post in posts:
-        post.user_has_liked = Like.objects.filter(user=request.user, post=post).exists()
-        post.user_has_favorited = Favorite.objects.filter(user=request.user, post=post).exists()
-        post.is_following_author = Follow.objects.filter(
-            follower=request.user, 
-            following=post.author
-        ).exists() if post.author != request.user else None
+    for post in posts_page:
+        post.user_has_liked = viewer.has_liked(post)
+        post.user_has_favorited = viewer.has_favorited(post)
+        post.is_following_author = viewer.is_following_author(post)
         
         # Add dynamic properties for template
-        post.like_count = post.total_likes
-        post.favorite_count = post.total_favorites
-        post.comment_count = post.comments.count
+        post.like_count = viewer.like_count(post)
+        post.favorite_count = viewer.favorite_count(post)
+        post.comment_count = viewer.comment_count(post)
         post.tags_list = post.get_tags_list()
     
-    paginator = Paginator(posts, 10)  # 10 posts per page
-    page_number = request.GET.get('page')
-    posts_page = paginator.get_page(page_number)
-    
-    suggested_users = User.objects.exclude(
-        id__in=following_users
-    ).exclude(
-        id=request.user.id
-    ).select_related('userprofile').annotate(
-        followers_count=Count('following')
-    ).order_by('-followers_count')[:3]
+    suggested_users = suggestions.suggested_users(request.user, limit=3)
     
     context = {
         'user_profile': user_profile,
@@ -189,6 +178,12 @@ def create_post(request):
                         order=i + 1
                     )
             
+            # Images already sent through ajax_upload_image or an upload session
+            uploads.attach(
+                request.user, post, request.POST.getlist('upload_ids'),
+                captions=image_captions[len(uploaded_images):], first_order=len(uploaded_images) + 1
+            )
+            
             messages.success(request, 'Your post has been created successfully!')
             return redirect('profile')
             
@@ -212,25 +207,21 @@ def ajax_upload_image(request):
         try:
             image = request.FILES['image']
             
-            # Validate image
-            if not image.content_type.startswith('image/'):
-                return JsonResponse({
-                    'success': False,
-                    'error': 'Please upload a valid image file.'
-                })
-            
-            if image.size > 10 * 1024 * 1024:  # 10MB limit
-                return JsonResponse({
-                    'success': False,
-                    'error': 'Image file too large. Maximum size is 10MB.'
-                })
+            # Keep the file so the post form can attach it by upload_id
+            session = uploads.store_file(request.user, image)
             
             return JsonResponse({
                 'success': True,
+                'upload_id': str(session.id),
                 'filename': image.name,
                 'size': image.size
             })
             
+        except uploads.UploadError as e:
+            return JsonResponse({
+                'success': False,
+                'error': str(e)
+            })
         except Exception as e:
             return JsonResponse({
                 'success': False,
@@ -242,89 +233,39 @@ def ajax_upload_image(request):
 @login_required
 def get_tag_suggestions(request):
     """Get popular tags for autocomplete"""
-    query = request.GET.get('q', '').lower()
-    
-    # Get popular tags from existing posts
-    popular_tags = [
-        'travel', 'adventure', 'backpacking', 'solo', 'budget', 'luxury',
-        'beach', 'mountain', 'city', 'nature', 'photography', 'food',
-        'culture', 'history', 'wildlife', 'roadtrip', 'europe', 'asia',
-        'america', 'africa', 'oceania', 'family', 'friends', 'couple'
-    ]
-    
-    if query:
-        suggestions = [tag for tag in popular_tags if query in tag]
-    else:
-        suggestions = popular_tags[:10]  # Show top 10
+    query = request.GET.get('q', '')
+    suggestions = autocomplete.suggest(query, limit=10)
     
     return JsonResponse({'suggestions': suggestions})
 
 @login_required
 def toggle_like(request, post_id):
     if request.method == "POST":
-        post = get_object_or_404(Post, id=post_id)
-        liked = Like.objects.filter(user=request.user, post=post).first()
-        if liked:
-            liked.delete()
-            liked_status = False
-            Notification.objects.filter(
-                to_user=post.author,
-                from_user=request.user,
-                notif_type='like',
-                post=post
-            ).delete()
-        else:
-            Like.objects.create(user=request.user, post=post)
-            liked_status = True
-            
-            if post.author != request.user:
-                Notification.objects.create(
-                    to_user=post.author,
-                    from_user=request.user,
-                    notification_type='like',
-                    post=post
-                )
-
-        like_count = Like.objects.filter(post=post).count()
-        return JsonResponse({'success': True, 'liked': liked_status, 'like_count': like_count})
+        try:
+            result = engagement.apply('like', request.user, post_id)
+        except engagement.TargetNotFound:
+            return JsonResponse({'success': False}, status=404)
+        return JsonResponse({'success': True, 'liked': result.active, 'like_count': result.count})
     return JsonResponse({'success': False}, status=400)
 
 @login_required
 def toggle_favorite(request, post_id):
     if request.method == 'POST':
-        post = get_object_or_404(Post, id=post_id)
-        favorite = Favorite.objects.filter(user=request.user, post=post).first()
-        if favorite:
-            favorite.delete()
-            favorite_status = False
-        else:
-            Favorite.objects.create(user=request.user, post=post)
-            favorite_status=True
-
-            if post.author != request.user:
-                Notification.objects.create(
-                    to_user=post.author,
-                    from_user=request.user,
-                    notification_type='favorite',
-                    post=post
-                )
-        favorite_count = Favorite.objects.filter(post=post).count()
-        return JsonResponse({'success': True, 'favorited': favorite_status, 'favorite_count': favorite_count})
+        try:
+            result = engagement.apply('favorite', request.user, post_id)
+        except engagement.TargetNotFound:
+            return JsonResponse({'success': False}, status=404)
+        return JsonResponse({'success': True, 'favorited': result.active, 'favorite_count': result.count})
     return JsonResponse({'success': False}, status=400)
 
 @login_required
 def toggle_comment_like(request, comment_id):
     if request.method == 'POST':
-        comment = get_object_or_404(CommentLike, id=comment_id)
-        comment_like = CommentLike.objects.filter(user=request.user,comment=comment).first()
-        if comment_like:
-            comment_like.delete()
-            comment_like_status = False
-        else:
-            CommentLike.objects.create(user=request.user, comment=comment)
-            comment_like_status=True
-        comment_like_count = CommentLike.objects.filter(comment=comment).count()
-        return JsonResponse({'success': True, 'liked': comment_like_status, 'like_count': comment_like_count})
+        try:
+            result = engagement.apply('comment_like', request.user, comment_id)
+        except engagement.TargetNotFound:
+            return JsonResponse({'success': False}, status=404)
+        return JsonResponse({'success': True, 'liked': result.active, 'like_count': result.count})
     return JsonResponse({'success': False}, status=400)
 
 @login_required
@@ -355,15 +296,9 @@ def comment(request, post_id):
         
         content = request.POST.get('comment', '').strip()
         if content:
-            Comment.objects.create(post=post, author=request.user, content=content)
+            new_comment = Comment.objects.create(post=post, author=request.user, content=content)
             messages.success(request, "Comment added!")
-            if post.author != request.user:
-                Notification.objects.create(
-                    to_user=post.author,
-                    from_user=request.user,
-                    notification_type='comment',
-                    post=post
-                )
+            notify.send(post.author_id, request.user, 'comment', post_id=post.id, comment_id=new_comment.id)
             
             return redirect('view_post', post_id=post.id)
         else:
@@ -376,56 +311,35 @@ def comment(request, post_id):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticatedOrReadOnly])
+@cache_public_response('feed')
 def api_feed(request):
     """
     Get feed posts with all necessary data for frontend
     """
     try:
+        posts = Post.objects.filter(
+            is_private=False
+        ).select_related('author__userprofile').prefetch_related('images')
+        cursor = request.GET.get('cursor')
+
         # Get following users for the authenticated user
+        entries = None
         if request.user.is_authenticated:
             following_users = Follow.objects.filter(follower=request.user).values_list('following', flat=True)
-            users = User.objects.select_related('userprofile')[:10]
-            
-            # Get posts from following users and user's own posts
-            posts = Post.objects.filter(
-                Q(author__in=users) | Q(author=request.user),
-                is_private=False
-            ).select_related('author').prefetch_related(
-                'images', 'author__userprofile', 'likes', 'favorites', 'comments'
-            ).annotate(
-                total_likes=Count('likes', distinct=True),
-                total_favorites=Count('favorites', distinct=True),
-                comment_count=Count('comments', distinct=True)
-            ).order_by('-created_at')
-            
-            # If no posts from following users, get popular posts
-            if not posts.exists():
-                posts = Post.objects.filter(
-                    is_private=False
-                ).select_related('author').prefetch_related(
-                    'images', 'author__userprofile', 'likes', 'favorites', 'comments'
-                ).annotate(
-                    total_likes=Count('likes', distinct=True),
-                    total_favorites=Count('favorites', distinct=True),
-                    comment_count=Count('comments', distinct=True)
-                ).order_by('-created_at', '-total_likes')[:20]
-                
+            entries = timeline_entries(request.user.id)
+        
+        if entries is not None and entries.exists():
+            # Page through the viewer's materialized timeline by index
+            page_entries, pagination = paginate(
+                entries.only('post_id', 'created_at'), cursor,
+                ordering=('-created_at', '-post_id'), with_count=wants_count(request)
+            )
+            posts_page = posts_in_order([entry.post_id for entry in page_entries], posts)
         else:
-            # For anonymous users, show public posts only
-            posts = Post.objects.filter(
-                is_private=False
-            ).select_related('author').prefetch_related(
-                'images', 'author__userprofile', 'likes', 'favorites', 'comments'
-            ).annotate(
-                total_likes=Count('likes', distinct=True),
-                total_favorites=Count('favorites', distinct=True),
-                comment_count=Count('comments', distinct=True)
-            ).order_by('-created_at')[:20]
-        
-        # Pagination
-        paginator = Paginator(posts, 10)
-        page_number = request.GET.get('page', 1)
-        posts_page = paginator.get_page(page_number)
+            # Empty timeline or anonymous user: show recent public posts
+            posts_page, pagination = paginate(
+                posts, cursor, ordering=('-created_at', '-id'), with_count=wants_count(request)
+            )
         
         # Serialize posts
         serializer = PostSerializer(posts_page, many=True, context={'request': request})
@@ -433,30 +347,21 @@ def api_feed(request):
         # Get suggested users
         suggested_users = []
         if request.user.is_authenticated:
-            suggested_users_qs = User.objects.exclude(
-                id__in=following_users if 'following_users' in locals() else []
-            ).exclude(
-                id=request.user.id
-            ).select_related('userprofile').annotate(
-                followers_count=Count('following')
-            ).order_by('-followers_count')[:5]
-            
-            suggested_users = UserSerializer(suggested_users_qs, many=True, context={'request': request}).data
+            suggested_users = UserSerializer(
+                suggestions.suggested_users(request.user, limit=5),
+                many=True, context={'request': request}
+            ).data
         
         return Response({
             'posts': serializer.data,
             'suggested_users': suggested_users,
-            'pagination': {
-                'current_page': posts_page.number,
-                'total_pages': paginator.num_pages,
-                'has_next': posts_page.has_next(),
-                'has_previous': posts_page.has_previous(),
-                'total_posts': paginator.count
-            },
+            'pagination': pagination,
             'user_authenticated': request.user.is_authenticated,
             'following_count': following_users.count() if request.user.is_authenticated and 'following_users' in locals() else 0
         })
         
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({
             'error': str(e)
@@ -505,7 +410,12 @@ def api_create_post(request):
         
         # Handle image uploads
         uploaded_images = request.FILES.getlist('images')
-        image_captions = request.data.getlist('image_captions')
+        if hasattr(request.data, 'getlist'):
+            image_captions = request.data.getlist('image_captions')
+            upload_ids = request.data.getlist('upload_ids')
+        else:
+            image_captions = list(request.data.get('image_captions') or [])
+            upload_ids = request.data.get('upload_ids') or []
         
         # Ensure captions list matches images list
         while len(image_captions) < len(uploaded_images):
@@ -527,6 +437,12 @@ def api_create_post(request):
                     order=i + 1
                 )
         
+        # Images uploaded beforehand in chunks
+        uploads.attach(
+            request.user, post, upload_ids,
+            captions=image_captions[len(uploaded_images):], first_order=len(uploaded_images) + 1
+        )
+        
         # Return serialized post
         serializer = PostSerializer(post, context={'request': request})
         return Response({
@@ -542,15 +458,14 @@ def api_create_post(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticatedOrReadOnly])
+@cache_public_response('post')
 def api_get_post(request, post_id):
     """
     Get a single post with all details
     """
     try:
         post = get_object_or_404(
-            Post.objects.prefetch_related(
-                'images', 'likes__user', 'comments__author', 'favorites__user'
-            ), 
+            Post.objects.select_related('author__userprofile').prefetch_related('images'),
             id=post_id
         )
         
@@ -562,102 +477,72 @@ def api_get_post(request, post_id):
         
         serializer = PostSerializer(post, context={'request': request})
         
-        # Get comments for this post
-        comments = Comment.objects.filter(post=post).select_related('author').prefetch_related('likes')
-        comments_serializer = CommentSerializer(comments, many=True, context={'request': request})
+        # One page of top-level threads, each with its first replies
+        threads, comments_pagination, liked = load_threads(
+            post, request.user, request.GET.get('comments_cursor')
+        )
+        comments_serializer = CommentSerializer(
+            threads, many=True, context={'request': request, 'liked_comments': liked}
+        )
         
         return Response({
             'post': serializer.data,
-            'comments': comments_serializer.data
+            'comments': comments_serializer.data,
+            'comments_pagination': comments_pagination
         })
         
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({
             'error': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-@api_view(['POST'])
+@api_view(['POST', 'PUT', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def api_toggle_like(request, post_id):
     """
-    Toggle like on a post
+    Like on a post: PUT sets it, DELETE removes it, POST toggles it
     """
     try:
-        post = get_object_or_404(Post, id=post_id)
-        liked = Like.objects.filter(user=request.user, post=post).first()
-        
-        if liked:
-            liked.delete()
-            liked_status = False
-            # Remove notification
-            Notification.objects.filter(
-                to_user=post.author,
-                from_user=request.user,
-                notification_type='like',
-                post=post
-            ).delete()
-        else:
-            Like.objects.create(user=request.user, post=post)
-            liked_status = True
-            
-            # Create notification
-            if post.author != request.user:
-                Notification.objects.create(
-                    to_user=post.author,
-                    from_user=request.user,
-                    notification_type='like',
-                    post=post
-                )
-        
-        like_count = post.likes.count()
+        result = engagement.apply('like', request.user, post_id, engagement.requested_state(request.method))
         
         return Response({
             'success': True,
-            'liked': liked_status,
-            'like_count': like_count
+            'liked': result.active,
+            'like_count': result.count
         })
         
+    except engagement.TargetNotFound:
+        return Response({
+            'error': 'Post not found'
+        }, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({
             'error': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-@api_view(['POST'])
+@api_view(['POST', 'PUT', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def api_toggle_favorite(request, post_id):
     """
-    Toggle favorite on a post
+    Favorite on a post: PUT sets it, DELETE removes it, POST toggles it
     """
     try:
-        post = get_object_or_404(Post, id=post_id)
-        favorite = Favorite.objects.filter(user=request.user, post=post).first()
-        
-        if favorite:
-            favorite.delete()
-            favorite_status = False
-        else:
-            Favorite.objects.create(user=request.user, post=post)
-            favorite_status = True
-            
-            # Create notification
-            if post.author != request.user:
-                Notification.objects.create(
-                    to_user=post.author,
-                    from_user=request.user,
-                    notification_type='favorite',
-                    post=post
-                )
-        
-        favorite_count = post.favorites.count()
+        result = engagement.apply('favorite', request.user, post_id, engagement.requested_state(request.method))
         
         return Response({
             'success': True,
-            'favorited': favorite_status,
-            'favorite_count': favorite_count
+            'favorited': result.active,
+            'favorite_count': result.count
         })
         
+    except engagement.TargetNotFound:
+        return Response({
+            'error': 'Post not found'
+        }, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({
             'error': str(e)
@@ -693,13 +578,7 @@ def api_add_comment(request, post_id):
         )
         
         # Create notification
-        if post.author != request.user:
-            Notification.objects.create(
-                to_user=post.author,
-                from_user=request.user,
-                notification_type='comment',
-                post=post
-            )
+        notify.send(post.author_id, request.user, 'comment', post_id=post.id, comment_id=comment.id)
         
         serializer = CommentSerializer(comment, context={'request': request})
         
@@ -715,29 +594,88 @@ def api_add_comment(request, post_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-@api_view(['POST'])
+@api_view(['GET'])
+@permission_classes([IsAuthenticatedOrReadOnly])
+def api_get_comment_replies(request, comment_id):
+    """
+    Get the next page of replies to a comment
+    """
+    try:
+        comment = Comment.objects.select_related('post').filter(id=comment_id).first()
+        if comment is None:
+            return Response({
+                'error': 'Comment not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        if comment.post.is_private and request.user != comment.post.author:
+            return Response({
+                'error': 'Post not found or private'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        replies, pagination, liked = load_replies(comment, request.user, request.GET.get('cursor'))
+        serializer = CommentSerializer(
+            replies, many=True, context={'request': request, 'liked_comments': liked}
+        )
+        
+        return Response({
+            'replies': serializer.data,
+            'pagination': pagination
+        })
+        
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['POST', 'PUT', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def api_toggle_comment_like(request, comment_id):
     """
-    Toggle like on a comment
+    Like on a comment: PUT sets it, DELETE removes it, POST toggles it
     """
     try:
-        comment = get_object_or_404(Comment, id=comment_id)
-        comment_like = CommentLike.objects.filter(user=request.user, comment=comment).first()
+        result = engagement.apply('comment_like', request.user, comment_id, engagement.requested_state(request.method))
         
-        if comment_like:
-            comment_like.delete()
-            liked_status = False
-        else:
-            CommentLike.objects.create(user=request.user, comment=comment)
-            liked_status = True
+        return Response({
+            'success': True,
+            'liked': result.active,
+            'like_count': result.count
+        })
         
-        like_count = comment.likes.count()
+    except engagement.TargetNotFound:
+        return Response({
+            'error': 'Comment not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def api_bulk_engagement(request):
+    """
+    Apply many likes, favorites and follows at once, e.g.
+    {"operations": [{"op": "like", "id": 12}, {"op": "unfollow", "id": 3}]}
+    """
+    try:
+        operations = request.data.get('operations')
+        if not isinstance(operations, list) or not operations:
+            return Response({
+                'error': 'operations must be a non-empty list'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if len(operations) > engagement.MAX_BULK_OPERATIONS:
+            return Response({
+                'error': f'At most {engagement.MAX_BULK_OPERATIONS} operations per request'
+            }, status=status.HTTP_400_BAD_REQUEST)
         
         return Response({
             'success': True,
-            'liked': liked_status,
-            'like_count': like_count
+            **engagement.apply_bulk(request.user, operations)
         })
         
     except Exception as e:
@@ -752,22 +690,8 @@ def api_get_tag_suggestions(request):
     """
     Get tag suggestions for autocomplete
     """
-    query = request.GET.get('q', '').lower()
-    
-    # Popular travel tags
-    popular_tags = [
-        'travel', 'adventure', 'backpacking', 'solo', 'budget', 'luxury',
-        'beach', 'mountain', 'city', 'nature', 'photography', 'food',
-        'culture', 'history', 'wildlife', 'roadtrip', 'europe', 'asia',
-        'america', 'africa', 'oceania', 'family', 'friends', 'couple',
-        'hiking', 'camping', 'hotel', 'hostel', 'restaurant', 'museum',
-        'sunset', 'sunrise', 'landscape', 'street', 'architecture'
-    ]
-    
-    if query:
-        suggestions = [tag for tag in popular_tags if query in tag]
-    else:
-        suggestions = popular_tags[:10]
+    query = request.GET.get('q', '')
+    suggestions = autocomplete.suggest(query, limit=10)
     
     return Response({
         'suggestions': suggestions
@@ -776,6 +700,7 @@ def api_get_tag_suggestions(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticatedOrReadOnly])
+@cache_public_response('search')
 def api_search_posts(request):
     """
     Search posts by title, content, tags, or location
@@ -788,13 +713,10 @@ def api_search_posts(request):
         
         posts = Post.objects.filter(is_private=False)
         
+        # Match against the full-text index; the filters below narrow its hits
+        ranked = False
         if query:
-            posts = posts.filter(
-                Q(title__icontains=query) |
-                Q(content__icontains=query) |
-                Q(tags__icontains=query) |
-                Q(location__icontains=query)
-            )
+            posts, ranked = search.search(posts, query)
         
         if post_type:
             posts = posts.filter(post_type=post_type)
@@ -803,37 +725,33 @@ def api_search_posts(request):
             posts = posts.filter(location__icontains=location)
         
         if tags:
-            tag_list = [tag.strip() for tag in tags.split(',')]
-            for tag in tag_list:
-                posts = posts.filter(tags__icontains=tag)
-        
-        posts = posts.select_related('author').prefetch_related(
-            'images', 'author__userprofile'
-        ).annotate(
-            total_likes=Count('likes', distinct=True),
-            total_favorites=Count('favorites', distinct=True),
-            comment_count=Count('comments', distinct=True)
-        ).order_by('-total_likes', '-created_at')
-        
-        # Pagination
-        paginator = Paginator(posts, 10)
-        page_number = request.GET.get('page', 1)
-        posts_page = paginator.get_page(page_number)
+            # Whole-tag intersection on the PostTag index ("asia" no longer matches "fantasia")
+            posts = filter_by_tags(posts, tags.split(','))
+        
+        posts = posts.select_related('author__userprofile').prefetch_related('images')
+        
+        # Most relevant (or most liked) first; id breaks ties so every row has a unique cursor
+        posts_page, pagination = paginate(
+            posts, request.GET.get('cursor'),
+            ordering=('search_rank', '-id') if ranked else ('-likes_count', '-id'),
+            with_count=wants_count(request)
+        )
         
         serializer = PostSerializer(posts_page, many=True, context={'request': request})
+        results = serializer.data
+        if ranked:
+            snippets = search.highlights(query, [post.id for post in posts_page])
+            for post_data in results:
+                post_data['highlight'] = snippets.get(post_data['id'])
         
         return Response({
-            'posts': serializer.data,
-            'pagination': {
-                'current_page': posts_page.number,
-                'total_pages': paginator.num_pages,
-                'has_next': posts_page.has_next(),
-                'has_previous': posts_page.has_previous(),
-                'total_posts': paginator.count
-            },
+            'posts': results,
+            'pagination': pagination,
             'query': query
         })
         
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({
             'error': str(e)
@@ -863,18 +781,12 @@ def api_user_posts(request, user_id=None):
             # User viewing their own posts - show all
             posts = Post.objects.filter(author=user)
         
-        posts = posts.select_related('author').prefetch_related(
-            'images', 'author__userprofile'
-        ).annotate(
-            total_likes=Count('likes', distinct=True),
-            total_favorites=Count('favorites', distinct=True),
-            comment_count=Count('comments', distinct=True)
-        ).order_by('-created_at')
-        
-        # Pagination
-        paginator = Paginator(posts, 10)
-        page_number = request.GET.get('page', 1)
-        posts_page = paginator.get_page(page_number)
+        posts = posts.select_related('author__userprofile').prefetch_related('images')
+        
+        posts_page, pagination = paginate(
+            posts, request.GET.get('cursor'),
+            ordering=('-created_at', '-id'), with_count=wants_count(request)
+        )
         
         serializer = PostSerializer(posts_page, many=True, context={'request': request})
         user_serializer = UserSerializer(user, context={'request': request})
@@ -882,15 +794,116 @@ def api_user_posts(request, user_id=None):
         return Response({
             'user': user_serializer.data,
             'posts': serializer.data,
-            'pagination': {
-                'current_page': posts_page.number,
-                'total_pages': paginator.num_pages,
-                'has_next': posts_page.has_next(),
-                'has_previous': posts_page.has_previous(),
-                'total_posts': paginator.count
-            }
+            'pagination': pagination
         })
         
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _upload_state(session):
+    return {
+        'upload_id': str(session.id),
+        'filename': session.filename,
+        'size': session.size,
+        'offset': session.received,
+        'status': session.status,
+        'content_type': session.content_type,
+    }
+
+
+def _upload_error(e):
+    body = {'error': str(e)}
+    if e.offset is not None:
+        body['offset'] = e.offset
+    response = Response(body, status=e.status)
+    if e.offset is not None:
+        response['Upload-Offset'] = str(e.offset)
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def api_start_upload(request):
+    """
+    Open a chunked upload session for an image of the given size
+    """
+    try:
+        session = uploads.start(request.user, request.data.get('filename'), request.data.get('size'))
+        return Response({
+            **_upload_state(session),
+            'chunk_size': uploads.MAX_CHUNK_SIZE
+        }, status=status.HTTP_201_CREATED)
+        
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    except Exception as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET', 'PUT', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def api_upload(request, upload_id):
+    """
+    GET: offset to resume from. PUT: raw chunk starting at the Upload-Offset
+    header. DELETE: abort the upload.
+    """
+    try:
+        session = UploadSession.objects.filter(id=upload_id, user=request.user).first()
+        if session is None:
+            return Response({
+                'error': 'Upload not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        if request.method == 'PUT':
+            try:
+                offset = int(request.headers.get('Upload-Offset', ''))
+                length = int(request.headers.get('Content-Length', ''))
+            except ValueError:
+                return Response({
+                    'error': 'Upload-Offset and Content-Length headers are required'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            # The body is read straight from the request stream, never parsed
+            session = uploads.append(session, request._request, offset, length)
+        elif request.method == 'DELETE':
+            uploads.abort(session)
+        
+        response = Response(_upload_state(session))
+        response['Upload-Offset'] = str(session.received)
+        return response
+        
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    except Exception as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def api_finish_upload(request, upload_id):
+    """
+    Finalize a fully received upload; its upload_id can then be passed to
+    api_create_post
+    """
+    try:
+        session = UploadSession.objects.filter(id=upload_id, user=request.user).first()
+        if session is None:
+            return Response({
+                'error': 'Upload not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+        session = uploads.finish(session)
+        return Response(_upload_state(session))
+        
+    except uploads.UploadError as e:
+        return _upload_error(e)
     except Exception as e:
         return Response({
             'error': str(e)
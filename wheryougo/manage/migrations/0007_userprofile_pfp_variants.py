@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manage', '0006_userprofile_portfolio_userprofile_youtube_channel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='pfp_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -7,6 +7,7 @@ class UserProfile(models.Model):
     name = models.CharField(max_length=150)
     date_of_birth = models.DateField(null=True, blank=True)
     pfp = models.ImageField(upload_to='profiles/', null=True, blank=True)
+    pfp_variants = models.JSONField(default=dict, blank=True, editable=False)
     bio = models.TextField(max_length=500, blank=True)
     location = models.CharField(max_length=100, blank=True)
     user_type = models.CharField(max_length=20, choices=[
@@ -0,0 +1,24 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from feed import blobs, derivatives, fragments
+
+from .models import UserProfile
+
+
+@receiver(pre_save, sender=UserProfile)
+def remember_pfp(sender, instance, update_fields=None, **kwargs):
+    blobs.remember(instance, update_fields)
+
+
+@receiver(post_save, sender=UserProfile)
+def profile_saved(sender, instance, **kwargs):
+    """Count the picture's blob reference, resize it, and refresh the author's cached posts"""
+    blobs.saved(instance)
+    derivatives.schedule(instance)
+    fragments.invalidate_author(instance.user_id)
+
+
+@receiver(post_delete, sender=UserProfile)
+def release_pfp(sender, instance, **kwargs):
+    blobs.deleted(instance)
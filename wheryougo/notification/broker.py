@@ -0,0 +1,93 @@
+"""
+Delivery of notification events to connected clients.
+
+notify and unread publish an event per affected user once their transaction
+commits; the stream view subscribes for the signed-in user and forwards the
+events as Server-Sent Events. The broker class comes from
+NOTIFICATION_BROKER. The default InProcessBroker only reaches subscribers in
+the same process, which suits a single ASGI worker and the tests; several
+workers need a broker backed by a shared channel (e.g. Redis pub/sub)
+implementing the same three methods.
+"""
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+QUEUE_SIZE = 100
+
+
+class Broker(ABC):
+
+    @abstractmethod
+    def publish(self, user_id, event):
+        """Deliver a JSON-serializable event to the user's subscribers"""
+
+    @abstractmethod
+    def subscribe(self, user_id):
+        """Return an asyncio.Queue that receives the user's events"""
+
+    @abstractmethod
+    def unsubscribe(self, user_id, queue):
+        """Stop delivering to a queue returned by subscribe()"""
+
+    def listening(self, user_ids):
+        """The users among `user_ids` worth building events for"""
+        return set(user_ids)
+
+
+class InProcessBroker(Broker):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # user_id -> {queue: event loop}
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(user_id, {})[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        with self._lock:
+            queues = self._subscribers.get(user_id, {})
+            queues.pop(queue, None)
+            if not queues:
+                self._subscribers.pop(user_id, None)
+
+    def listening(self, user_ids):
+        with self._lock:
+            return {user_id for user_id in user_ids if user_id in self._subscribers}
+
+    def publish(self, user_id, event):
+        # Called from sync code in any thread; hand over to each queue's loop
+        with self._lock:
+            queues = list(self._subscribers.get(user_id, {}).items())
+        for queue, loop in queues:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # The subscriber's loop is gone
+                self.unsubscribe(user_id, queue)
+
+
+def _offer(queue, event):
+    # A client that stopped reading loses events rather than growing the queue
+    if not queue.full():
+        queue.put_nowait(event)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(
+                getattr(settings, 'NOTIFICATION_BROKER', 'notification.broker.InProcessBroker')
+            )()
+        return _broker
@@ -0,0 +1,166 @@
+"""
+Background notification writes.
+
+With NOTIFICATION_ASYNC on, notify records each write as a NotificationJob
+row inside the request's own transaction, so a job exists exactly when the
+like, comment or follow that caused it was committed. Once the transaction
+commits, a worker thread in the process is woken: it waits up to
+FLUSH_INTERVAL seconds for more jobs, claims up to BATCH_SIZE due jobs by
+deleting them (DELETE ... RETURNING, so two workers never claim the same
+job), merges consecutive jobs of the same kind by the same actor into one
+call, and applies them in the claiming transaction. A job is therefore gone
+exactly when its notifications are written.
+
+If a batch fails it is rolled back and retried job by job; a job that still
+fails stays in the table with its attempts counted and is retried after a
+growing delay, never dropped. Jobs left behind by a process that was killed
+or restarted are picked up by any worker's next poll (every POLL_INTERVAL
+seconds) or by the process_notification_jobs command.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.db import close_old_connections, connection, transaction
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import NotificationJob
+
+ASYNC = getattr(settings, 'NOTIFICATION_ASYNC', True)
+FLUSH_INTERVAL = getattr(settings, 'NOTIFICATION_FLUSH_INTERVAL', 0.2)
+BATCH_SIZE = getattr(settings, 'NOTIFICATION_BATCH_SIZE', 500)
+POLL_INTERVAL = 5
+MAX_BACKOFF = 600
+RETRIES_BEFORE_ERROR = 3
+
+logger = logging.getLogger(__name__)
+
+_worker = None
+_worker_lock = threading.Lock()
+_wake = threading.Event()
+
+
+def submit(write, actor, notification_type, items):
+    """Have write(actor, notification_type, items) run once the current transaction commits"""
+    if not ASYNC:
+        write(actor, notification_type, items)
+        return
+    NotificationJob.objects.create(
+        write=f'{write.__module__}.{write.__qualname__}', actor=actor,
+        notification_type=notification_type, items=[list(item) for item in items]
+    )
+    _start()
+    transaction.on_commit(_wake.set)
+
+
+def flush():
+    """Apply every due job now, in this thread; returns how many were applied"""
+    applied = 0
+    while True:
+        count = _process(BATCH_SIZE)
+        if not count:
+            return applied
+        applied += count
+
+
+def _start():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name='notification-dispatch', daemon=True)
+            _worker.start()
+
+
+def _run():
+    while True:
+        if _wake.wait(POLL_INTERVAL):
+            # Let a burst of jobs pile up into one batch
+            time.sleep(FLUSH_INTERVAL)
+        _wake.clear()
+        try:
+            close_old_connections()
+            flush()
+        except Exception:
+            logger.exception('Processing notification jobs failed')
+        finally:
+            close_old_connections()
+
+
+def _claim(limit, job_id=None):
+    """Delete and return due jobs, oldest first, inside the current transaction"""
+    table = NotificationJob._meta.db_table
+    if job_id is not None:
+        condition, params = 'id = %s', [job_id]
+    else:
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        condition = f'id IN (SELECT id FROM {table} WHERE run_after <= %s ORDER BY run_after, id LIMIT %s)'
+        params = [now, limit]
+    items_field = NotificationJob._meta.get_field('items')
+    with connection.cursor() as cursor:
+        # A write as the first statement: the transaction takes the write lock
+        # up front, and concurrent workers cannot claim the same rows
+        cursor.execute(
+            f'DELETE FROM {table} WHERE {condition} '
+            f'RETURNING id, write, actor_id, notification_type, items',
+            params
+        )
+        rows = sorted(cursor.fetchall())
+    actors = User.objects.in_bulk({row[2] for row in rows})
+    return [
+        (row_id, write, actors[actor_id], notification_type, items_field.from_db_value(items, None, connection))
+        for row_id, write, actor_id, notification_type, items in rows
+        if actor_id in actors
+    ]
+
+
+def _merged(jobs):
+    """Consecutive jobs with the same write, actor and type, as single jobs"""
+    merged = []
+    for _, write, actor, notification_type, items in jobs:
+        last = merged[-1] if merged else None
+        if last and last[0] == write and last[1].pk == actor.pk and last[2] == notification_type:
+            last[3].extend(items)
+        else:
+            merged.append((write, actor, notification_type, list(items)))
+    return merged
+
+
+def _apply(jobs):
+    for write, actor, notification_type, items in _merged(jobs):
+        import_string(write)(actor, notification_type, [tuple(item) for item in items])
+
+
+def _process(limit):
+    """Claim and apply one batch; returns the number of jobs applied"""
+    try:
+        with transaction.atomic():
+            jobs = _claim(limit)
+            _apply(jobs)
+        return len(jobs)
+    except Exception:
+        logger.warning('Notification batch failed, retrying job by job', exc_info=True)
+
+    now = timezone.now()
+    due = list(NotificationJob.objects.filter(run_after__lte=now).order_by('run_after', 'id').values_list(
+        'id', 'attempts'
+    )[:limit])
+    applied = 0
+    for job_id, attempts in due:
+        try:
+            with transaction.atomic():
+                jobs = _claim(1, job_id)
+                _apply(jobs)
+            applied += len(jobs)
+        except Exception:
+            log = logger.error if attempts + 1 >= RETRIES_BEFORE_ERROR else logger.warning
+            log('Notification job %s failed (attempt %d), will retry', job_id, attempts + 1, exc_info=True)
+            NotificationJob.objects.filter(pk=job_id).update(
+                attempts=F('attempts') + 1,
+                run_after=timezone.now() + timedelta(seconds=min(2 ** attempts, MAX_BACKOFF))
+            )
+    return applied
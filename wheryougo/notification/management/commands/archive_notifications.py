@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from notification import retention
+
+
+def _megabytes(size):
+    return f"{size / (1024 * 1024):.1f}MB"
+
+
+class Command(BaseCommand):
+    help = "Move seen notifications past their retention into a compressed archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Rows archived and deleted per transaction")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many rows would be archived")
+        parser.add_argument('--vacuum', action='store_true',
+                            help="Compact the SQLite file afterwards (locks the database while it runs)")
+
+    def handle(self, *args, **options):
+        report = retention.archive(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"Would archive {report['rows']} notifications"))
+            return
+
+        if report['file']:
+            self.stdout.write(f"Wrote {report['file']} ({_megabytes(report['archive_bytes'])})")
+        if report['freed_bytes'] is not None:
+            self.stdout.write(f"Freed {_megabytes(report['freed_bytes'])} inside the database")
+        if options['vacuum']:
+            released = retention.vacuum()
+            if released is not None:
+                self.stdout.write(f"Vacuum released {_megabytes(released)} to the file system")
+        self.stdout.write(self.style.SUCCESS(f"Archived {report['rows']} notifications"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from notification import dispatch
+
+
+class Command(BaseCommand):
+    help = "Write the queued notification jobs that are due, e.g. after a crash or from cron"
+
+    def handle(self, *args, **options):
+        applied = dispatch.flush()
+        self.stdout.write(self.style.SUCCESS(f"{applied} notification jobs processed"))
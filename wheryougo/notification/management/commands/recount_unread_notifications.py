@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from notification.unread import recount
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-user unread notification counters from the notifications"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            help="Only recount this user id (repeatable)")
+
+    def handle(self, *args, **options):
+        fixed = recount(options['user'])
+        self.stdout.write(self.style.SUCCESS(f"{fixed} unread counters repaired"))
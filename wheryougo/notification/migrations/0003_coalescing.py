@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_recent_actors(apps, schema_editor):
+    Notification = apps.get_model('notification', 'Notification')
+    batch = []
+    for notification in Notification.objects.only('id', 'from_user_id').iterator(chunk_size=2000):
+        notification.recent_actors = [notification.from_user_id]
+        batch.append(notification)
+        if len(batch) == 2000:
+            Notification.objects.bulk_update(batch, ['recent_actors'])
+            batch = []
+    Notification.objects.bulk_update(batch, ['recent_actors'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0012_mediablob'),
+        ('notification', '0002_alter_notification_notification_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='actor_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='recent_actors',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(populate_recent_actors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['to_user', 'notification_type', 'post', '-created_at'], name='notification_group_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_unread_counters(apps, schema_editor):
+    Notification = apps.get_model('notification', 'Notification')
+    UnreadCounter = apps.get_model('notification', 'UnreadCounter')
+    unseen = Notification.objects.filter(is_seen=False).order_by().values('to_user_id').annotate(n=Count('id'))
+    UnreadCounter.objects.bulk_create(
+        [UnreadCounter(user_id=row['to_user_id'], count=row['n']) for row in unseen.iterator()], batch_size=2000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('feed', '0012_mediablob'),
+        ('notification', '0003_coalescing'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='unread_notifications', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(populate_unread_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['to_user', 'is_seen', 'created_at'], name='notification_unseen_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['to_user', '-created_at', '-id'], name='notification_inbox_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:57
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notification', '0004_unread_counter'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='notification',
+            options={},
+        ),
+    ]
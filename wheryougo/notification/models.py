@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Notification(models.Model):
     NOTIFICATION_TYPES = [
@@ -10,16 +11,59 @@ class Notification(models.Model):
         ('favorite', 'Favorite'),
     ]
 
-    to_user = models.ForeignKey(User, related_name='notifications', on_delete=models.CASCADE)
+    # Indexed by the composite indexes below, which all lead with it
+    to_user = models.ForeignKey(User, related_name='notifications', on_delete=models.CASCADE, db_index=False)
+    # The latest actor; coalesced notifications list the others in recent_actors
     from_user = models.ForeignKey(User, related_name='sent_notifications', on_delete=models.CASCADE)
     notification_type = models.CharField(max_length=20, choices=NOTIFICATION_TYPES)
     post = models.ForeignKey('feed.Post', null=True, blank=True, on_delete=models.CASCADE)
     comment = models.ForeignKey('feed.Comment', null=True, blank=True, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     is_seen = models.BooleanField(default=False)
+    actor_count = models.PositiveIntegerField(default=1)
+    recent_actors = models.JSONField(default=list, blank=True)  # user ids, newest first
     
     class Meta:
-        ordering = ['-created_at']
+        # No default ordering: every query orders explicitly, by an index
+        indexes = [
+            models.Index(fields=['to_user', 'notification_type', 'post', '-created_at'], name='notification_group_idx'),
+            # Partial: is_seen=False compiles to NOT is_seen, which a column index cannot seek on
+            models.Index(fields=['to_user', 'created_at'], condition=models.Q(is_seen=False), name='notification_unseen_idx'),
+            models.Index(fields=['to_user', '-created_at', '-id'], name='notification_inbox_idx'),
+        ]
         
+    @property
+    def others_count(self):
+        """Actors besides from_user, as in "Ana and 41 others liked your post" """
+        return self.actor_count - 1
+
+    def __str__(self):
+        return f"{self.from_user.username} {self.notification_type} {self.to_user.username}"
+
+
+class UnreadCounter(models.Model):
+    """Unseen notifications per user, kept by notification.unread"""
+    user = models.OneToOneField(User, primary_key=True, related_name='unread_notifications', on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.count} unread"
+
+
+class NotificationJob(models.Model):
+    """A notification write queued in the request's transaction, applied and deleted by notification.dispatch"""
+    write = models.CharField(max_length=100)  # Dotted path of the notify function to call
+    actor = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    notification_type = models.CharField(max_length=20)
+    items = models.JSONField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)  # Pushed back after a failed attempt
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run_after', 'id'], name='notification_job_due_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.from_user.username} {self.notification_type} {self.to_user.username}"
\ No newline at end of file
+        return f"{self.write} {self.notification_type} by {self.actor_id} ({len(self.items)} items)"
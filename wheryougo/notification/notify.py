@@ -0,0 +1,217 @@
+"""
+Creating and withdrawing notifications.
+
+With NOTIFICATION_COALESCE on, a like, favorite, comment or follow for the
+same (recipient, type, post) as a notification created or updated within the
+last NOTIFICATION_COALESCE_WINDOW seconds is merged into that row instead of
+adding a new one: actor_count goes up, the actor moves to the front of
+recent_actors (the newest RECENT_ACTORS user ids), and the row becomes the
+recipient's newest unseen notification again. A viral post therefore keeps
+one row per recipient while the activity lasts, however many people react.
+
+actor_count counts distinct actors as far as recent_actors can tell: someone
+who reacts again after dropping out of that list is counted twice, unless
+they withdrew in between (an unlike takes them out of the count).
+
+Withdrawing takes the actor out of the newest row that lists them, however
+old it is; with coalescing off it deletes the actor's own rows. An actor the
+open group no longer lists is taken out of its count only. Only an unlike
+withdraws (feed.engagement.RETRACTED): an unfavorite leaves the favorite
+notification in place, and an unfollow is sent as an 'unfollow'
+notification of its own.
+"""
+import datetime
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import BooleanField, Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from .models import Notification
+from .broker import get_broker
+from .serializers import NotificationSerializer
+from . import dispatch, unread
+
+COALESCE = getattr(settings, 'NOTIFICATION_COALESCE', True)
+WINDOW = getattr(settings, 'NOTIFICATION_COALESCE_WINDOW', 6 * 3600)
+RECENT_ACTORS = 3
+COALESCED_TYPES = {'like', 'favorite', 'comment', 'follow'}
+
+
+def coalesces(notification_type):
+    return COALESCE and notification_type in COALESCED_TYPES
+
+
+def _rows(notification_type, keys):
+    """Notifications of this type for (to_user_id, post_id) pairs covering `keys`; filter by key after"""
+    post_ids = {post_id for _, post_id in keys}
+    posts = Q(post_id__in=post_ids - {None})
+    if None in post_ids:
+        posts |= Q(post__isnull=True)
+    return Notification.objects.select_for_update().filter(
+        posts, notification_type=notification_type, to_user_id__in={to_user_id for to_user_id, _ in keys}
+    )
+
+
+def _listing(actor_id):
+    """Rows that name `actor_id` as their latest or one of their recent actors"""
+    if connection.vendor == 'sqlite':
+        # SQLite has no JSON containment lookup
+        listed = Q(RawSQL(
+            'EXISTS (SELECT 1 FROM json_each(recent_actors) WHERE value = %s)', [actor_id],
+            output_field=BooleanField()
+        ))
+    else:
+        listed = Q(recent_actors__contains=[actor_id])
+    return Q(from_user_id=actor_id) | listed
+
+
+def _groups(notification_type, keys, since=None, rows=None):
+    """Latest notification per (to_user_id, post_id) among `keys`"""
+    keys = set(keys)
+    rows = _rows(notification_type, keys) if rows is None else rows
+    if since is not None:
+        rows = rows.filter(created_at__gte=since)
+    groups = {}
+    for row in rows.order_by('created_at'):
+        if (row.to_user_id, row.post_id) in keys:
+            groups[(row.to_user_id, row.post_id)] = row
+    return groups
+
+
+def send(to_user_id, actor, notification_type, post_id=None, comment_id=None):
+    send_many(actor, notification_type, [(to_user_id, post_id, comment_id)])
+
+
+def send_many(actor, notification_type, targets):
+    """
+    Notify each (to_user_id, post_id, comment_id) in `targets` that `actor`
+    did `notification_type`. Self-notifications are dropped. Written in the
+    background unless NOTIFICATION_ASYNC is off (see notification.dispatch).
+    """
+    targets = [tuple(target) for target in targets if target[0] != actor.id]
+    if targets:
+        dispatch.submit(_send_many, actor, notification_type, targets)
+
+
+def _send_many(actor, notification_type, targets):
+    now = timezone.now()
+    with transaction.atomic():
+        groups = {}
+        if coalesces(notification_type):
+            groups = _groups(
+                notification_type, [(to_user_id, post_id) for to_user_id, post_id, _ in targets],
+                since=now - datetime.timedelta(seconds=WINDOW)
+            )
+        merged = {}
+        created = []
+        opened = Counter()
+        for to_user_id, post_id, comment_id in targets:
+            group = groups.get((to_user_id, post_id))
+            if group is None or group.is_seen:
+                opened[to_user_id] += 1
+            if group is None:
+                group = Notification(
+                    to_user_id=to_user_id, from_user=actor, notification_type=notification_type,
+                    post_id=post_id, comment_id=comment_id, recent_actors=[actor.id]
+                )
+                created.append(group)
+                if coalesces(notification_type):
+                    # Repeats of the same target in one batch merge into this row
+                    groups[(to_user_id, post_id)] = group
+                continue
+            if actor.id not in group.recent_actors:
+                group.actor_count += 1
+            group.recent_actors = [actor.id] + [
+                user_id for user_id in group.recent_actors if user_id != actor.id
+            ][:RECENT_ACTORS - 1]
+            group.from_user = actor
+            group.comment_id = comment_id or group.comment_id
+            group.created_at = now
+            group.is_seen = False
+            if group.pk is not None:
+                merged[group.pk] = group
+        merged = list(merged.values())
+        if merged:
+            Notification.objects.bulk_update(
+                merged, ['actor_count', 'recent_actors', 'from_user', 'comment', 'created_at', 'is_seen']
+            )
+        Notification.objects.bulk_create(created)
+        listening = get_broker().listening({row.to_user_id for row in merged + created})
+        if listening:
+            rows = [row for row in merged + created if row.to_user_id in listening]
+            transaction.on_commit(lambda: _push(rows))
+        unread.add(opened)
+
+
+def _push(rows):
+    broker = get_broker()
+    for row, data in zip(rows, NotificationSerializer(attach_actors(rows), many=True).data):
+        broker.publish(row.to_user_id, {'type': 'notification', 'notification': data})
+
+
+def withdraw(to_user_id, actor, notification_type, post_id=None):
+    withdraw_many(actor, notification_type, [(to_user_id, post_id)])
+
+
+def withdraw_many(actor, notification_type, keys):
+    """
+    Take `actor` back out of their notifications for each (to_user_id,
+    post_id), e.g. after an unlike. Rows left without actors are deleted.
+    """
+    keys = [tuple(key) for key in keys if key[0] != actor.id]
+    if keys:
+        dispatch.submit(_withdraw_many, actor, notification_type, keys)
+
+
+def _withdraw_many(actor, notification_type, keys):
+    keys = set(keys)
+    with transaction.atomic():
+        if not coalesces(notification_type):
+            rows = _rows(notification_type, keys).filter(from_user=actor)
+            Notification.objects.filter(pk__in=[
+                pk for pk, to_user_id, post_id in rows.values_list('pk', 'to_user_id', 'post_id')
+                if (to_user_id, post_id) in keys
+            ]).delete()
+            return
+
+        groups = _groups(notification_type, keys, rows=_rows(notification_type, keys).filter(_listing(actor.id)))
+        unlisted = keys - groups.keys()
+        if unlisted:
+            # Someone the open group no longer lists may be one of its hidden actors
+            since = timezone.now() - datetime.timedelta(seconds=WINDOW)
+            for key, group in _groups(notification_type, unlisted, since=since).items():
+                if group.actor_count > len(group.recent_actors):
+                    groups[key] = group
+        emptied = []
+        changed = []
+        for key in keys:
+            group = groups.get(key)
+            if group is None:
+                continue
+            group.recent_actors = [user_id for user_id in group.recent_actors if user_id != actor.id]
+            group.actor_count -= 1
+            if group.actor_count <= 0 or not group.recent_actors:
+                emptied.append(group.pk)
+            else:
+                group.from_user_id = group.recent_actors[0]
+                changed.append(group)
+        if changed:
+            Notification.objects.bulk_update(changed, ['actor_count', 'recent_actors', 'from_user'])
+        if emptied:
+            Notification.objects.filter(pk__in=emptied).delete()
+
+
+def attach_actors(notifications):
+    """Set `actors` (User objects, newest first) on each notification with one query"""
+    notifications = list(notifications)
+    user_ids = {user_id for notification in notifications for user_id in notification.recent_actors}
+    users = User.objects.in_bulk(user_ids) if user_ids else {}
+    for notification in notifications:
+        notification.actors = [users[user_id] for user_id in notification.recent_actors if user_id in users]
+        if not notification.actors:
+            notification.actors = [notification.from_user]
+    return notifications
@@ -0,0 +1,23 @@
+from rest_framework import serializers
+from django.contrib.auth.models import User
+from .models import Notification
+
+class ActorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username']
+
+class NotificationSerializer(serializers.ModelSerializer):
+    actors = serializers.SerializerMethodField()
+    others_count = serializers.ReadOnlyField()
+
+    class Meta:
+        model = Notification
+        fields = [
+            'id', 'notification_type', 'post', 'comment', 'created_at', 'is_seen',
+            'actor_count', 'others_count', 'actors'
+        ]
+
+    def get_actors(self, obj):
+        # Set by notify.attach_actors
+        return ActorSerializer(getattr(obj, 'actors', [obj.from_user]), many=True).data
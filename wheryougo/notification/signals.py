@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Notification
+from . import unread
+
+
+@receiver(post_delete, sender=Notification)
+def release_unread(sender, instance, **kwargs):
+    # Also runs for notifications removed along with their post or comment
+    if not instance.is_seen:
+        unread.add({instance.to_user_id: -1})
@@ -1,3 +1,174 @@
-from django.test import TestCase
+import datetime
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.test import AsyncClient, TestCase
+from django.utils import timezone
+
+from feed.models import Post
+from . import dispatch, notify, unread
+from .models import Notification, NotificationJob
+
+
+@mock.patch('notification.dispatch.ASYNC', False)
+class WithdrawTests(TestCase):
+
+    def setUp(self):
+        self.author, self.a, self.b = (User.objects.create_user(name) for name in ('author', 'a', 'b'))
+        self.post = Post.objects.create(author=self.author, title='Post')
+
+    def like(self, actor):
+        notify.send(self.author.id, actor, 'like', self.post.id)
+
+    def unlike(self, actor):
+        notify.withdraw(self.author.id, actor, 'like', self.post.id)
+
+    def rows(self):
+        return list(Notification.objects.order_by('id').values_list('from_user__username', 'actor_count', 'recent_actors'))
+
+    @mock.patch('notification.notify.COALESCE', False)
+    def test_uncoalesced_withdraw_deletes_the_actors_row(self):
+        self.like(self.a)
+        self.like(self.b)
+        self.unlike(self.a)
+        self.assertEqual(self.rows(), [('b', 1, [self.b.id])])
+
+    @mock.patch('notification.notify.COALESCE', True)
+    def test_coalesced_withdraw_updates_the_group(self):
+        self.like(self.a)
+        self.like(self.b)
+        self.unlike(self.a)
+        self.assertEqual(self.rows(), [('b', 1, [self.b.id])])
+        self.unlike(self.b)
+        self.assertEqual(self.rows(), [])
+
+    @mock.patch('notification.notify.COALESCE', True)
+    def test_coalesced_withdraw_finds_an_older_group(self):
+        self.like(self.a)
+        # Push A's group out of the window so B's like opens a new one
+        Notification.objects.update(created_at=timezone.now() - datetime.timedelta(seconds=notify.WINDOW + 60))
+        self.like(self.b)
+        self.assertEqual(len(self.rows()), 2)
+        self.unlike(self.a)
+        self.assertEqual(self.rows(), [('b', 1, [self.b.id])])
+
+    @mock.patch('notification.notify.COALESCE', True)
+    def test_repeated_target_in_one_batch_merges(self):
+        notify.send_many(self.a, 'like', [(self.author.id, self.post.id, None)] * 2)
+        notify.send_many(self.b, 'like', [(self.author.id, self.post.id, None)])
+        self.assertEqual(self.rows(), [('b', 2, [self.b.id, self.a.id])])
+
+
+@mock.patch('notification.dispatch.ASYNC', True)
+@mock.patch('notification.dispatch._start', lambda: None)
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        self.author, self.a = (User.objects.create_user(name) for name in ('author', 'a'))
+        self.post = Post.objects.create(author=self.author, title='Post')
+
+    def test_jobs_are_kept_until_applied(self):
+        notify.send(self.author.id, self.a, 'like', self.post.id)
+        self.assertEqual(NotificationJob.objects.count(), 1)
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(dispatch.flush(), 1)
+        self.assertFalse(NotificationJob.objects.exists())
+        self.assertEqual(Notification.objects.get().from_user, self.a)
+
+    def test_failed_job_is_retried_later(self):
+        notify.send(self.author.id, self.a, 'like', self.post.id)
+        with mock.patch('notification.notify._send_many', side_effect=RuntimeError), self.assertLogs(dispatch.logger):
+            self.assertEqual(dispatch.flush(), 0)
+        job = NotificationJob.objects.get()
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_after, timezone.now())
+        job.run_after = timezone.now()
+        job.save()
+        self.assertEqual(dispatch.flush(), 1)
+        self.assertTrue(Notification.objects.exists())
+
+
+class StreamTests(TestCase):
+
+    def test_refused_outside_asgi(self):
+        self.client.force_login(User.objects.create_user('reader'))
+        response = self.client.get('/notifications/api/stream/')
+        self.assertEqual(response.status_code, 501)
+        self.assertEqual(response.json()['poll'], '/notifications/api/unread/')
+
+    async def test_served_under_asgi(self):
+        response = await AsyncClient().get('/notifications/api/stream/')
+        # Past the ASGI check; anonymous users are then refused
+        self.assertEqual(response.status_code, 401)
+
+
+@mock.patch('notification.dispatch.ASYNC', False)
+@mock.patch('notification.notify.COALESCE', True)
+class UnreadTests(TestCase):
+
+    def setUp(self):
+        self.author, self.a, self.b = (User.objects.create_user(name) for name in ('author', 'a', 'b'))
+        self.post, self.other = (Post.objects.create(author=self.author, title=title) for title in ('Post', 'Other'))
+
+    def count(self):
+        return unread.count(self.author.id)
+
+    def test_send_counts_new_and_reopened_groups(self):
+        notify.send(self.author.id, self.a, 'like', self.post.id)
+        notify.send(self.author.id, self.a, 'like', self.other.id)
+        self.assertEqual(self.count(), 2)
+        # Merged into the unseen group: still one unread notification
+        notify.send(self.author.id, self.b, 'like', self.post.id)
+        self.assertEqual(self.count(), 2)
+        unread.mark_seen(self.author.id)
+        # Merged into a seen group: it is unread again
+        notify.send(self.author.id, self.a, 'like', self.post.id)
+        self.assertEqual(self.count(), 1)
+        self.assertEqual(unread.recount(), 0)
+
+    def test_self_notifications_are_not_counted(self):
+        notify.send(self.author.id, self.author, 'like', self.post.id)
+        self.assertEqual(self.count(), 0)
+
+    def test_mark_seen_endpoint(self):
+        notify.send(self.author.id, self.a, 'like', self.post.id)
+        notify.send(self.author.id, self.a, 'comment', self.post.id)
+        self.client.force_login(self.author)
+        response = self.client.post('/notifications/api/seen/')
+        self.assertEqual(response.json()['marked'], 2)
+        self.assertEqual(response.json()['unread_count'], 0)
+        self.assertEqual(self.count(), 0)
+        # Nothing left to mark: the counter does not go below zero
+        self.assertEqual(self.client.post('/notifications/api/seen/').json()['unread_count'], 0)
+
+    def test_withdraw_releases_emptied_groups_only(self):
+        notify.send(self.author.id, self.a, 'like', self.post.id)
+        notify.send(self.author.id, self.b, 'like', self.post.id)
+        notify.withdraw(self.author.id, self.a, 'like', self.post.id)
+        self.assertEqual(self.count(), 1)
+        notify.withdraw(self.author.id, self.b, 'like', self.post.id)
+        self.assertEqual(self.count(), 0)
+        self.assertEqual(unread.recount(), 0)
+
+    def test_withdrawing_a_seen_notification_leaves_the_count(self):
+        notify.send(self.author.id, self.a, 'like', self.post.id)
+        notify.send(self.author.id, self.a, 'like', self.other.id)
+        unread.mark_seen(self.author.id, Q(post=self.post))
+        notify.withdraw(self.author.id, self.a, 'like', self.post.id)
+        self.assertEqual(self.count(), 1)
+
+    def test_deleting_notifications_releases_unseen_ones(self):
+        notify.send(self.author.id, self.a, 'like', self.post.id)
+        notify.send(self.author.id, self.a, 'like', self.other.id)
+        notify.send(self.author.id, self.a, 'follow')
+        unread.mark_seen(self.author.id, Q(post=self.other))
+        self.assertEqual(self.count(), 2)
+        # Cascades from the post, then a direct delete
+        self.post.delete()
+        self.assertEqual(self.count(), 1)
+        self.other.delete()
+        self.assertEqual(self.count(), 1)
+        Notification.objects.filter(notification_type='follow').delete()
+        self.assertEqual(self.count(), 0)
+        self.assertEqual(unread.recount(), 0)
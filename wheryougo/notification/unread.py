@@ -0,0 +1,76 @@
+"""
+Denormalized unread notification counts.
+
+UnreadCounter.count is moved by notify (new and re-opened notifications),
+by the post_delete signal (unseen notifications going away) and by
+mark_seen(), so the bell reads one row instead of counting the user's
+history. Connected clients are sent the new count (see notification.broker).
+recount() rebuilds the counters from the notifications.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from .models import Notification, UnreadCounter
+from .broker import get_broker
+
+
+def add(deltas):
+    """Apply {user_id: delta} to the counters, never going below zero"""
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    # Only increments need a row; a missing one already reads as zero
+    UnreadCounter.objects.bulk_create(
+        [UnreadCounter(user_id=user_id) for user_id, delta in deltas.items() if delta > 0], ignore_conflicts=True
+    )
+    by_delta = defaultdict(list)
+    for user_id, delta in deltas.items():
+        by_delta[delta].append(user_id)
+    for delta, user_ids in by_delta.items():
+        UnreadCounter.objects.filter(user_id__in=user_ids).update(count=Greatest(F('count') + delta, 0))
+    listening = get_broker().listening(deltas)
+    if listening:
+        transaction.on_commit(lambda: _push(listening))
+
+
+def _push(user_ids):
+    broker = get_broker()
+    counts = dict(UnreadCounter.objects.filter(user_id__in=user_ids).values_list('user_id', 'count'))
+    for user_id in user_ids:
+        broker.publish(user_id, {'type': 'unread', 'unread_count': counts.get(user_id, 0)})
+
+
+def count(user_id):
+    return UnreadCounter.objects.filter(user_id=user_id).values_list('count', flat=True).first() or 0
+
+
+def mark_seen(user_id, condition=None):
+    """Mark the user's unseen notifications (optionally only those matching `condition`) as seen"""
+    unseen = Notification.objects.filter(to_user_id=user_id, is_seen=False)
+    if condition is not None:
+        unseen = unseen.filter(condition)
+    marked = unseen.update(is_seen=True)
+    add({user_id: -marked})
+    return marked
+
+
+def recount(user_ids=None):
+    """Reset counters from the notifications; returns how many were wrong"""
+    unseen = Notification.objects.filter(is_seen=False)
+    counters = UnreadCounter.objects.all()
+    if user_ids is not None:
+        unseen = unseen.filter(to_user_id__in=user_ids)
+        counters = counters.filter(user_id__in=user_ids)
+    actual = Counter(dict(
+        unseen.order_by().values('to_user_id').annotate(n=Count('id')).values_list('to_user_id', 'n')
+    ))
+    stored = dict(counters.values_list('user_id', 'count'))
+    fixed = 0
+    for user_id in set(actual) | set(stored):
+        if actual[user_id] != stored.get(user_id, 0):
+            UnreadCounter.objects.update_or_create(user_id=user_id, defaults={'count': actual[user_id]})
+            fixed += 1
+    return fixed
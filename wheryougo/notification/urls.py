@@ -4,4 +4,8 @@ from . import views
 urlpatterns = [
     path('show/', views.notification_list, name='notification_list'),
     path('show/all/', views.notification_list_all, name='notification_list_all'),
-]
\ No newline at end of file
+    path('api/', views.api_notifications, name='api_notifications'),
+    path('api/unread/', views.api_unread_count, name='api_unread_count'),
+    path('api/seen/', views.api_mark_seen, name='api_mark_seen'),
+    path('api/stream/', views.notification_stream, name='notification_stream'),
+]
@@ -1,15 +1,151 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.urls import reverse
+from feed.pagination import paginate, encode_cursor, up_to, InvalidCursor
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework import status
 from .models import Notification
+from .notify import attach_actors
+from .serializers import NotificationSerializer
+from .broker import get_broker
+from . import unread
+
+INBOX_PAGE_SIZE = 20
+STREAM_KEEPALIVE = 15  # seconds between comments that keep proxies from closing the stream
+POLL_INTERVAL = 30  # suggested to clients when the stream is unavailable
 
 # Create your views here.
 
 def notification_list(request):
-    notifications = Notification.objects.filter(to_user=request.user).select_related('from_user', 'post', 'comment').order_by('-created_at')[:5]
+    notifications = attach_actors(Notification.objects.filter(to_user=request.user).select_related('from_user', 'post', 'comment').order_by('-created_at')[:5])
 
-    all_notifications = Notification.objects.filter(to_user=request.user)
-    return render(request, 'feed/_notification_list.html', {'notifications': notifications, 'total_notifications': all_notifications.count()})
+    return render(request, 'feed/_notification_list.html', {'notifications': notifications, 'unread_count': unread.count(request.user.id)})
 
 def notification_list_all(request):
-    notifications = Notification.objects.filter(to_user=request.user).select_related('from_user', 'post', 'comment').order_by('-created_at')
+    notifications = Notification.objects.filter(to_user=request.user).select_related('from_user', 'post', 'comment')
+    page, pagination = paginate(notifications, request.GET.get('cursor'), page_size=INBOX_PAGE_SIZE)
+
+    return render(request, 'feed/all_notification_list.html', {
+        'notifications': attach_actors(page),
+        'pagination': pagination,
+        'unread_count': unread.count(request.user.id)
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def api_notifications(request):
+    """
+    One page of the user's notifications, newest first. ?unseen=1 lists
+    only unseen ones. `seen_cursor` marks this page's newest notification;
+    pass it to the mark-seen endpoint to clear everything up to it.
+    """
+    try:
+        notifications = Notification.objects.filter(to_user=request.user).select_related('from_user')
+        if request.GET.get('unseen', '').lower() in ('1', 'true', 'yes'):
+            notifications = notifications.filter(is_seen=False)
+        page, pagination = paginate(notifications, request.GET.get('cursor'), page_size=INBOX_PAGE_SIZE)
+
+        return Response({
+            'notifications': NotificationSerializer(attach_actors(page), many=True).data,
+            'pagination': pagination,
+            'seen_cursor': encode_cursor([page[0].created_at, page[0].id]) if page else None,
+            'unread_count': unread.count(request.user.id)
+        })
+
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def api_unread_count(request):
+    """
+    Number of unseen notifications, for the bell icon
+    """
+    return Response({'unread_count': unread.count(request.user.id)})
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def api_mark_seen(request):
+    """
+    Mark notifications seen: those up to and including `cursor` (a
+    seen_cursor from the inbox), or all of them without one
+    """
+    try:
+        cursor = request.data.get('cursor')
+        condition = up_to(cursor, Notification) if cursor else None
+        marked = unread.mark_seen(request.user.id, condition)
+
+        return Response({
+            'success': True,
+            'marked': marked,
+            'unread_count': unread.count(request.user.id)
+        })
+
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def notification_stream(request):
+    """
+    Server-Sent Events for the signed-in user: an `unread` event with the
+    current count on connect, then `notification` and `unread` events as
+    they happen. Replaces polling the notification list.
+
+    Only served under ASGI (wheryougo.asgi). Under WSGI, e.g. runserver,
+    the endless response would hold a worker thread per client, so it
+    answers 501 with the unread count endpoint to poll instead.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({
+            'error': 'The notification stream needs the ASGI server',
+            'poll': reverse('api_unread_count'),
+            'poll_interval': POLL_INTERVAL,
+        }, status=501)
+
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    broker = get_broker()
+    queue = broker.subscribe(user.id)
+    count = await sync_to_async(unread.count)(user.id)
+
+    async def events():
+        try:
+            yield _sse({'type': 'unread', 'unread_count': count})
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield _sse(event)
+        finally:
+            broker.unsubscribe(user.id, queue)
 
-    return render(request, 'feed/all_notification_list.html', {'notifications': notifications, 'total_notifications': notifications.count()})
\ No newline at end of file
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -6,8 +6,8 @@ from django.contrib import messages
 from django.core.paginator import Paginator
 from manage.models import UserProfile
 from feed.models import Post, Follow, Favorite
-from django.db.models import Count, Q
-from notification.models import Notification
+from django.db.models import Count, F, Q
+from notification import notify
 
 def profile(request, username=None):
     """Profile view that shows user's profile and posts"""
@@ -51,9 +51,9 @@ def profile(request, username=None):
         posts = posts.filter(is_private=False)
         
     posts = posts.annotate(
-    like_count=Count('likes', distinct=True),
-    comment_count=Count('comments', distinct=True)
-    )
+    like_count=F('likes_count'),
+    comment_count=F('comments_count')
+    ).order_by('-created_at')
     # Pagination for posts
     paginator = Paginator(posts, 12)
     page_number = request.GET.get('page')
@@ -154,21 +154,13 @@ def follow_user(request, username):
                 follow.delete()
                 following = False
                 action = 'unfollowed'
-                Notification.objects.create(
-                    to_user=user_to_follow,
-                    from_user=request.user,
-                    notification_type='unfollow',
-                )
+                notify.send(user_to_follow.id, request.user, 'unfollow')
             
             else:
                 # Follow
                 following = True
                 action = 'followed'
-                Notification.objects.create(
-                    to_user=user_to_follow,
-                    from_user=request.user,
-                    notification_type='follow',
-                )
+                notify.send(user_to_follow.id, request.user, 'follow')
             
             # Get updated counts
             followers_count = Follow.objects.filter(following=user_to_follow).count()
@@ -5,7 +5,7 @@ from django.contrib.auth.models import User
 class Trip(models.Model):
     name = models.CharField(max_length=50, help_text="Name of the trip, e.g., Bali Trip")
     description = models.TextField(blank=True, help_text="Optional description of the trip")
-    created_by = models.ForeignKey(User, default=False,on_delete=models.CASCADE, related_name='created_trips', help_text="User who created the trip")
+    created_by = models.ForeignKey(User, default=False,on_delete=models.CASCADE, related_name='created_trips', db_index=False, help_text="User who created the trip")
     created_at = models.DateTimeField(auto_now_add=True, help_text="Date and time when the trip was created")
     start_date = models.DateField(help_text="Start date of the trip")
     end_date = models.DateField(help_text="End date of the trip")
@@ -17,6 +17,7 @@ class Trip(models.Model):
         ('completed', 'Completed'),
     ], default='planned', help_text="Current status of the trip")
     image = models.ImageField(upload_to='trips/', null=True, blank=True, help_text="Optional image for the trip")
+    image_variants = models.JSONField(default=dict, blank=True, editable=False, help_text="Resized copies of the trip image")
     
     def __str__(self):
         return f"{self.name} by {self.created_by.username}"
@@ -34,4 +35,7 @@ class Trip(models.Model):
         return (self.end_date - self.start_date).days + 1
     
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_by', '-created_at'], name='trip_created_by_recent'),
+        ]
\ No newline at end of file
@@ -0,0 +1,23 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from feed import blobs, derivatives
+
+from .models import Trip
+
+
+@receiver(pre_save, sender=Trip)
+def remember_image(sender, instance, update_fields=None, **kwargs):
+    blobs.remember(instance, update_fields)
+
+
+@receiver(post_save, sender=Trip)
+def trip_saved(sender, instance, **kwargs):
+    """Count the image's blob reference and resize it"""
+    blobs.saved(instance)
+    derivatives.schedule(instance)
+
+
+@receiver(post_delete, sender=Trip)
+def release_image(sender, instance, **kwargs):
+    blobs.deleted(instance)
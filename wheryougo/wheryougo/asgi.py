@@ -3,6 +3,15 @@ ASGI config for wheryougo project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the project through this entry point (e.g. with uvicorn or daphne)
+for the notification stream at /notifications/api/stream/, which holds a
+connection open per client without tying up a worker thread:
+
+    uvicorn wheryougo.asgi:application
+
+Under WSGI (runserver, gunicorn) the stream answers 501 and clients poll
+/notifications/api/unread/ instead.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -0,0 +1,118 @@
+"""
+Per-request SQL instrumentation.
+
+For a sampled share of requests (SQL_INSTRUMENTATION_SAMPLE_RATE), every
+statement run on any database is timed through a connection execute
+wrapper. The response gets a Server-Timing header with the query count and
+SQL time, and one JSON line is logged to the `wheryougo.sql` logger with the
+slowest statement and the statements repeated within the request. A
+statement whose fingerprint (the SQL with literals and IN lists collapsed)
+runs more than SQL_N_PLUS_ONE_THRESHOLD times is flagged as a likely N+1
+and logged as a warning.
+
+Requests that are not sampled only pay for one random() call.
+"""
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+SAMPLE_RATE = getattr(settings, 'SQL_INSTRUMENTATION_SAMPLE_RATE', 0.0)
+N_PLUS_ONE_THRESHOLD = getattr(settings, 'SQL_N_PLUS_ONE_THRESHOLD', 5)
+REPORTED_DUPLICATES = 5
+SQL_PREVIEW = 300
+
+logger = logging.getLogger('wheryougo.sql')
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\bIN \((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Normalized statement and a short hash of it, equal for runs that differ only in values"""
+    normalized = _SPACE.sub(' ', _IN_LISTS.sub('IN (...)', _LITERALS.sub('?', sql))).strip()
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12], normalized
+
+
+class QueryRecorder:
+    """Execute wrapper collecting the statements of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = (0.0, '')
+        self.fingerprints = defaultdict(int)
+        self.samples = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            if elapsed > self.slowest[0]:
+                self.slowest = (elapsed, sql)
+            key, normalized = fingerprint(sql)
+            self.fingerprints[key] += 1
+            self.samples.setdefault(key, normalized)
+
+    def duplicates(self):
+        repeated = sorted(
+            ((n, key) for key, n in self.fingerprints.items() if n > 1), reverse=True
+        )[:REPORTED_DUPLICATES]
+        return [
+            {'fingerprint': key, 'count': n, 'sql': self.samples[key][:SQL_PREVIEW]}
+            for n, key in repeated
+        ]
+
+
+class SQLInstrumentationMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if SAMPLE_RATE <= 0 or random.random() >= SAMPLE_RATE:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in settings.DATABASES:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        duplicates = recorder.duplicates()
+        n_plus_one = [d for d in duplicates if d['count'] > N_PLUS_ONE_THRESHOLD]
+        response['Server-Timing'] = (
+            f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries", '
+            f'app;dur={total * 1000:.1f}'
+        )
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': getattr(request.resolver_match, 'view_name', None),
+            'status': response.status_code,
+            'queries': recorder.count,
+            'sql_ms': round(recorder.duration * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+            'slowest': {
+                'ms': round(recorder.slowest[0] * 1000, 2),
+                'sql': recorder.slowest[1][:SQL_PREVIEW],
+            },
+            'duplicates': duplicates,
+            'n_plus_one': bool(n_plus_one),
+        }
+        logger.log(logging.WARNING if n_plus_one else logging.INFO, json.dumps(record))
+        return response
@@ -0,0 +1,342 @@
+"""
+Prometheus metrics, aggregated across worker processes.
+
+With METRICS_ENABLED on, MetricsMiddleware records per-view request latency
+histograms and status codes (labelled with the URL name, e.g. api_feed),
+requests in flight and database query counts and time. feed.response_cache,
+feed.fragments, feed.suggestions and feed.autocomplete report cache hits and
+misses, and feed.uploads reports the image bytes received.
+
+Each process keeps its numbers in memory and writes them to its own JSON file
+in METRICS_DIR at most every METRICS_FLUSH_INTERVAL seconds (and on exit).
+GET /metrics sums the files of every process in the text exposition format,
+so any worker can answer the scrape. Counters and histograms of exited
+processes are folded into one file so totals never go down; their gauges are
+dropped. Set METRICS_TOKEN to require `Authorization: Bearer <token>`.
+
+With METRICS_ENABLED off the middleware removes itself, /metrics is not
+routed and the record functions return immediately.
+"""
+import atexit
+import glob
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+try:
+    import fcntl
+except ImportError:  # Windows: exited processes' files are kept as they are
+    fcntl = None
+
+ENABLED = getattr(settings, 'METRICS_ENABLED', False)
+METRICS_DIR = getattr(settings, 'METRICS_DIR', os.path.join(settings.BASE_DIR, 'metrics'))
+FLUSH_INTERVAL = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+TOKEN = getattr(settings, 'METRICS_TOKEN', '')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = 'wheryougo_'
+EXITED_FILE = 'exited.json'
+
+HELP = {
+    'http_requests_total': ('counter', 'Requests by URL name, method and status code'),
+    'http_request_duration_seconds': ('histogram', 'Request latency by URL name'),
+    'http_requests_in_flight': ('gauge', 'Requests being handled'),
+    'db_queries_total': ('counter', 'SQL statements run while handling requests, by URL name'),
+    'db_query_duration_seconds_total': ('counter', 'Time spent in SQL while handling requests, by URL name'),
+    'cache_requests_total': ('counter', 'Cache lookups by cache and result'),
+    'upload_bytes_total': ('counter', 'Image upload bytes received, by upload kind'),
+}
+
+
+class Store:
+    """This process's metrics; series are keyed by (name, sorted label pairs)"""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.path = os.path.join(METRICS_DIR, f'{self.pid}-{uuid.uuid4().hex[:8]}.json')
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.gauges = defaultdict(float)
+        self.histograms = {}
+        self.flushed_at = 0.0
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.counters[name, labels] += value
+
+    def add(self, name, labels, value):
+        with self.lock:
+            self.gauges[name, labels] += value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[name, labels] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def state(self):
+        with self.lock:
+            return {
+                'pid': self.pid,
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'gauges': [[name, labels, value] for (name, labels), value in self.gauges.items()],
+                'histograms': [[name, labels, dict(h, buckets=list(h['buckets']))]
+                               for (name, labels), h in self.histograms.items()],
+            }
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.flushed_at < FLUSH_INTERVAL:
+            return
+        self.flushed_at = now
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        _write_state(self.path, self.state())
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _get_store():
+    """The store of the current process; a forked worker starts its own"""
+    global _store
+    if _store is None or _store.pid != os.getpid():
+        with _store_lock:
+            if _store is None or _store.pid != os.getpid():
+                _store = Store()
+    return _store
+
+
+def _labels(**labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def record_cache(cache_name, hits=0, misses=0):
+    """Count lookups in one of the project's caches"""
+    if not ENABLED:
+        return
+    store = _get_store()
+    if hits:
+        store.inc('cache_requests_total', _labels(cache=cache_name, result='hit'), hits)
+    if misses:
+        store.inc('cache_requests_total', _labels(cache=cache_name, result='miss'), misses)
+
+
+def record_upload(kind, size):
+    if ENABLED and size > 0:
+        _get_store().inc('upload_bytes_total', _labels(kind=kind), size)
+
+
+class _QueryCounter:
+    """Execute wrapper adding up the statements of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+
+    def __init__(self, get_response):
+        if not ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        store = _get_store()
+        store.add('http_requests_in_flight', (), 1)
+        queries = _QueryCounter()
+        start = time.perf_counter()
+        status = 500
+        try:
+            with ExitStack() as stack:
+                for alias in settings.DATABASES:
+                    stack.enter_context(connections[alias].execute_wrapper(queries))
+                response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - start
+            match = request.resolver_match
+            view = (match.url_name or match.view_name) if match else 'unmatched'
+            store.add('http_requests_in_flight', (), -1)
+            store.inc('http_requests_total', _labels(view=view, method=request.method, status=status))
+            store.observe('http_request_duration_seconds', _labels(view=view), elapsed)
+            if queries.count:
+                store.inc('db_queries_total', _labels(view=view), queries.count)
+                store.inc('db_query_duration_seconds_total', _labels(view=view), queries.duration)
+            store.flush()
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(total, state, gauges=True):
+    for name, labels, value in state['counters']:
+        total['counters'][name, tuple(map(tuple, labels))] += value
+    if gauges:
+        for name, labels, value in state['gauges']:
+            total['gauges'][name, tuple(map(tuple, labels))] += value
+    for name, labels, histogram in state['histograms']:
+        merged = total['histograms'].setdefault(
+            (name, tuple(map(tuple, labels))), {'buckets': [0] * len(histogram['buckets']), 'sum': 0.0, 'count': 0}
+        )
+        merged['buckets'] = [a + b for a, b in zip(merged['buckets'], histogram['buckets'])]
+        merged['sum'] += histogram['sum']
+        merged['count'] += histogram['count']
+
+
+def _empty():
+    return {'counters': defaultdict(float), 'gauges': defaultdict(float), 'histograms': {}}
+
+
+def _read(path):
+    try:
+        with open(path) as metrics_file:
+            return json.load(metrics_file)
+    except (OSError, ValueError):
+        # Removed by another scrape, or a process writing it right now
+        return None
+
+
+@contextmanager
+def _directory_lock():
+    """Keeps scrapes from reading while another one folds exited processes"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(METRICS_DIR, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _write_state(path, state):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as metrics_file:
+        json.dump(state, metrics_file)
+    os.replace(temporary, path)
+
+
+def _fold_exited(paths):
+    """Merge the files of exited processes into EXITED_FILE and delete them"""
+    exited_path = os.path.join(METRICS_DIR, EXITED_FILE)
+    total = _empty()
+    for path in [exited_path, *paths]:
+        state = _read(path)
+        if state is not None:
+            _merge(total, state, gauges=False)
+    _write_state(exited_path, {
+        'pid': None,
+        'counters': [[name, labels, value] for (name, labels), value in total['counters'].items()],
+        'gauges': [],
+        'histograms': [[name, labels, h] for (name, labels), h in total['histograms'].items()],
+    })
+    for path in paths:
+        os.remove(path)
+
+
+def collect():
+    """Every process's metrics summed into one state"""
+    _get_store().flush(force=True)
+    exited_path = os.path.join(METRICS_DIR, EXITED_FILE)
+    total = _empty()
+    with _directory_lock():
+        paths = [path for path in glob.glob(os.path.join(METRICS_DIR, '*.json')) if path != exited_path]
+        if fcntl is not None:
+            exited = [path for path in paths if not _is_alive(_pid(path))]
+            if exited:
+                _fold_exited(exited)
+                paths = [path for path in paths if path not in exited]
+        for path in [exited_path, *paths]:
+            state = _read(path)
+            if state is not None:
+                _merge(total, state)
+    return total
+
+
+def _pid(path):
+    pid = os.path.basename(path).split('-')[0]
+    return int(pid) if pid.isdigit() else os.getpid()
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def render(total):
+    """Text exposition format"""
+    series = defaultdict(list)
+    for kind in ('counters', 'gauges'):
+        for (name, labels), value in sorted(total[kind].items()):
+            series[name].append(f'{PREFIX}{name}{_format_labels(labels)} {_format_value(value)}')
+    for (name, labels), histogram in sorted(total['histograms'].items(), key=lambda item: item[0]):
+        bounds = [*LATENCY_BUCKETS, math.inf]
+        for bound, count in zip(bounds, [*histogram['buckets'], histogram['count']]):
+            bucket_labels = _format_labels((*labels, ('le', _format_value(bound))))
+            series[name].append(f'{PREFIX}{name}_bucket{bucket_labels} {count}')
+        series[name].append(f'{PREFIX}{name}_sum{_format_labels(labels)} {_format_value(histogram["sum"])}')
+        series[name].append(f'{PREFIX}{name}_count{_format_labels(labels)} {histogram["count"]}')
+
+    lines = []
+    for name in sorted(series):
+        kind, description = HELP.get(name, ('untyped', name))
+        lines.append(f'# HELP {PREFIX}{name} {description}')
+        lines.append(f'# TYPE {PREFIX}{name} {kind}')
+        lines.extend(series[name])
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    if TOKEN and request.headers.get('Authorization') != f'Bearer {TOKEN}':
+        return HttpResponseForbidden()
+    return HttpResponse(render(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@atexit.register
+def _shutdown():
+    if ENABLED and _store is not None and _store.pid == os.getpid():
+        try:
+            _store.flush(force=True)
+        except OSError:
+            pass
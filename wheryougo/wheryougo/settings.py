@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -27,6 +28,9 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
+# Running under `manage.py test`: background workers are switched off below
+TESTING = sys.argv[1:2] == ['test']
+
 
 # Application definition
 
@@ -48,6 +52,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'wheryougo.metrics.MetricsMiddleware',
+    'wheryougo.instrumentation.SQLInstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -89,6 +95,102 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# CACHE_BACKEND=locmem|file|memcached|redis. locmem is per process, so
+# multi-worker deployments should use one of the shared backends.
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+CACHE_LOCATIONS = {
+    'locmem': 'wheryougo',
+    'file': str(BASE_DIR / 'cache'),
+    'memcached': '127.0.0.1:11211',
+    'redis': 'redis://127.0.0.1:6379/1',
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.environ.get('CACHE_LOCATION', CACHE_LOCATIONS[CACHE_BACKEND]),
+    }
+}
+
+# Seconds an anonymous feed, post or search response may be served from cache.
+# Post and comment changes invalidate it sooner; like counts may lag by this much.
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 30))
+
+# Resized variants of uploaded images are generated after each save by a pool
+# of IMAGE_DERIVATIVE_WORKERS processes. IMAGE_DERIVATIVES_ASYNC=0 generates
+# them in the saving thread instead, as the test runner always does.
+IMAGE_DERIVATIVES_ASYNC = os.environ.get('IMAGE_DERIVATIVES_ASYNC', '1') == '1' and not TESTING
+IMAGE_DERIVATIVE_WORKERS = int(os.environ.get('IMAGE_DERIVATIVE_WORKERS', 2))
+
+# Likes, favorites, comments and follows for the same recipient and post that
+# arrive within this many seconds of each other share one notification row.
+# Set NOTIFICATION_COALESCE=0 to store one row per event.
+NOTIFICATION_COALESCE = os.environ.get('NOTIFICATION_COALESCE', '1') == '1'
+NOTIFICATION_COALESCE_WINDOW = int(os.environ.get('NOTIFICATION_COALESCE_WINDOW', 6 * 3600))
+
+# Notifications are queued as NotificationJob rows in the request's
+# transaction and written by a background thread in batches, flushed every
+# NOTIFICATION_FLUSH_INTERVAL seconds or NOTIFICATION_BATCH_SIZE jobs. Jobs
+# left over by a stopped process are picked up by the next worker, or by
+# `manage.py process_notification_jobs`. NOTIFICATION_ASYNC=0 (and the test
+# runner) writes them inside the request instead.
+NOTIFICATION_ASYNC = os.environ.get('NOTIFICATION_ASYNC', '1') == '1' and not TESTING
+NOTIFICATION_FLUSH_INTERVAL = float(os.environ.get('NOTIFICATION_FLUSH_INTERVAL', 0.2))
+NOTIFICATION_BATCH_SIZE = int(os.environ.get('NOTIFICATION_BATCH_SIZE', 500))
+
+# Pushes notification events to /notifications/api/stream/ clients. The
+# in-process broker only reaches clients connected to the same process, so
+# run a single ASGI worker or plug in a shared broker.
+NOTIFICATION_BROKER = os.environ.get('NOTIFICATION_BROKER', 'notification.broker.InProcessBroker')
+
+# Days seen notifications are kept before archive_notifications moves them
+# to gzipped JSONL files in NOTIFICATION_ARCHIVE_DIR. Unseen ones are kept.
+NOTIFICATION_RETENTION = {
+    'default': 90,
+    'like': 30,
+    'favorite': 30,
+    'unfollow': 7,
+    'comment': 180,
+}
+NOTIFICATION_ARCHIVE_DIR = os.environ.get('NOTIFICATION_ARCHIVE_DIR', str(BASE_DIR / 'archive' / 'notifications'))
+
+
+# Share of requests (0-1) whose SQL is timed and logged to the wheryougo.sql
+# logger with a Server-Timing header; statements repeated more than
+# SQL_N_PLUS_ONE_THRESHOLD times in one request are flagged as N+1.
+SQL_INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('SQL_INSTRUMENTATION_SAMPLE_RATE', 1.0 if DEBUG else 0.01))
+SQL_N_PLUS_ONE_THRESHOLD = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+
+# METRICS_ENABLED=1 serves Prometheus metrics at /metrics. Every worker process
+# writes its own file to METRICS_DIR (shared by all workers on the host) every
+# METRICS_FLUSH_INTERVAL seconds; a scrape sums them. Set METRICS_TOKEN to
+# require it as a bearer token.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+METRICS_DIR = os.environ.get('METRICS_DIR', str(BASE_DIR / 'metrics'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'wheryougo.sql': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -134,6 +236,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploads are stored once per distinct content under media/blobs/
+STORAGES = {
+    'default': {
+        'BACKEND': 'feed.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 LOGIN_URL = 'signin'
 LOGIN_REDIRECT_URL = 'feed'
 LOGOUT_REDIRECT_URL = 'home'
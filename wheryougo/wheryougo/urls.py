@@ -20,6 +20,8 @@ from django.urls import include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from wheryougo import metrics
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -30,3 +32,6 @@ urlpatterns = [
     path('notifications/', include('notification.urls')),
     path('trip/', include('trip.urls'))
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+if settings.METRICS_ENABLED:
+    urlpatterns.append(path('metrics', metrics.metrics_view, name='metrics'))